@@ -0,0 +1,155 @@
+import asyncio
+import contextlib
+import logging
+from collections import defaultdict, deque
+
+import chess
+import chess.engine
+
+from enginepool import EnginePool
+from metrics import timed
+
+log = logging.getLogger(__name__)
+
+SEARCH_STATS = {"searches": 0, "nodes": 0}
+
+
+@timed("engine_search")
+async def search_position(engine, board: chess.Board, depth: int, multipv: int = 1) -> list[dict]:
+    infos = await engine.analyse(
+        board,
+        limit=chess.engine.Limit(depth=depth),
+        multipv=multipv,
+        info=chess.engine.INFO_BASIC | chess.engine.INFO_SCORE | chess.engine.INFO_PV
+    )
+    SEARCH_STATS["searches"] += 1
+    SEARCH_STATS["nodes"] += max((info.get("nodes", 0) for info in infos), default=0)
+    lines = []
+    for info in infos:
+        if "score" not in info:
+            continue
+        pv = info.get("pv") or []
+        lines.append({
+            "move": pv[0] if pv else None,
+            "score": info["score"].pov(board.turn).score(mate_score=100000),
+            "pv": pv,
+        })
+    return lines
+
+
+class AnalysisFarm:
+    # Очередь позиций на всю машину: по одному воркеру на движок пула,
+    # задания разных владельцев (chat_id) выбираются по кругу
+    def __init__(self, pool: EnginePool, workers: int):
+        self.pool = pool
+        self.workers = workers
+        self._queues: dict[object, deque] = {}
+        self._ready: deque = deque()
+        self._available = asyncio.Semaphore(0)
+        self._pending = 0
+        self._running = 0
+        self._tasks: dict[object, set[asyncio.Task]] = defaultdict(set)
+        self._workers: list[asyncio.Task] = []
+
+    def start(self):
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def close(self):
+        for task in self._workers:
+            task.cancel()
+        for task in self._workers:
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+        self._workers = []
+        for queue in self._queues.values():
+            for *_, fut in queue:
+                fut.cancel()
+        self._queues.clear()
+        self._ready.clear()
+        self._pending = 0
+
+    async def analyse(
+        self,
+        owner,
+        board: chess.Board,
+        depth: int,
+        multipv: int = 1,
+        urgent: bool = False
+    ) -> list[dict]:
+        self.start()
+        fut = asyncio.get_running_loop().create_future()
+        job = (board, depth, multipv, fut)
+
+        queue = self._queues.get(owner)
+        if queue is None:
+            queue = self._queues[owner] = deque()
+            self._ready.append(owner)
+        if urgent:
+            queue.appendleft(job)
+        else:
+            queue.append(job)
+        self._pending += 1
+        self._available.release()
+        return await fut
+
+    def submit(self, owner, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self._tasks[owner].add(task)
+
+        def _done(t: asyncio.Task):
+            tasks = self._tasks.get(owner)
+            if tasks is not None:
+                tasks.discard(t)
+                if not tasks:
+                    del self._tasks[owner]
+
+        task.add_done_callback(_done)
+        return task
+
+    def queue_depth(self) -> dict[str, int]:
+        return {
+            "pending": self._pending,
+            "running": self._running,
+            "owners": len(self._queues),
+            "tasks": sum(len(t) for t in self._tasks.values()),
+        }
+
+    def owner_depth(self, owner) -> int:
+        queue = self._queues.get(owner)
+        return len(queue) if queue else 0
+
+    def _next_job(self):
+        owner = self._ready.popleft()
+        queue = self._queues[owner]
+        job = queue.popleft()
+        if queue:
+            self._ready.append(owner)
+        else:
+            del self._queues[owner]
+        self._pending -= 1
+        return job
+
+    async def _worker(self):
+        while True:
+            await self._available.acquire()
+            board, depth, multipv, fut = self._next_job()
+            if fut.done():
+                continue
+            self._running += 1
+            try:
+                async with self.pool.engine() as engine:
+                    lines = await search_position(engine, board, depth, multipv)
+            except asyncio.CancelledError:
+                if not fut.done():
+                    fut.cancel()
+                raise
+            except Exception as e:
+                log.warning("Ошибка анализа позиции: %r", e)
+                if not fut.done():
+                    fut.set_exception(e)
+            else:
+                if not fut.done():
+                    fut.set_result(lines)
+            finally:
+                self._running -= 1
@@ -0,0 +1,64 @@
+import hashlib
+import mmap
+import os
+import tempfile
+import time
+
+ASSET_DIR = "gifstore"
+
+
+def _asset_path(digest: str) -> str:
+    return os.path.join(ASSET_DIR, digest[:2], digest + ".gif")
+
+def put_asset(data: bytes) -> str:
+    digest = hashlib.sha256(data).hexdigest()
+    path = _asset_path(digest)
+    if os.path.exists(path):
+        # одинаковая анимация уже лежит — только продлеваем ей жизнь для GC
+        os.utime(path)
+        return digest
+
+    folder = os.path.dirname(path)
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=folder, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return digest
+
+def read_asset(digest: str | None, use_mmap: bool = False) -> bytes | None:
+    if not digest:
+        return None
+    try:
+        with open(_asset_path(digest), "rb") as f:
+            if not use_mmap:
+                return f.read()
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                return m[:]
+    except (FileNotFoundError, ValueError):
+        return None
+
+def collect_garbage(live: set[str], grace_seconds: float = 3600) -> int:
+    # grace: свежие файлы могут ещё ждать записи своего хеша в БД
+    if not os.path.isdir(ASSET_DIR):
+        return 0
+    cutoff = time.time() - grace_seconds
+    removed = 0
+    for folder, _, files in os.walk(ASSET_DIR):
+        for name in files:
+            path = os.path.join(folder, name)
+            digest, ext = os.path.splitext(name)
+            if ext == ".gif" and digest in live:
+                continue
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except FileNotFoundError:
+                continue
+    return removed
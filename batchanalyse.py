@@ -0,0 +1,211 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import connection
+from connection import (
+    enqueue_job,
+    existing_game_keys,
+    get_user_nicks,
+    init_db,
+    make_game_key,
+    pgn_headers,
+    replay_plies,
+    run_db,
+    save_analysed_game,
+    upsert_user,
+    user_color_in_game,
+)
+from loadgames import iter_pgn_texts
+from stockfishanalyse import ANALYSIS_WORKERS, close_engine_pool, findmove, geteval
+
+BATCH_OWNER = "batch"
+REPORT_EVERY = 50
+# партий в работе одновременно: чтобы у каждого движка фермы всегда была очередь
+IN_FLIGHT_PER_WORKER = 2
+
+
+class _Progress:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.games = 0
+        self.positions = 0
+        self.blunders = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def report(self, final: bool = False):
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        print(
+            f"{'Итого' if final else 'Прогресс'}: партий {self.games} "
+            f"({self.games / elapsed:.2f}/с), позиций {self.positions} "
+            f"({self.positions / elapsed:.1f}/с), ошибок {self.blunders}, "
+            f"пропущено {self.skipped}, сбоев {self.failed}, {elapsed:.0f} с",
+            flush=True,
+        )
+
+async def _analyse(pgn: str, use_cache: bool, side: str | None = None) -> tuple[dict[int, dict], int]:
+    evals = await geteval(pgn, use_cache=use_cache, owner=BATCH_OWNER, side=side)
+    bad_idxs = await asyncio.to_thread(findmove, evals)
+    return replay_plies(pgn, bad_idxs), len(evals)
+
+async def _to_db(pgn: str, chat_id: int, source: str, color: str, progress: _Progress):
+    plies, positions = await _analyse(pgn, use_cache=True, side=color)
+    saved = await run_db(save_analysed_game, chat_id, source, pgn, plies)
+    progress.positions += positions
+    if saved is None:
+        progress.skipped += 1
+        return
+    game_id, color, bls = saved
+    # лучший ход и продолжение досчитает очередь заданий бота
+    for b in bls:
+        await run_db(
+            enqueue_job, "engine_line",
+            json.dumps({
+                "chat_id": chat_id,
+                "game_id": game_id,
+                "move_index": b["move_index"],
+                "fen": b["fen"],
+                "played_uci": b["played_uci"],
+                "user_color": color,
+            }),
+            f"{game_id}:{b['move_index']}",
+        )
+    progress.blunders += len(bls)
+
+async def _to_jsonl(index: int, pgn: str, out, progress: _Progress):
+    plies, positions = await _analyse(pgn, use_cache=False)
+    headers = pgn_headers(pgn)
+    record = {
+        "index": index,
+        "site": headers.get("Site", ""),
+        "white": headers.get("White", ""),
+        "black": headers.get("Black", ""),
+        "positions": positions,
+        "blunders": [{"move_index": idx, **ply} for idx, ply in sorted(plies.items())],
+    }
+    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+    out.flush()
+    progress.positions += positions
+    progress.blunders += len(plies)
+
+def _resume_jsonl(path: str) -> set[int]:
+    # продолжение после обрыва: уже записанные партии повторно не считаем.
+    # Строку, оборванную падением посреди записи, убираем, иначе следующая
+    # запись приклеится к ней и испортит обе
+    done = set()
+    if not os.path.exists(path):
+        return done
+    kept = []
+    broken = 0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                if not line.endswith("\n"):
+                    raise ValueError("оборванная строка")
+                done.add(json.loads(line)["index"])
+            except (ValueError, KeyError, TypeError):
+                broken += 1
+                continue
+            kept.append(line)
+    if broken:
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.writelines(kept)
+        os.replace(tmp, path)
+        print(f"Удалено повреждённых строк в {path}: {broken}", flush=True)
+    return done
+
+async def batch_analyse(
+    path: str,
+    chat_id: int | None = None,
+    source: str = "lichess",
+    jsonl: str | None = None,
+    limit: int | None = None
+):
+    progress = _Progress()
+    done = _resume_jsonl(jsonl) if jsonl else set()
+    out = open(jsonl, "a", encoding="utf-8") if jsonl else None
+    sem = asyncio.Semaphore(ANALYSIS_WORKERS * IN_FLIGHT_PER_WORKER)
+    tasks: set[asyncio.Task] = set()
+    nick = None
+    if out is None:
+        lichess_nick, chesscom_nick = await run_db(get_user_nicks, chat_id)
+        nick = lichess_nick if source == "lichess" else chesscom_nick
+
+    async def run(index: int, pgn: str, color: str):
+        try:
+            if out is not None:
+                await _to_jsonl(index, pgn, out, progress)
+            else:
+                await _to_db(pgn, chat_id, source, color, progress)
+        except Exception as e:
+            progress.failed += 1
+            print(f"Партия #{index}: {e!r}", flush=True)
+        else:
+            progress.games += 1
+            if progress.games % REPORT_EVERY == 0:
+                progress.report()
+        finally:
+            sem.release()
+
+    try:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            for index, pgn in enumerate(iter_pgn_texts(f)):
+                if limit is not None and index >= limit:
+                    break
+                if index in done:
+                    progress.skipped += 1
+                    continue
+                color = ""
+                if out is None:
+                    # в партиях без ника пользователя его ошибок нет — движок на них не тратим
+                    color = user_color_in_game(pgn, nick)
+                    if not color:
+                        progress.skipped += 1
+                        continue
+                    if await run_db(existing_game_keys, chat_id, [make_game_key(source, pgn)]):
+                        progress.skipped += 1
+                        continue
+                await sem.acquire()
+                task = asyncio.create_task(run(index, pgn, color))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+    finally:
+        if out is not None:
+            out.close()
+        await close_engine_pool()
+    progress.report(final=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетный анализ PGN-файла без Telegram")
+    parser.add_argument("pgn", help="PGN-файл (например, месячная выгрузка Lichess)")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--chat-id", type=int, help="записать партии и ошибки в bot.db этому пользователю")
+    target.add_argument("--jsonl", help="записать результат в JSONL вместо БД")
+    parser.add_argument("--source", choices=("lichess", "chesscom"), default="lichess")
+    parser.add_argument("--nick", help="ник пользователя у провайдера, если ещё не привязан")
+    parser.add_argument("--db", default=connection.DB_PATH, help="путь к базе бота")
+    parser.add_argument("--limit", type=int, default=None, help="максимум партий")
+    args = parser.parse_args()
+
+    connection.DB_PATH = args.db
+    if args.chat_id is not None:
+        init_db()
+        if args.nick:
+            upsert_user(args.chat_id, **{args.source: args.nick})
+        lichess_nick, chesscom_nick = get_user_nicks(args.chat_id)
+        if not (lichess_nick if args.source == "lichess" else chesscom_nick):
+            parser.error(f"у пользователя {args.chat_id} нет ника {args.source}: укажите --nick")
+
+    try:
+        asyncio.run(batch_analyse(args.pgn, args.chat_id, args.source, args.jsonl, args.limit))
+    finally:
+        connection.close_db()
+
+if __name__ == "__main__":
+    main()
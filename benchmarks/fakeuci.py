@@ -0,0 +1,68 @@
+# Детерминированный UCI-движок для бенчмарков: оценка и главная линия —
+# хеш позиции, так что один и тот же FEN всегда даёт один и тот же ответ,
+# а время «поиска» не зависит от железа и глубины
+# (--delay СЕКУНДЫ — изображать поиск фиксированной длительности)
+import hashlib
+import sys
+import time
+
+import chess
+
+
+def _digest(board: chess.Board) -> int:
+    return int(hashlib.md5(board.fen().encode()).hexdigest(), 16)
+
+def _search(board: chess.Board, depth: int) -> str:
+    if board.is_game_over():
+        return "info depth 0 score mate 0\nbestmove (none)"
+    score = _digest(board) % 1200 - 600
+    pv = []
+    line = board.copy(stack=False)
+    for _ in range(8):
+        moves = sorted(line.legal_moves, key=lambda m: m.uci())
+        if not moves:
+            break
+        move = moves[_digest(line) % len(moves)]
+        pv.append(move.uci())
+        line.push(move)
+    return (
+        f"info depth {depth} multipv 1 score cp {score} nodes {depth * 1000} pv {' '.join(pv)}\n"
+        f"bestmove {pv[0]}"
+    )
+
+def main():
+    delay = float(sys.argv[sys.argv.index("--delay") + 1]) if "--delay" in sys.argv else 0.0
+    board = chess.Board()
+    for raw in sys.stdin:
+        parts = raw.split()
+        if not parts:
+            continue
+        cmd = parts[0]
+        if cmd == "uci":
+            print("id name FakeUCI")
+            print("option name Threads type spin default 1 min 1 max 512")
+            print("option name Hash type spin default 16 min 1 max 33554432")
+            print("option name MultiPV type spin default 1 min 1 max 500")
+            print("uciok")
+        elif cmd == "isready":
+            print("readyok")
+        elif cmd == "position":
+            if parts[1] == "startpos":
+                board, rest = chess.Board(), parts[2:]
+            else:
+                i = parts.index("fen")
+                board, rest = chess.Board(" ".join(parts[i + 1:i + 7])), parts[i + 7:]
+            if rest and rest[0] == "moves":
+                for uci in rest[1:]:
+                    board.push_uci(uci)
+        elif cmd == "go":
+            depth = int(parts[parts.index("depth") + 1]) if "depth" in parts else 10
+            if delay:
+                time.sleep(delay)
+            print(_search(board, depth))
+        elif cmd == "quit":
+            break
+        sys.stdout.flush()
+
+if __name__ == "__main__":
+    main()
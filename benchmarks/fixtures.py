@@ -0,0 +1,74 @@
+import random
+
+import chess
+import chess.pgn
+
+SEED = 20240601
+
+
+def synthetic_games(count: int, min_plies: int = 40, max_plies: int = 120, seed: int = SEED) -> list[str]:
+    # случайные, но воспроизводимые партии с заголовками как у Lichess
+    rng = random.Random(seed)
+    games = []
+    for n in range(count):
+        board = chess.Board()
+        game = chess.pgn.Game()
+        game.headers["Event"] = "Rated Blitz game"
+        game.headers["Site"] = f"https://lichess.org/bench{n:06d}"
+        game.headers["White"] = "bench_user" if n % 2 == 0 else f"opponent{n}"
+        game.headers["Black"] = f"opponent{n}" if n % 2 == 0 else "bench_user"
+        node = game
+        for _ in range(rng.randint(min_plies, max_plies)):
+            moves = list(board.legal_moves)
+            if not moves:
+                break
+            move = rng.choice(moves)
+            node = node.add_variation(move)
+            board.push(move)
+        game.headers["Result"] = board.result(claim_draw=True)
+        games.append(str(game))
+    return games
+
+def synthetic_positions(count: int, seed: int = SEED) -> list[str]:
+    # случайные партии: и дебютные, и разреженные эндшпильные позиции
+    rng = random.Random(seed)
+    fens = []
+    while len(fens) < count:
+        board = chess.Board()
+        for _ in range(rng.randint(0, 120)):
+            moves = list(board.legal_moves)
+            if not moves:
+                break
+            board.push(rng.choice(moves))
+        if not board.is_game_over():
+            fens.append(board.fen())
+    return fens
+
+def synthetic_lines(fens: list[str], plies: int, seed: int = SEED) -> list[tuple[str, list[chess.Move]]]:
+    rng = random.Random(seed)
+    lines = []
+    for fen in fens:
+        board = chess.Board(fen)
+        moves = []
+        for _ in range(plies):
+            legal = list(board.legal_moves)
+            if not legal:
+                break
+            moves.append(rng.choice(legal))
+            board.push(moves[-1])
+        if moves:
+            lines.append((fen, moves))
+    return lines
+
+def synthetic_evals(length: int, seed: int = SEED) -> list[int]:
+    # оценки с редкими резкими скачками, как в реальных партиях
+    rng = random.Random(seed)
+    evals = []
+    score = 0
+    for i in range(length):
+        score += rng.randint(-40, 40)
+        if rng.random() < 0.03:
+            score += rng.choice((-1, 1)) * rng.randint(200, 900)
+        score = max(-3000, min(3000, score))
+        evals.append(score if i % 2 == 0 else -score)
+    return evals
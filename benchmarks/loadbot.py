@@ -0,0 +1,39 @@
+# bot.py для нагрузочного теста: база, анимации и движок подменяются
+# до импорта бота; адреса Bot API и провайдеров приходят через окружение
+import argparse
+import asyncio
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import assetstore
+import connection
+import loadgames
+import stockfishanalyse
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", required=True)
+    parser.add_argument("--assets", required=True)
+    parser.add_argument("--engine-delay", type=float, default=0.0)
+    parser.add_argument("--no-rate-limits", action="store_true")
+    args = parser.parse_args()
+
+    os.chdir(ROOT)
+    connection.DB_PATH = args.db
+    assetstore.ASSET_DIR = args.assets
+    stockfishanalyse.ENGINE_PATH = [
+        sys.executable, os.path.join(ROOT, "benchmarks", "fakeuci.py"), "--delay", str(args.engine_delay)
+    ]
+    if args.no_rate_limits:
+        for limiter in loadgames.RATE_LIMITS.values():
+            limiter.min_interval = 0.0
+
+    import bot
+    asyncio.run(bot.main())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,477 @@
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import re
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import aiohttp
+from aiohttp import web
+
+from benchmarks.fixtures import synthetic_games
+
+BOT_TOKEN = "123456:LOADTEST"
+STEP_TIMEOUT = 60.0
+SYNC_TIMEOUT = 1800.0
+
+
+def _percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+def _peak_rss_kb(pid: int) -> int:
+    # VmHWM — пиковый RSS процесса за всё время жизни
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+def _children(pid: int) -> list[int]:
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(p) for p in f.read().split()]
+    except OSError:
+        return []
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+async def _scrape(url: str) -> str:
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(url) as resp:
+                return await resp.text()
+    except aiohttp.ClientError:
+        return ""
+
+async def _start_app(app: web.Application) -> tuple[web.AppRunner, str]:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    return runner, f"http://{host}:{port}"
+
+
+class FakeTelegram:
+    # Bot API в объёме, который использует бот: getUpdates с long polling,
+    # send* складываются во входящие соответствующего чата
+    def __init__(self):
+        self.updates: list[dict] = []
+        self.calls = Counter()
+        self.polling = asyncio.Event()
+        self._changed = asyncio.Event()
+        self._update_id = 0
+        self._message_id = 0
+        self._inboxes: dict[int, asyncio.Queue] = defaultdict(asyncio.Queue)
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        return app
+
+    def inbox(self, chat_id: int) -> asyncio.Queue:
+        return self._inboxes[chat_id]
+
+    def push_message(self, chat_id: int, text: str):
+        self._push({"message": {**self._message(chat_id), "from": self._user(chat_id), "text": text}})
+
+    def push_callback(self, chat_id: int, message_id: int, data: str):
+        self._push({"callback_query": {
+            "id": f"{chat_id}:{self._update_id}",
+            "from": self._user(chat_id),
+            "chat_instance": str(chat_id),
+            "data": data,
+            "message": {**self._message(chat_id), "message_id": message_id, "text": "card"},
+        }})
+
+    def _push(self, update: dict):
+        self._update_id += 1
+        self.updates.append({"update_id": self._update_id, **update})
+        self._changed.set()
+
+    def _message(self, chat_id: int) -> dict:
+        self._message_id += 1
+        return {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+        }
+
+    @staticmethod
+    def _user(chat_id: int) -> dict:
+        return {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}"}
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        form = await request.post()
+        self.calls[method] += 1
+        if method == "getUpdates":
+            result = await self._get_updates(int(form.get("offset", 0)), float(form.get("timeout", 0)))
+        elif method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "LoadTest", "username": "loadtest_bot"}
+        elif method.startswith("send"):
+            chat_id = int(form["chat_id"])
+            result = self._message(chat_id)
+            markup = form.get("reply_markup")
+            self.inbox(chat_id).put_nowait({
+                "at": time.perf_counter(),
+                "method": method,
+                "text": form.get("text") or form.get("caption") or "",
+                "markup": json.loads(markup) if markup else None,
+                "message_id": result["message_id"],
+            })
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def _get_updates(self, offset: int, timeout: float) -> list[dict]:
+        self.polling.set()
+        self.updates = [u for u in self.updates if u["update_id"] >= offset]
+        deadline = time.monotonic() + timeout
+        while not self.updates:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+        return list(self.updates)
+
+
+class FakeProviders:
+    # Lichess и Chess.com с заранее сгенерированными партиями для каждого ника
+    def __init__(self, games_per_user: int, latency: float):
+        self.games_per_user = games_per_user
+        self.latency = latency
+        self.calls = Counter()
+        self._now_ms = int(time.time() * 1000)
+        self._games: dict[str, list[str]] = {}
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/api/user/{nick}", self._lichess_user)
+        app.router.add_get("/api/games/user/{nick}", self._lichess_games)
+        app.router.add_get("/pub/player/{nick}", self._chesscom_player)
+        app.router.add_get("/pub/player/{nick}/games/{year}/{month}", self._chesscom_month)
+        return app
+
+    def _games_for(self, nick: str) -> list[str]:
+        games = self._games.get(nick)
+        if games is None:
+            seed = sum(map(ord, nick))
+            games = self._games[nick] = [
+                pgn.replace("bench_user", nick).replace("lichess.org/bench", f"lichess.org/{nick}x")
+                for pgn in synthetic_games(self.games_per_user, seed=seed)
+            ]
+        return games
+
+    async def _pause(self, name: str):
+        self.calls[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def _lichess_user(self, request: web.Request) -> web.Response:
+        await self._pause("lichess_user")
+        nick = request.match_info["nick"]
+        return web.json_response({"id": nick.lower(), "username": nick, "seenAt": self._now_ms})
+
+    async def _lichess_games(self, request: web.Request) -> web.StreamResponse:
+        await self._pause("lichess_games")
+        since = int(request.query.get("since", 0))
+        limit = int(request.query.get("max", 30))
+        resp = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await resp.prepare(request)
+        sent = 0
+        # заочных партий у синтетических игроков нет
+        games = [] if request.query.get("perfType") == "correspondence" else self._games_for(request.match_info["nick"])
+        for i, pgn in enumerate(games):
+            created = self._now_ms - (i + 1) * 60_000
+            if created < since or sent >= limit:
+                continue
+            await resp.write((json.dumps({"id": f"g{i}", "createdAt": created, "pgn": pgn}) + "\n").encode())
+            sent += 1
+        await resp.write_eof()
+        return resp
+
+    async def _chesscom_player(self, request: web.Request) -> web.Response:
+        await self._pause("chesscom_player")
+        nick = request.match_info["nick"]
+        return web.json_response({"username": nick, "last_online": self._now_ms // 1000})
+
+    async def _chesscom_month(self, request: web.Request) -> web.Response:
+        await self._pause("chesscom_month")
+        now = datetime.datetime.fromtimestamp(self._now_ms / 1000, datetime.timezone.utc)
+        year, month = int(request.match_info["year"]), int(request.match_info["month"])
+        if (year, month) != (now.year, now.month):
+            return web.json_response({"games": []})
+        nick = request.match_info["nick"]
+        games = [
+            {
+                "url": f"https://www.chess.com/game/live/{nick}{i}",
+                "pgn": pgn.replace("[Site ", f'[Link "https://www.chess.com/game/live/{nick}{i}"]\n[Site ', 1),
+                "end_time": self._now_ms // 1000 - (i + 1) * 60,
+            }
+            for i, pgn in enumerate(self._games_for(nick))
+        ]
+        return web.json_response({"games": games})
+
+
+class Stats:
+    def __init__(self):
+        self.latency: dict[str, list[float]] = defaultdict(list)
+        self.failures = Counter()
+        self.not_ready = 0
+        self.syncs: list[tuple[float, float, int]] = []
+
+
+class SimUser:
+    # сценарий одного пользователя: привязка аккаунта, синхронизация, разбор ошибок
+    def __init__(self, tg: FakeTelegram, stats: Stats, chat_id: int, source: str, tasks: int, think: float):
+        self.tg = tg
+        self.stats = stats
+        self.chat_id = chat_id
+        self.source = source
+        self.nick = f"load{chat_id}"
+        self.tasks = tasks
+        self.think = think
+
+    async def run(self):
+        try:
+            await self._scenario()
+        except asyncio.TimeoutError:
+            self.stats.failures["timeout"] += 1
+        except Exception as e:
+            self.stats.failures[type(e).__name__] += 1
+
+    async def _scenario(self):
+        await self._say("start", "/start")
+        await self._say("profile", "👤 Профиль")
+        button = "🔗 Привязать Lichess" if self.source == "lichess" else "🔗 Привязать Chesscom"
+        await self._say("bind_prompt", button)
+        reply = await self._say("bind", self.nick)
+        if not reply["text"].startswith("✅"):
+            self.stats.failures["bind"] += 1
+            return
+        await self._say("analysis", "🔍 Анализ игр")
+
+        started = time.perf_counter()
+        await self._say("sync_ack", "🔄 Синхронизировать")
+        done = await self._wait("sync_done", started, lambda r: r["text"].startswith("✅"), SYNC_TIMEOUT)
+        games = re.search(r"Новые партии: (\d+)", done["text"])
+        self.stats.syncs.append((started, done["at"], int(games.group(1)) if games else 0))
+
+        reply = await self._say("errors", "📋 Мои ошибки", lambda r: r["method"] == "sendDocument" or "Задач нет" in r["text"])
+        for _ in range(self.tasks):
+            if reply["method"] != "sendDocument":
+                return
+            bid = self._callback_id(reply, "soln:")
+            solution = await self._click("solution", reply, f"soln:{bid}", lambda r: r["method"] == "sendAnimation" or r["text"].startswith("⏳"))
+            if solution["method"] != "sendAnimation":
+                self.stats.not_ready += 1
+            reply = await self._click("next", solution, f"next:{bid}", lambda r: r["method"] == "sendDocument" or "последняя" in r["text"])
+
+    @staticmethod
+    def _callback_id(reply: dict, prefix: str) -> int:
+        for row in reply["markup"]["inline_keyboard"]:
+            for button in row:
+                if button.get("callback_data", "").startswith(prefix):
+                    return int(button["callback_data"].split(":", 1)[1])
+        raise LookupError(prefix)
+
+    def _drain(self):
+        inbox = self.tg.inbox(self.chat_id)
+        while not inbox.empty():
+            inbox.get_nowait()
+
+    async def _say(self, step: str, text: str, until=lambda r: True) -> dict:
+        await asyncio.sleep(self.think)
+        self._drain()
+        started = time.perf_counter()
+        self.tg.push_message(self.chat_id, text)
+        return await self._wait(step, started, until, STEP_TIMEOUT)
+
+    async def _click(self, step: str, message: dict, data: str, until) -> dict:
+        await asyncio.sleep(self.think)
+        self._drain()
+        started = time.perf_counter()
+        self.tg.push_callback(self.chat_id, message["message_id"], data)
+        return await self._wait(step, started, until, STEP_TIMEOUT)
+
+    async def _wait(self, step: str, started: float, until, timeout: float) -> dict:
+        inbox = self.tg.inbox(self.chat_id)
+        deadline = started + timeout
+        while True:
+            reply = await asyncio.wait_for(inbox.get(), max(0.0, deadline - time.perf_counter()))
+            if until(reply):
+                self.stats.latency[step].append(reply["at"] - started)
+                return reply
+
+
+async def run(args) -> dict:
+    # база, журнал и метрики бота — во временной папке; --keep оставляет её
+    workdir = tempfile.mkdtemp(prefix="chessload-")
+    try:
+        return await _run(args, workdir)
+    finally:
+        if args.keep:
+            print(f"Временная папка сохранена: {workdir}", flush=True)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+async def _run(args, workdir: str) -> dict:
+    tg = FakeTelegram()
+    providers = FakeProviders(args.games, args.provider_latency)
+    tg_runner, tg_url = await _start_app(tg.app())
+    pr_runner, pr_url = await _start_app(providers.app())
+    metrics_port = _free_port()
+
+    env = {
+        **os.environ,
+        "BOT_TOKEN": BOT_TOKEN,
+        "TELEGRAM_API_URL": tg_url,
+        "LICHESS_URL": pr_url,
+        "CHESSCOM_URL": pr_url,
+        "METRICS_PORT": str(metrics_port),
+    }
+    cmd = [
+        sys.executable, "-m", "benchmarks.loadbot",
+        "--db", os.path.join(workdir, "bot.db"),
+        "--assets", os.path.join(workdir, "gifstore"),
+        "--engine-delay", str(args.engine_delay),
+    ]
+    if not args.real_rate_limits:
+        cmd.append("--no-rate-limits")
+    log = open(os.path.join(workdir, "bot.log"), "wb")
+    proc = await asyncio.create_subprocess_exec(*cmd, cwd=ROOT, env=env, stdout=log, stderr=log)
+    print(f"Бот запущен (pid {proc.pid}), журнал: {log.name}", flush=True)
+
+    stats = Stats()
+    bot_rss = engines_rss = 0
+    try:
+        await asyncio.wait_for(tg.polling.wait(), 60)
+        users = [
+            SimUser(tg, stats, 1000 + i, "lichess" if i % 2 == 0 else "chesscom", args.tasks, args.think)
+            for i in range(args.users)
+        ]
+        started = time.perf_counter()
+        runs = []
+        for user in users:
+            runs.append(asyncio.create_task(user.run()))
+            await asyncio.sleep(args.ramp / max(1, args.users))
+        await asyncio.gather(*runs)
+        elapsed = time.perf_counter() - started
+        bot_rss = _peak_rss_kb(proc.pid)
+        engines_rss = sum(_peak_rss_kb(pid) for pid in _children(proc.pid))
+        # по этапам конвейера — в /metrics самого бота
+        metrics_path = os.path.join(workdir, "metrics.txt")
+        with open(metrics_path, "w", encoding="utf-8") as f:
+            f.write(await _scrape(f"http://127.0.0.1:{metrics_port}/metrics"))
+    finally:
+        if proc.returncode is None:
+            proc.send_signal(signal.SIGINT)
+            try:
+                await asyncio.wait_for(proc.wait(), 30)
+            except asyncio.TimeoutError:
+                proc.kill()
+                await proc.wait()
+        log.close()
+        await tg_runner.cleanup()
+        await pr_runner.cleanup()
+
+    steps = {
+        step: {
+            "count": len(values),
+            "p50_ms": 1000 * _percentile(values, 50),
+            "p95_ms": 1000 * _percentile(values, 95),
+            "p99_ms": 1000 * _percentile(values, 99),
+            "max_ms": 1000 * max(values),
+        }
+        for step, values in stats.latency.items()
+    }
+    handlers = [v for step, values in stats.latency.items() if step != "sync_done" for v in values]
+    sync_span = (max(e for _, e, _ in stats.syncs) - min(s for s, _, _ in stats.syncs)) if stats.syncs else 0.0
+    sync_games = sum(g for _, _, g in stats.syncs)
+    return {
+        "config": vars(args),
+        "elapsed_s": elapsed,
+        "handlers": {
+            "count": len(handlers),
+            "p50_ms": 1000 * _percentile(handlers, 50),
+            "p95_ms": 1000 * _percentile(handlers, 95),
+            "p99_ms": 1000 * _percentile(handlers, 99),
+        },
+        "steps": steps,
+        "sync": {
+            "completed": len(stats.syncs),
+            "games": sync_games,
+            "per_min": 60 * len(stats.syncs) / sync_span if sync_span else 0.0,
+            "games_per_s": sync_games / sync_span if sync_span else 0.0,
+        },
+        "solutions_not_ready": stats.not_ready,
+        "failures": dict(stats.failures),
+        "peak_rss_mb": {"bot": bot_rss / 1024, "engines": engines_rss / 1024},
+        "telegram_calls": dict(tg.calls),
+        "provider_calls": dict(providers.calls),
+        "metrics": metrics_path if args.keep else None,
+    }
+
+def print_report(report: dict):
+    print()
+    print(f"Пользователей: {report['config']['users']}, время прогона: {report['elapsed_s']:.1f} с")
+    print(f"{'шаг':>12}  {'n':>5}  {'p50, мс':>9}  {'p95, мс':>9}  {'p99, мс':>9}  {'max, мс':>9}")
+    for step, s in report["steps"].items():
+        print(f"{step:>12}  {s['count']:5d}  {s['p50_ms']:9.1f}  {s['p95_ms']:9.1f}  {s['p99_ms']:9.1f}  {s['max_ms']:9.1f}")
+    h = report["handlers"]
+    print(f"Обработчики (без ожидания конца синхронизации): p50 {h['p50_ms']:.1f} мс, "
+          f"p95 {h['p95_ms']:.1f} мс, p99 {h['p99_ms']:.1f} мс")
+    s = report["sync"]
+    print(f"Синхронизации: {s['completed']} ({s['per_min']:.1f}/мин), партий {s['games']} ({s['games_per_s']:.2f}/с)")
+    print(f"Решение ещё не готово: {report['solutions_not_ready']}, сбои: {report['failures'] or 'нет'}")
+    rss = report["peak_rss_mb"]
+    print(f"Пиковый RSS: бот {rss['bot']:.0f} МБ, движки {rss['engines']:.0f} МБ")
+    if report["metrics"]:
+        print(f"Метрики бота: {report['metrics']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота на локальных заглушках Telegram и провайдеров")
+    parser.add_argument("--users", type=int, default=20, help="число пользователей")
+    parser.add_argument("--games", type=int, default=10, help="партий у каждого пользователя")
+    parser.add_argument("--tasks", type=int, default=5, help="задач, которые разбирает каждый пользователь")
+    parser.add_argument("--ramp", type=float, default=5.0, help="за сколько секунд подключаются все пользователи")
+    parser.add_argument("--think", type=float, default=0.2, help="пауза пользователя между действиями, с")
+    parser.add_argument("--provider-latency", type=float, default=0.05, help="задержка ответов провайдеров, с")
+    parser.add_argument("--engine-delay", type=float, default=0.0, help="длительность одного поиска движка, с")
+    parser.add_argument("--real-rate-limits", action="store_true", help="оставить лимиты запросов к провайдерам")
+    parser.add_argument("--output", help="записать отчёт в JSON")
+    parser.add_argument("--keep", action="store_true", help="не удалять временную папку с базой, журналом и метриками")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
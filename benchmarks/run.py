@@ -0,0 +1,294 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import chess
+
+import assetstore
+import boardrender
+import connection
+import stockfishanalyse
+from benchmarks.fixtures import synthetic_evals, synthetic_games, synthetic_lines, synthetic_positions
+from evalcache import PositionCache
+from loadgames import iter_pgn_texts
+
+FAKE_ENGINE = [sys.executable, os.path.join(ROOT, "benchmarks", "fakeuci.py")]
+DB_ROWS = 10_000
+BENCH_CHAT = 1
+
+CASES: dict[str, tuple] = {}
+
+
+def case(name: str, unit: str):
+    # setup() готовит фикстуры и возвращает (операция, число единиц за один вызов);
+    # операция — обычная функция или корутина
+    def register(setup):
+        CASES[name] = (setup, unit)
+        return setup
+    return register
+
+# --- рендер ---
+
+@case("render_board_image", "кадр")
+def _render_board():
+    fens = synthetic_positions(50)
+    def op():
+        for i, fen in enumerate(fens):
+            boardrender._render_board_image(fen, 200, i % 2 == 1)
+    return op, len(fens)
+
+@case("render_move_gif", "анимация")
+def _render_move():
+    lines = synthetic_lines(synthetic_positions(20), 1)
+    def op():
+        for fen, moves in lines:
+            boardrender.render_move_gif(fen, moves[0])
+    return op, len(lines)
+
+@case("render_line_gif", "анимация")
+def _render_line():
+    lines = synthetic_lines(synthetic_positions(10), 6)
+    def op():
+        for fen, moves in lines:
+            boardrender.render_line_gif(fen, moves)
+    return op, len(lines)
+
+# --- разбор партий и поиск ошибок ---
+
+@case("findmove", "оценка")
+def _findmove():
+    evals = synthetic_evals(100_000)
+    def op():
+        stockfishanalyse.findmove(evals)
+    return op, len(evals)
+
+@case("iter_pgn_texts", "партия")
+def _split_pgn():
+    text = "\n\n".join(synthetic_games(500))
+    lines = text.splitlines(keepends=True)
+    def op():
+        for _ in iter_pgn_texts(lines):
+            pass
+    return op, 500
+
+@case("get_fen_at_move", "вызов")
+def _fen_at_move():
+    games = synthetic_games(50, min_plies=80, max_plies=120)
+    def op():
+        for pgn in games:
+            connection.get_fen_at_move(pgn, 70)
+    return op, len(games)
+
+@case("replay_plies", "партия")
+def _replay_plies():
+    games = synthetic_games(50, min_plies=80, max_plies=120)
+    idxs = list(range(10, 80, 7))
+    def op():
+        for pgn in games:
+            connection.replay_plies(pgn, idxs)
+    return op, len(games)
+
+# --- база: таблицы на DB_ROWS строк ---
+
+def _fill_db():
+    games = synthetic_games(DB_ROWS, min_plies=20, max_plies=40)
+    connection.upsert_user(BENCH_CHAT, lichess="bench_user")
+    saved = []
+    for i in range(0, len(games), 500):
+        saved += connection.save_games(BENCH_CHAT, "lichess", games[i:i + 500])
+    for game_id, pgn, color in saved:
+        plies = connection.replay_plies(pgn, range(0, 20))
+        connection.save_blunders(game_id, [
+            {"move_index": idx, "opponent": "x", **ply} for idx, ply in plies.items()
+        ])
+    return games
+
+@case("save_game", "партия")
+def _save_game():
+    games = synthetic_games(200, min_plies=20, max_plies=40, seed=7)
+    counter = iter(range(1_000_000))
+    def op():
+        n = next(counter)
+        for i, pgn in enumerate(games):
+            # уникальный Site — каждая итерация вставляет новые партии
+            connection.save_game(BENCH_CHAT, "lichess", pgn.replace("bench", f"r{n}x{i}_", 1))
+    return op, len(games)
+
+@case("save_blunders", "ошибка")
+def _save_blunders():
+    game_id, _ = connection.save_game(BENCH_CHAT, "lichess", synthetic_games(1, seed=11)[0])
+    fen = chess.STARTING_FEN
+    counter = iter(range(0, 10_000_000, 1000))
+    def op():
+        base = next(counter)
+        connection.save_blunders(game_id, [
+            {"move_index": base + i, "fen": fen, "played_uci": "e2e4", "played_san": "e4",
+             "side_to_move": "w", "opponent": "x"}
+            for i in range(1000)
+        ])
+    return op, 1000
+
+@case("load_unsolved_blunders", "выборка")
+def _load_unsolved():
+    def op():
+        connection.load_unsolved_blunders(BENCH_CHAT)
+    return op, 1
+
+@case("load_blunder_page", "страница")
+def _load_page():
+    def op():
+        cursor = None
+        for _ in range(10):
+            ids = connection.load_blunder_page(BENCH_CHAT, cursor, 20)
+            cursor = ids[-1]
+            connection.load_blunder(BENCH_CHAT, ids[0])
+    return op, 10
+
+# --- движок: локальный детерминированный UCI ---
+
+@case("geteval", "партия")
+def _geteval():
+    games = synthetic_games(8, min_plies=60, max_plies=60, seed=3)
+    async def op():
+        await asyncio.gather(*[
+            stockfishanalyse.geteval(pgn, use_cache=False, owner=i) for i, pgn in enumerate(games)
+        ])
+    return op, len(games)
+
+@case("engine_line", "ошибка")
+def _engine_line():
+    # то же, что задание engine_line в боте: лучший ход и продолжение после ошибки
+    lines = synthetic_lines(synthetic_positions(16, seed=5), 1, seed=5)
+    async def one(fen: str, played: chess.Move):
+        await stockfishanalyse.stockfish_principal_variation(fen, owner=fen)
+        after = chess.Board(fen)
+        after.push(played)
+        await stockfishanalyse.stockfish_principal_variation(after.fen(), owner=fen)
+    async def op():
+        stockfishanalyse.POSITION_CACHE = PositionCache(persistent=False)
+        await asyncio.gather(*[one(fen, moves[0]) for fen, moves in lines])
+    return op, len(lines)
+
+
+def _measure(loop, op, repeat: int) -> list[float]:
+    is_async = asyncio.iscoroutinefunction(op)
+    timings = []
+    for i in range(repeat + 1):
+        started = time.perf_counter()
+        if is_async:
+            loop.run_until_complete(op())
+        else:
+            op()
+        if i:  # первый прогон — прогрев кэшей
+            timings.append(time.perf_counter() - started)
+    return timings
+
+def run_suite(names: list[str], repeat: int) -> dict:
+    loop = asyncio.new_event_loop()
+    results = {}
+    try:
+        for name in names:
+            setup, unit = CASES[name]
+            op, units = setup()
+            timings = _measure(loop, op, repeat)
+            median = statistics.median(timings)
+            results[name] = {
+                "unit": unit,
+                "units_per_op": units,
+                "median_s": median,
+                "min_s": min(timings),
+                "per_s": units / median if median else 0.0,
+                "repeat": repeat,
+            }
+            print(f"{name:>24}: {1000 * median:9.2f} мс, {results[name]['per_s']:10.1f} {unit}/с", flush=True)
+    finally:
+        loop.run_until_complete(stockfishanalyse.close_engine_pool())
+        loop.close()
+    return results
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    print()
+    print(f"{'сценарий':>24}  {'база, мс':>10}  {'сейчас, мс':>10}  {'отношение':>9}")
+    for name, res in results.items():
+        base = baseline.get("results", {}).get(name)
+        if base is None:
+            print(f"{name:>24}  {'—':>10}  {1000 * res['median_s']:10.2f}  {'новый':>9}")
+            continue
+        ratio = res["median_s"] / base["median_s"] if base["median_s"] else float("inf")
+        mark = ""
+        if ratio > 1 + tolerance:
+            mark = "  ← медленнее"
+            regressions.append(name)
+        elif ratio < 1 - tolerance:
+            mark = "  ← быстрее"
+        print(f"{name:>24}  {1000 * base['median_s']:10.2f}  {1000 * res['median_s']:10.2f}  {ratio:8.2f}x{mark}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки горячих путей на синтетических данных")
+    parser.add_argument("cases", nargs="*", help=f"сценарии (по умолчанию все): {', '.join(CASES)}")
+    parser.add_argument("--repeat", type=int, default=5, help="замеров на сценарий")
+    parser.add_argument("--output", help="записать результаты в JSON")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое замедление (0.2 = 20%%)")
+    parser.add_argument("--keep", action="store_true", help="не удалять временную папку с базой")
+    args = parser.parse_args()
+
+    names = args.cases or list(CASES)
+    unknown = [n for n in names if n not in CASES]
+    if unknown:
+        parser.error(f"неизвестные сценарии: {', '.join(unknown)}")
+
+    os.chdir(ROOT)  # init_db читает schema.sql из текущей папки
+    workdir = tempfile.mkdtemp(prefix="chessbench-")
+    connection.DB_PATH = os.path.join(workdir, "bench.db")
+    assetstore.ASSET_DIR = os.path.join(workdir, "gifstore")
+    stockfishanalyse.ENGINE_PATH = FAKE_ENGINE
+    try:
+        connection.init_db()
+        if any(CASES[n][0].__name__.startswith(("_save", "_load")) for n in names):
+            print(f"Заполнение базы: {DB_ROWS} партий…", flush=True)
+            _fill_db()
+        results = run_suite(names, args.repeat)
+    finally:
+        connection.close_db()
+        if args.keep:
+            print(f"Временная папка сохранена: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "db_rows": DB_ROWS,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\nЗамедление больше {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 import os
-from PIL import Image, ImageDraw
+import threading
+from PIL import Image, ImageColor, ImageDraw
 from io import BytesIO
 import chess
 
@@ -16,42 +17,126 @@ def _load_piece_images():
 
 _load_piece_images()
 
+LIGHT_SQUARE, DARK_SQUARE = "#F0D9B5", "#B58863"
+
+_sprites: dict[tuple[str, int], Image.Image] = {}
+_empty_boards: dict[int, Image.Image] = {}
+
 def _get_scaled_icon(key: str, square_size: int) -> Image.Image:
-    icon = _piece_images[key]
-    if icon.width == square_size and icon.height == square_size:
-        return icon
-    return icon.resize((square_size, square_size), Image.LANCZOS)
+    sprite = _sprites.get((key, square_size))
+    if sprite is None:
+        icon = _piece_images[key]
+        if icon.width != square_size or icon.height != square_size:
+            icon = icon.resize((square_size, square_size), Image.LANCZOS)
+        # рендер идёт из нескольких потоков: кто первым положил, того и берём
+        sprite = _sprites.setdefault((key, square_size), icon)
+    return sprite
+
+def _empty_board(square_size: int) -> Image.Image:
+    # раскраска клеток при развороте доски не меняется (a1 и h8 обе тёмные),
+    # так что одной заготовки на размер хватает для обеих ориентаций
+    board = _empty_boards.get(square_size)
+    if board is None:
+        bs = square_size
+        board = Image.new("RGBA", (8 * bs, 8 * bs), LIGHT_SQUARE)
+        draw = ImageDraw.Draw(board)
+        for rank in range(8):
+            for file in range(8):
+                if (file + rank) % 2:
+                    x0, y0 = file * bs, rank * bs
+                    draw.rectangle([x0, y0, x0 + bs - 1, y0 + bs - 1], fill=DARK_SQUARE)
+        board = _empty_boards.setdefault(square_size, board)
+    return board
+
+def _square_origin(sq: chess.Square, square_size: int, flip: bool) -> tuple[int, int]:
+    file, rank = chess.square_file(sq), chess.square_rank(sq)
+    if flip:
+        return (7 - file) * square_size, rank * square_size
+    return file * square_size, (7 - rank) * square_size
 
 def _render_board_image(fen: str, square_size: int, flip: bool) -> Image.Image:
     board = chess.Board(fen)
-    bs = square_size
-    img = Image.new("RGBA", (8 * bs, 8 * bs), "#FFFFFF")
-    draw = ImageDraw.Draw(img)
-
-    light, dark = "#F0D9B5", "#B58863"
-    for rank in range(8):
-        for file in range(8):
-            color = light if (file + rank) % 2 == 0 else dark
-            x0, y0 = file * bs, rank * bs
-            x1, y1 = x0 + bs, y0 + bs
-            draw.rectangle([x0, y0, x1, y1], fill=color)
-
-            if not flip:
-                actual_file = file
-                actual_rank = 7 - rank
-            else:
-                actual_file = 7 - file
-                actual_rank = rank
-
-            sq = chess.square(actual_file, actual_rank)
-            piece = board.piece_at(sq)
-            if piece:
-                key = f"{'w' if piece.color else 'b'}{piece.symbol().lower()}"
-                icon = _get_scaled_icon(key, bs)
-                img.alpha_composite(icon, (x0, y0))
+    img = _empty_board(square_size).copy()
+    for sq, piece in board.piece_map().items():
+        key = f"{'w' if piece.color else 'b'}{piece.symbol().lower()}"
+        img.alpha_composite(_get_scaled_icon(key, square_size), _square_origin(sq, square_size, flip))
+    return img
 
+# --- GIF: кадры сразу в общей палитре, без квантования каждого кадра ---
+
+_palette: Image.Image | None = None
+_palette_lock = threading.Lock()
+_tiles: dict[tuple[str, int, bool], Image.Image] = {}
+_indexed_boards: dict[int, Image.Image] = {}
+
+def _shared_palette() -> Image.Image:
+    # в кадре бывают только цвета клеток и фигур на светлой/тёмной клетке:
+    # одна палитра на все кадры и все анимации
+    global _palette
+    with _palette_lock:
+        if _palette is None:
+            size = max(icon.width for icon in _piece_images.values())
+            sample = Image.new("RGBA", (size * len(_piece_images), size * 2))
+            for i, key in enumerate(sorted(_piece_images)):
+                icon = _get_scaled_icon(key, size)
+                for row, color in enumerate((LIGHT_SQUARE, DARK_SQUARE)):
+                    tile = Image.new("RGBA", (size, size), color)
+                    tile.alpha_composite(icon)
+                    sample.paste(tile, (i * size, row * size))
+            quantized = sample.convert("RGB").quantize(colors=254, method=Image.Quantize.MEDIANCUT)
+            # цвета клеток — точно, первыми индексами
+            colors = list(ImageColor.getrgb(LIGHT_SQUARE)) + list(ImageColor.getrgb(DARK_SQUARE))
+            colors += quantized.getpalette()[:254 * 3]
+            palette = Image.new("P", (1, 1))
+            palette.putpalette(colors + [0] * (768 - len(colors)))
+            _palette = palette
+        return _palette
+
+def _indexed_tile(key: str, square_size: int, dark: bool) -> Image.Image:
+    tile = _tiles.get((key, square_size, dark))
+    if tile is None:
+        rgba = Image.new("RGBA", (square_size, square_size), DARK_SQUARE if dark else LIGHT_SQUARE)
+        rgba.alpha_composite(_get_scaled_icon(key, square_size))
+        tile = rgba.convert("RGB").quantize(palette=_shared_palette(), dither=Image.Dither.NONE)
+        tile = _tiles.setdefault((key, square_size, dark), tile)
+    return tile
+
+def _indexed_empty_board(square_size: int) -> Image.Image:
+    board = _indexed_boards.get(square_size)
+    if board is None:
+        board = _empty_board(square_size).convert("RGB").quantize(
+            palette=_shared_palette(), dither=Image.Dither.NONE
+        )
+        board = _indexed_boards.setdefault(square_size, board)
+    return board
+
+def _render_board_indexed(fen: str, square_size: int, flip: bool) -> Image.Image:
+    board = chess.Board(fen)
+    img = _indexed_empty_board(square_size).copy()
+    for sq, piece in board.piece_map().items():
+        key = f"{'w' if piece.color else 'b'}{piece.symbol().lower()}"
+        dark = (chess.square_file(sq) + chess.square_rank(sq)) % 2 == 0
+        img.paste(_indexed_tile(key, square_size, dark), _square_origin(sq, square_size, flip))
     return img
 
+def _encode_gif(frames: list[Image.Image], durations: list[int], name: str) -> BytesIO:
+    # disposal=1: кадр рисуется поверх предыдущего, и Pillow пишет только
+    # прямоугольник изменившихся клеток; паузы — длительностью кадра
+    gif_buf = BytesIO()
+    gif_buf.name = name
+    frames[0].save(
+        gif_buf,
+        format="GIF",
+        save_all=True,
+        append_images=frames[1:],
+        loop=0,
+        duration=durations,
+        disposal=1,
+        optimize=False,
+    )
+    gif_buf.seek(0)
+    return gif_buf
+
 def render_board_png(
     fen: str,
     square_size: int = 200,
@@ -72,27 +157,13 @@ def render_move_gif(
     frame_duration: int = 800,
     pause_after: int = 2000
 ) -> BytesIO:
-    im1 = _render_board_image(fen_before, square_size, flip)
     board_after = chess.Board(fen_before)
     board_after.push(move)
-    im2 = _render_board_image(board_after.fen(), square_size, flip)
-
-    pause_copies = max(1, int(round(pause_after / frame_duration)))
-    frames = [im1, im2] + [im2] * pause_copies
-
-    gif_buf = BytesIO()
-    gif_buf.name = "move.gif"
-    frames[0].save(
-        gif_buf,
-        format="GIF",
-        save_all=True,
-        append_images=frames[1:],
-        loop=0,
-        duration=frame_duration,
-        disposal=2,
-    )
-    gif_buf.seek(0)
-    return gif_buf
+    frames = [
+        _render_board_indexed(fen_before, square_size, flip),
+        _render_board_indexed(board_after.fen(), square_size, flip),
+    ]
+    return _encode_gif(frames, [frame_duration, frame_duration + pause_after], "move.gif")
 
 def render_line_gif(
     fen_start: str,
@@ -103,27 +174,12 @@ def render_line_gif(
     pause_after: int = 2000
 ) -> BytesIO:
 
-    frames: list[Image.Image] = []
     board = chess.Board(fen_start)
-
-    frames.append(_render_board_image(fen_start, square_size, flip))
+    frames = [_render_board_indexed(fen_start, square_size, flip)]
     for mv in moves:
         board.push(mv)
-        frames.append(_render_board_image(board.fen(), square_size, flip))
+        frames.append(_render_board_indexed(board.fen(), square_size, flip))
 
-    pause_copies = max(1, int(round(pause_after / frame_duration)))
-    frames += [frames[-1]] * pause_copies
-
-    gif_buf = BytesIO()
-    gif_buf.name = "line.gif"
-    frames[0].save(
-        gif_buf,
-        format="GIF",
-        save_all=True,
-        append_images=frames[1:],
-        loop=0,
-        duration=frame_duration,
-        disposal=2,
-    )
-    gif_buf.seek(0)
-    return gif_buf
+    durations = [frame_duration] * len(frames)
+    durations[-1] += pause_after
+    return _encode_gif(frames, durations, "line.gif")
@@ -1,11 +1,14 @@
 import asyncio
+import contextlib
 import logging
-import io
-import aiohttp
-from concurrent.futures import ThreadPoolExecutor
+import os
+import signal
+import time
 from typing import Optional
 
 from aiogram import Bot, Dispatcher, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.filters import Command
 from aiogram.types import (
     Message,
@@ -20,45 +23,93 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
 import chess
-import chess.pgn
 
-from boardrender import render_board_png, render_move_gif, render_line_gif
-from loadgames import getlastlichessgames, getlastchesscomgames
+from assetstore import collect_garbage
+from boardrender import render_board_png
+from diagnostics import capture
+from jobqueue import JobQueue
+from metrics import HANDLER_ERRORS, HANDLER_SECONDS, Callback, start_metrics_server, timed
+from rendercache import RENDER_CACHE
+from syncscheduler import SyncScheduler, has_new_games
+from loadgames import (
+    fetch_lichess_correspondence,
+    fetch_lichess_games,
+    fetch_chesscom_games,
+    lichess_user_exists,
+    chesscom_user_exists,
+    close_session,
+    FetchError,
+)
 from stockfishanalyse import (
     findmove,
     geteval,
-    stockfish_best_move,
+    stockfish_principal_variation,
     evaluate_move,
+    get_analysis_farm,
+    close_engine_pool,
 )
 from connection import (
     init_db,
     upsert_user,
     get_user_nicks,
-    get_all_users,
-    save_game,
+    save_games,
     save_blunders,
-    load_unsolved_blunders,
-    get_game_pgn,
+    load_blunder_page,
+    load_blunder,
     mark_blunder_solved,
-    get_fen_at_move,
+    replay_plies,
+    opponent_name,
     get_blunder_id,
-    update_blunder_assets,
+    get_game,
+    update_blunder_lines,
+    live_render_assets,
+    get_sync_mark,
+    set_sync_mark,
+    mark_synced,
+    touch_user_activity,
+    run_db,
+    queue_write,
+    close_db,
 )
 
 logging.basicConfig(level=logging.INFO)
-BOT_TOKEN = ""
+BOT_TOKEN = os.environ.get("BOT_TOKEN", "")
+# свой сервер Bot API (локальный telegram-bot-api или заглушка нагрузочного теста)
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL")
 
-bot = Bot(token=BOT_TOKEN)
+bot = Bot(
+    token=BOT_TOKEN,
+    session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None,
+)
 dp = Dispatcher()
 
 init_db()
 
-MAX_CONCURRENT_GAMES = 3
-MAX_CONCURRENT_BLUNDERS = 4
-
-RENDER_EXECUTOR = ThreadPoolExecutor(max_workers=4)
+JOB_WORKERS = 4
+JOB_MAX_PENDING = 2000
+SYNC_CONCURRENCY = 4
+SYNC_COOLDOWN = 60
+SAVE_BATCH = 50
+ASSET_GC_INTERVAL = 24 * 3600
+# /metrics в формате Prometheus только на localhost; METRICS_PORT=0 — выключить
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9108"))
+# /diag [секунды] — профиль, снимок памяти и стеки задач в папку diagnostics;
+# то же по SIGUSR1. Команда доступна только чатам из ADMIN_IDS
+ADMIN_IDS = {int(x) for x in os.environ.get("ADMIN_IDS", "").split(",") if x.strip()}
+DIAG_PROFILE_SECONDS = 30
+BLUNDER_PAGE = 20
+# рисовать анимации ошибки заранее (только в ориентации пользователя),
+# иначе — при первом показе карточки
+PREWARM_RENDERS = True
+# углублять оценку только вокруг ходов пользователя (ошибки соперника всё равно не показываются)
+EVAL_USER_PLIES_ONLY = False
+
+JOB_QUEUE = JobQueue(workers=JOB_WORKERS, max_pending=JOB_MAX_PENDING)
 
 pending_binding: dict[int, str] = {}
+_sync_inflight: dict[int, asyncio.Future] = {}
+_sync_results: dict[int, tuple[float, dict[str, int]]] = {}
 
 
 main_kb = ReplyKeyboardMarkup(
@@ -89,209 +140,112 @@ class ErrorsSG(StatesGroup):
     WAIT_ANSWER = State()
     WAIT_FIX = State()
 
-async def _engine_best_move_async(fen: str) -> Optional[chess.Move]:
-    loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(None, stockfish_best_move, fen)
-
-async def _engine_evaluate_move_async(fen: str, move: chess.Move, depth: int = 15) -> int:
-    loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(None, evaluate_move, fen, move, depth)
-
-async def _engine_geteval_async(pgn: str) -> list[int]:
-    loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(None, geteval, pgn)
-
 async def _engine_findmove_async(evals: list[int]) -> list[int]:
     loop = asyncio.get_running_loop()
     return await loop.run_in_executor(None, findmove, evals)
 
-async def lichess_user_exists(nick: str) -> bool:
-    if not nick:
-        return False
-    url = f"https://lichess.org/api/user/{nick}"
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as resp:
-            return resp.status == 200
-
-
-async def chesscom_user_exists(nick: str) -> bool:
-    if not nick:
-        return False
-    url = f"https://api.chess.com/pub/player/{nick.lower()}"
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as resp:
-            return resp.status == 200
-
 def _pretty_source_name(source: str) -> str:
     return "chesscom" if source == "chesscom" else "lichess"
 
-def _get_move_from_pgn(pgn: str, move_idx: int) -> Optional[chess.Move]:
-    game = chess.pgn.read_game(io.StringIO(pgn))
-    if not game:
-        return None
-    for i, mv in enumerate(game.mainline_moves()):
-        if i == move_idx:
-            return mv
-    return None
-
-def _calc_played_san_and_opponent(pgn: str, move_idx: int, user_color: str) -> tuple[str, str]:
-    game = chess.pgn.read_game(io.StringIO(pgn))
-    if not game:
-        return "?", "?"
-    white = game.headers.get("White", "")
-    black = game.headers.get("Black", "")
-    opponent = black if user_color == "w" else white
-    board = game.board()
-    for i, mv in enumerate(game.mainline_moves()):
-        if i == move_idx:
-            try:
-                san = board.san(mv)
-            except:
-                san = "?"
-            return san, opponent
-        board.push(mv)
-    return "?", opponent
-
-async def _best_line_by_iterating(fen: str, plies: int = 6) -> list[chess.Move]:
-    board = chess.Board(fen)
-    line: list[chess.Move] = []
-    for _ in range(plies):
-        mv = await _engine_best_move_async(board.fen())
-        if not mv or mv not in board.legal_moves:
-            break
-        line.append(mv)
-        board.push(mv)
-    return line
-
-def _render_all_gifs_sync(
-    blunder_id: int,
-    fen_before: str,
-    bad_move: Optional[chess.Move],
-    best_move: Optional[chess.Move],
-    cont_line: list[chess.Move],
-):
-    gif_error_w = gif_error_b = gif_best_w = gif_best_b = gif_cont_w = gif_cont_b = None
-    try:
-        if bad_move:
-            w = render_move_gif(fen_before, bad_move, flip=False)
-            b = render_move_gif(fen_before, bad_move, flip=True)
-            gif_error_w, gif_error_b = w.getvalue(), b.getvalue()
-    except Exception:
-        pass
-    try:
-        if best_move:
-            w = render_move_gif(fen_before, best_move, flip=False)
-            b = render_move_gif(fen_before, best_move, flip=True)
-            gif_best_w, gif_best_b = w.getvalue(), b.getvalue()
-    except Exception:
-        pass
-    try:
-        if cont_line:
-            board_after = chess.Board(fen_before)
-            if bad_move:
-                board_after.push(bad_move)
-            fen_after = board_after.fen()
-            w = render_line_gif(fen_after, cont_line, flip=False)
-            b = render_line_gif(fen_after, cont_line, flip=True)
-            gif_cont_w, gif_cont_b = w.getvalue(), b.getvalue()
-    except Exception:
-        pass
-    update_blunder_assets(
-        blunder_id=blunder_id,
+async def _best_line(fen: str, plies: int = 6, owner=None) -> list[chess.Move]:
+    lines = await stockfish_principal_variation(fen, owner=owner)
+    if not lines:
+        return []
+    return lines[0]["pv"][:plies]
+
+@timed("engine_line")
+async def engine_line_job(payload: dict):
+    chat_id, fen_before = payload["chat_id"], payload["fen"]
+    bl_id = await run_db(get_blunder_id, payload["game_id"], payload["move_index"])
+    if bl_id is None:
+        return
+    bad_move = chess.Move.from_uci(payload["played_uci"]) if payload["played_uci"] else None
+    lines = await stockfish_principal_variation(fen_before, owner=chat_id)
+    best_move = lines[0]["move"] if lines else None
+    board_after = chess.Board(fen_before)
+    if bad_move:
+        board_after.push(bad_move)
+    cont_line = await _best_line(board_after.fen(), plies=6, owner=chat_id)
+
+    await run_db(
+        update_blunder_lines,
+        blunder_id=bl_id,
         best_move_uci=(best_move.uci() if best_move else None),
         cont_line_uci=(" ".join(m.uci() for m in cont_line) if cont_line else None),
-        gif_error_w=gif_error_w,
-        gif_error_b=gif_error_b,
-        gif_best_w=gif_best_w,
-        gif_best_b=gif_best_b,
-        gif_cont_w=gif_cont_w,
-        gif_cont_b=gif_cont_b,
     )
 
-async def _render_and_save_gifs_async(
-    blunder_id: int,
-    fen_before: str,
-    bad_move: Optional[chess.Move],
-    best_move: Optional[chess.Move],
-    cont_line: list[chess.Move],
-):
-    loop = asyncio.get_running_loop()
-    await loop.run_in_executor(
-        RENDER_EXECUTOR,
-        _render_all_gifs_sync,
-        blunder_id,
-        fen_before,
-        bad_move,
-        best_move,
-        cont_line,
+    if PREWARM_RENDERS:
+        await JOB_QUEUE.enqueue("render", {
+            "fen": fen_before,
+            "played_uci": payload["played_uci"],
+            "best_uci": best_move.uci() if best_move else None,
+            "cont_uci": [m.uci() for m in cont_line],
+            "flip": payload["user_color"] == "b",
+        }, dedup_key=f"{payload['game_id']}:{payload['move_index']}")
+
+@timed("render_prewarm")
+async def render_job(payload: dict):
+    await RENDER_CACHE.prewarm(
+        payload["fen"],
+        chess.Move.from_uci(payload["played_uci"]) if payload["played_uci"] else None,
+        chess.Move.from_uci(payload["best_uci"]) if payload["best_uci"] else None,
+        [chess.Move.from_uci(u) for u in payload["cont_uci"]],
+        flip=payload["flip"],
     )
 
-async def process_blunder(
-    game_id: int,
-    idx: int,
-    fen_before: str,
-    pgn: str,
-    sem_bl: asyncio.Semaphore
-):
-    async with sem_bl:
-        bl_id = get_blunder_id(game_id, idx)
-        bad_move = _get_move_from_pgn(pgn, idx)
-        best_move = await _engine_best_move_async(fen_before)
-        cont_line: list[chess.Move] = []
-        try:
-            board_after = chess.Board(fen_before)
-            if bad_move:
-                board_after.push(bad_move)
-            cont_line = await _best_line_by_iterating(board_after.fen(), plies=6)
-        except Exception:
-            pass
-
-        update_blunder_assets(
-            blunder_id=bl_id,
-            best_move_uci=(best_move.uci() if best_move else None),
-            cont_line_uci=(" ".join(m.uci() for m in cont_line) if cont_line else None),
-            gif_error_w=None, gif_error_b=None,
-            gif_best_w=None, gif_best_b=None,
-            gif_cont_w=None, gif_cont_b=None,
-        )
-
-        asyncio.create_task(
-            _render_and_save_gifs_async(bl_id, fen_before, bad_move, best_move, cont_line)
-        )
-
+async def _find_user_blunders(chat_id: int, pgn: str, user_color: str) -> dict[int, dict]:
+    evals = await geteval(pgn, owner=chat_id, side=(user_color if EVAL_USER_PLIES_ONLY else None))
+    bad_idxs = await _engine_findmove_async(evals)
+    plies = replay_plies(pgn, bad_idxs)
+    return {idx: ply for idx, ply in plies.items() if ply["side_to_move"] == user_color}
+
+async def _save_user_blunders(chat_id: int, game_id: int, pgn: str, user_color: str, plies: dict[int, dict]) -> int:
+    if not plies:
+        return 0
+    opponent = opponent_name(pgn, user_color)
+    bls = [{"move_index": idx, "opponent": opponent, **ply} for idx, ply in plies.items()]
+    await run_db(save_blunders, game_id, bls)
+    for b in bls:
+        await JOB_QUEUE.enqueue("engine_line", {
+            "chat_id": chat_id,
+            "game_id": game_id,
+            "move_index": b["move_index"],
+            "fen": b["fen"],
+            "played_uci": b["played_uci"],
+            "user_color": user_color,
+        }, dedup_key=f"{game_id}:{b['move_index']}")
+    return len(bls)
+
+@timed("analyse_game")
 async def analyse_game(
     chat_id: int,
-    source: str,
+    game_id: int,
     pgn: str,
-    sem_games: asyncio.Semaphore
+    user_color: str
 ) -> tuple[int, int]:
-    async with sem_games:
-        game_id, is_new = save_game(chat_id, source, pgn)
-        if not is_new:
-            return 0, 0
-        try:
-            evals = await _engine_geteval_async(pgn)
-            bad_idxs = await _engine_findmove_async(evals)
-        except Exception:
-            return 1, 0
+    if user_color not in ("w", "b"):
+        # ника нет среди игроков — задач из этой партии не будет
+        return 1, 0
+    try:
+        plies = await _find_user_blunders(chat_id, pgn, user_color)
+    except Exception as e:
+        # партия уже сохранена: анализ повторит очередь заданий
+        logging.warning("Анализ партии %d не удался, повторим позже: %r", game_id, e)
+        await JOB_QUEUE.enqueue("reanalysis", {"game_id": game_id}, dedup_key=str(game_id))
+        return 1, 0
+    return 1, await _save_user_blunders(chat_id, game_id, pgn, user_color, plies)
+
+@timed("reanalysis")
+async def reanalysis_job(payload: dict):
+    game = await run_db(get_game, payload["game_id"])
+    if game is None or game["user_color"] not in ("w", "b"):
+        return
+    plies = await _find_user_blunders(game["chat_id"], game["pgn"], game["user_color"])
+    await _save_user_blunders(game["chat_id"], game["game_id"], game["pgn"], game["user_color"], plies)
 
-        bls = []
-        for idx in bad_idxs:
-            try:
-                fen = get_fen_at_move(pgn, idx)
-                bls.append((idx, fen))
-            except:
-                continue
-        if not bls:
-            return 1, 0
-
-        save_blunders(game_id, bls)
-        sem_bl = asyncio.Semaphore(MAX_CONCURRENT_BLUNDERS)
-        await asyncio.gather(*[
-            process_blunder(game_id, idx, fen, pgn, sem_bl)
-            for idx, fen in bls
-        ])
-        return 1, len(bls)
+JOB_QUEUE.register("engine_line", engine_line_job)
+JOB_QUEUE.register("render", render_job)
+JOB_QUEUE.register("reanalysis", reanalysis_job)
 
 async def sync_for_user(
     chat_id: int,
@@ -299,19 +253,104 @@ async def sync_for_user(
     max_games: int = 30,
     silent: bool = False
 ) -> dict[str, int]:
-    lichess_nick, chesscom_nick = get_user_nicks(chat_id)
-    sem_games = asyncio.Semaphore(MAX_CONCURRENT_GAMES)
+    # одна синхронизация на пользователя: повторные запросы ждут идущую,
+    # а сразу после неё получают её же результат
+    loop = asyncio.get_running_loop()
+    recent = _sync_results.get(chat_id)
+    if recent is not None and loop.time() - recent[0] < SYNC_COOLDOWN:
+        return recent[1]
+
+    fut = _sync_inflight.get(chat_id)
+    if fut is None:
+        fut = asyncio.ensure_future(_sync_for_user(chat_id, period_days, max_games, silent))
+        _sync_inflight[chat_id] = fut
+
+        def _done(f: asyncio.Future):
+            _sync_inflight.pop(chat_id, None)
+            if f.cancelled() or f.exception() is not None:
+                return
+            now = loop.time()
+            for stale in [c for c, (at, _) in _sync_results.items() if now - at >= SYNC_COOLDOWN]:
+                del _sync_results[stale]
+            _sync_results[chat_id] = (now, f.result())
+
+        fut.add_done_callback(_done)
+    return await asyncio.shield(fut)
+
+@timed("sync")
+async def _sync_for_user(
+    chat_id: int,
+    period_days: int,
+    max_games: int,
+    silent: bool
+) -> dict[str, int]:
+    started_at = time.time()
+    lichess_nick, chesscom_nick = await run_db(get_user_nicks, chat_id)
+    farm = await get_analysis_farm()
     tasks = []
+    marks = []
+    complete = True
+
+    async def ingest(source: str, batch: list[str]):
+        for game_id, pgn, user_color in await run_db(save_games, chat_id, source, batch):
+            tasks.append(farm.submit(chat_id, analyse_game(chat_id, game_id, pgn, user_color)))
+        batch.clear()
 
     if lichess_nick:
-        for pgn in getlastlichessgames(lichess_nick, max_games=max_games, period=period_days):
-            tasks.append(analyse_game(chat_id, "lichess", pgn, sem_games))
+        since = await run_db(get_sync_mark, chat_id, "lichess", lichess_nick)
+        newest = since or 0
+        batch = []
+        fetched = 0
+        try:
+            async for g in fetch_lichess_games(lichess_nick, max_games=max_games, period=period_days, since=since):
+                fetched += 1
+                batch.append(g["pgn"])
+                newest = max(newest, g["ts"])
+                if len(batch) >= SAVE_BATCH:
+                    await ingest("lichess", batch)
+        except FetchError as e:
+            logging.warning("Lichess %s: %s", lichess_nick, e)
+            newest = since or 0
+            complete = False
+        await ingest("lichess", batch)
+        if newest > (since or 0):
+            marks.append(("lichess", lichess_nick, newest))
+
+        # заочные — со своей отметкой и в пределах того же max_games
+        left = max_games - fetched
+        if left > 0:
+            since = await run_db(get_sync_mark, chat_id, "lichess_correspondence", lichess_nick)
+            try:
+                games, corr_mark = await fetch_lichess_correspondence(
+                    lichess_nick, max_games=left, period=period_days, since=since
+                )
+            except FetchError as e:
+                logging.warning("Lichess (заочные) %s: %s", lichess_nick, e)
+                games, corr_mark = [], None
+                complete = False
+            await ingest("lichess", [g["pgn"] for g in games])
+            if corr_mark is not None and corr_mark > (since or 0):
+                marks.append(("lichess_correspondence", lichess_nick, corr_mark))
 
     if chesscom_nick:
-        for pgn in getlastchesscomgames(chesscom_nick, max_games=max_games, period=period_days):
-            tasks.append(analyse_game(chat_id, "chesscom", pgn, sem_games))
+        since = await run_db(get_sync_mark, chat_id, "chesscom", chesscom_nick)
+        chesscom_complete = True
+        try:
+            games = await fetch_chesscom_games(chesscom_nick, max_games=max_games, period=period_days, since=since)
+        except FetchError as e:
+            logging.warning("Chess.com %s: %s", chesscom_nick, e)
+            games, chesscom_complete = e.games, False
+            complete = False
+        await ingest("chesscom", [g["pgn"] for g in games])
+        if chesscom_complete and games:
+            marks.append(("chesscom", chesscom_nick, max(g["ts"] for g in games)))
 
     results = await asyncio.gather(*tasks)
+    for provider, nick, last_seen in marks:
+        await run_db(set_sync_mark, chat_id, provider, nick, last_seen)
+    if complete:
+        # проба профиля сравнивает «был на сайте» с этим моментом
+        await run_db(mark_synced, chat_id, started_at)
     new_games = sum(r[0] for r in results)
     new_blunders = sum(r[1] for r in results)
 
@@ -329,16 +368,53 @@ async def sync_for_user(
 
     return {"new_games": new_games, "new_blunders": new_blunders}
 
-async def auto_sync_loop():
-    await asyncio.sleep(5)
+async def _scheduled_sync(chat_id: int):
+    farm = await get_analysis_farm()
+    await farm.submit(chat_id, sync_for_user(chat_id, silent=True))
+
+SYNC_SCHEDULER = SyncScheduler(_scheduled_sync, has_new_games, concurrency=SYNC_CONCURRENCY)
+
+async def _oldest_pending_job() -> float:
+    return (await JOB_QUEUE.stats())["oldest_pending_age"]
+
+Callback("chessbot_jobs", "Очередь заданий: незавершённые, выполняемые, воркеры", JOB_QUEUE.snapshot, labels=("state",))
+Callback("chessbot_jobs_oldest_pending_seconds", "Возраст старейшего ждущего задания", _oldest_pending_job)
+Callback("chessbot_sync_running", "Идущие автосинхронизации", lambda: SYNC_SCHEDULER.stats()["running"])
+Callback(
+    "chessbot_sync_total", "Автосинхронизации по итогу",
+    lambda: {k: v for k, v in SYNC_SCHEDULER.stats().items() if k != "running"}, labels=("result",), kind="counter",
+)
+Callback("chessbot_sync_inflight", "Синхронизации в работе (ручные и авто)", lambda: len(_sync_inflight))
+
+@dp.message.outer_middleware()
+async def track_activity(handler, event: Message, data: dict):
+    queue_write(touch_user_activity, event.chat.id)
+    return await handler(event, data)
+
+@dp.message.middleware()
+@dp.callback_query.middleware()
+async def measure_handler(handler, event, data: dict):
+    # внутренний middleware: обработчик уже выбран фильтрами
+    name = data["handler"].callback.__name__
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    try:
+        return await handler(event, data)
+    except Exception:
+        HANDLER_ERRORS.inc(handler=name)
+        raise
+    finally:
+        HANDLER_SECONDS.observe(loop.time() - started, handler=name)
+
+async def asset_gc_loop():
     while True:
-        users = get_all_users()
-        for u in users:
-            try:
-                await sync_for_user(u["chat_id"], silent=True)
-            except:
-                pass
-        await asyncio.sleep(8 * 3600)
+        await asyncio.sleep(ASSET_GC_INTERVAL)
+        try:
+            live = await run_db(live_render_assets)
+            removed = await asyncio.to_thread(collect_garbage, live)
+            logging.info("GC анимаций: удалено файлов: %d", removed)
+        except Exception:
+            logging.exception("GC анимаций завершился ошибкой")
 
 @dp.message(Command("start"))
 async def cmd_start(message: Message):
@@ -349,9 +425,28 @@ async def cmd_start(message: Message):
         reply_markup=main_kb,
     )
 
+@dp.message(Command("diag"), F.chat.id.in_(ADMIN_IDS))
+async def cmd_diag(message: Message):
+    arg = (message.text or "").split()[1:]
+    seconds = float(arg[0]) if arg and arg[0].replace(".", "", 1).isdigit() else DIAG_PROFILE_SECONDS
+    await message.answer(f"🩺 Снимаю диагностику, профиль {seconds:.0f} с…")
+    try:
+        paths = await capture(seconds)
+    except RuntimeError as e:
+        return await message.answer(f"⚠️ {e}")
+    await message.answer("🩺 Готово:\n" + "\n".join(f"• {p}" for p in paths))
+
+async def _diag_on_signal():
+    try:
+        paths = await capture(DIAG_PROFILE_SECONDS)
+    except Exception:
+        logging.exception("Диагностика по сигналу не удалась")
+        return
+    logging.info("Диагностика записана: %s", ", ".join(paths))
+
 @dp.message(F.text == "👤 Профиль")
 async def open_profile(message: Message):
-    l, c = get_user_nicks(message.chat.id)
+    l, c = await run_db(get_user_nicks, message.chat.id)
     await message.answer(
         f"👤 Твой профиль:\n"
         f"• ID: {message.chat.id}\n"
@@ -391,7 +486,7 @@ async def bind_lichess(m: Message):
     # отмена при нажатии "Назад"
     if text == "🏠 Назад":
         pending_binding.pop(m.chat.id, None)
-        l, c = get_user_nicks(m.chat.id)
+        l, c = await run_db(get_user_nicks, m.chat.id)
         await m.answer(
             f"👤 Твой профиль:\n"
             f"• ID: {m.chat.id}\n"
@@ -408,7 +503,7 @@ async def bind_lichess(m: Message):
         await m.answer("❌ Lichess не найден. Привязка отменена.", reply_markup=profile_kb)
         return
 
-    upsert_user(m.chat.id, lichess=nick)
+    await run_db(upsert_user, m.chat.id, lichess=nick)
     pending_binding.pop(m.chat.id, None)
     await m.answer(f"✅ Lichess привязан: `{nick}`", reply_markup=profile_kb)
 
@@ -424,7 +519,7 @@ async def bind_chesscom(m: Message):
     # отмена при нажатии "Назад"
     if text == "🏠 Назад":
         pending_binding.pop(m.chat.id, None)
-        l, c = get_user_nicks(m.chat.id)
+        l, c = await run_db(get_user_nicks, m.chat.id)
         await m.answer(
             f"👤 Твой профиль:\n"
             f"• ID: {m.chat.id}\n"
@@ -440,7 +535,7 @@ async def bind_chesscom(m: Message):
         await m.answer("❌ Chesscom не найден. Привязка отменена.", reply_markup=profile_kb)
         return
 
-    upsert_user(m.chat.id, chesscom=nick)
+    await run_db(upsert_user, m.chat.id, chesscom=nick)
     pending_binding.pop(m.chat.id, None)
     await m.answer(f"✅ Chesscom привязан: `{nick}`", reply_markup=profile_kb)
 
@@ -460,76 +555,40 @@ async def sync_games(m: Message):
 @dp.message(F.text == "📋 Мои ошибки")
 async def show_errors(message: Message, state: FSMContext):
     chat_id = message.chat.id
-    l, c = get_user_nicks(chat_id)
-    rows = load_unsolved_blunders(chat_id)
-    if not rows:
+    ids = await run_db(load_blunder_page, chat_id, None, BLUNDER_PAGE)
+    if not ids:
         return await message.answer("📭 Задач нет. Синхронизируй партии.", reply_markup=analysis_kb)
 
-    user_blunders = []
-    for r in rows:
-        game_id, idx, fen, src = (
-            r["game_id"], r["move_index"], r["fen_before"], r["source"]
-        )
-        pgn = get_game_pgn(game_id)
-        if not pgn:
-            continue
-        game = chess.pgn.read_game(io.StringIO(pgn))
-        if not game:
-            continue
-
-        white = game.headers.get("White", "").lower()
-        black = game.headers.get("Black", "").lower()
-        nick = ((l if src == "lichess" else c) or "").lower()
-
-        if nick not in (white, black):
-            continue
-        color = "w" if nick == white else "b"
-        if fen.split()[1] != color:
-            continue
-
-        user_blunders.append({
-            "idx": len(user_blunders),
-            "blunder_id": r["blunder_id"],
-            "game_id": game_id,
-            "move_idx": idx,
-            "fen": fen,
-            "source": src,
-            "user_color": color,
-            "gif_error_w": r["gif_error_w"],
-            "gif_error_b": r["gif_error_b"],
-            "gif_best_w":  r["gif_best_w"],
-            "gif_best_b":  r["gif_best_b"],
-            "gif_cont_w":  r["gif_cont_w"],
-            "gif_cont_b":  r["gif_cont_b"],
-            "best_move_uci": r["best_move_uci"],
-            "cont_line_uci": r["cont_line_uci"],
-        })
-
-    if not user_blunders:
-        return await message.answer("📭 Нет задач для твоего цвета.", reply_markup=analysis_kb)
-
-    attempts = {b["blunder_id"]: 0 for b in user_blunders}
-    await state.update_data(errors=user_blunders, current_idx=0, attempts=attempts)
+    # в FSM только id текущей страницы и курсор — сами задачи читаются из БД по одной
+    await state.set_data({"ids": ids, "cursor": ids[-1], "current_id": ids[0], "attempts": {}})
     await state.set_state(ErrorsSG.WAIT_ANSWER)
-    await _send_error_card(bot, chat_id, user_blunders[0])
+    await _show_task(bot, chat_id, ids[0])
+
+async def _current_error(chat_id: int, state: FSMContext) -> Optional[dict]:
+    data = await state.get_data()
+    blunder_id = data.get("current_id")
+    if blunder_id is None:
+        return None
+    return await run_db(load_blunder, chat_id, blunder_id)
+
+async def _show_task(bot: Bot, chat_id: int, blunder_id: int) -> bool:
+    err = await run_db(load_blunder, chat_id, blunder_id)
+    if err is None:
+        await bot.send_message(chat_id, "❗ Недоступно.")
+        return False
+    await _send_error_card(bot, chat_id, err)
+    return True
 
 async def _send_error_card(bot: Bot, chat_id: int, err: dict):
-    pgn = get_game_pgn(err["game_id"])
     flip = (err["user_color"] == "b")
-    blob = err["gif_error_b"] if flip else err["gif_error_w"]
-
-    if blob:
-        file_obj = BufferedInputFile(blob, filename="move.gif")
+    if err["played_uci"]:
+        gif = await RENDER_CACHE.move_gif(err["fen"], chess.Move.from_uci(err["played_uci"]), flip)
+        file_obj = BufferedInputFile(gif, filename="move.gif")
     else:
-        move = _get_move_from_pgn(pgn, err["move_idx"])
-        if move:
-            gif = render_move_gif(err["fen"], move, square_size=200, flip=flip)
-            file_obj = BufferedInputFile(gif.getvalue(), filename=gif.name)
-        else:
-            png = render_board_png(err["fen"], square_size=200, flip=flip)
-            file_obj = BufferedInputFile(png.getvalue(), filename=png.name)
-
-    san, opp = _calc_played_san_and_opponent(pgn, err["move_idx"], err["user_color"])
+        png = render_board_png(err["fen"], square_size=200, flip=flip)
+        file_obj = BufferedInputFile(png.getvalue(), filename=png.name)
+
+    san, opp = err["played_san"] or "?", err["opponent"] or "?"
     move_no = err["move_idx"] // 2 + 1
     src = _pretty_source_name(err["source"])
 
@@ -538,16 +597,22 @@ async def _send_error_card(bot: Bot, chat_id: int, err: dict):
         f"Ход №{move_no}: вы сыграли «{san}», позиция ухудшилась.\n\n"
         "Выберите действие:"
     )
+    bid = err["blunder_id"]
     kb = InlineKeyboardMarkup(inline_keyboard=[
         [
-            InlineKeyboardButton(text="📌 Решение", callback_data=f"soln:{err['idx']}"),
-            InlineKeyboardButton(text="📈 Продолжение", callback_data=f"cont:{err['idx']}"),
+            InlineKeyboardButton(text="📌 Решение", callback_data=f"soln:{bid}"),
+            InlineKeyboardButton(text="📈 Продолжение", callback_data=f"cont:{bid}"),
         ],
-        [InlineKeyboardButton(text="🛠 Исправить ход", callback_data=f"try:{err['idx']}")],
+        [InlineKeyboardButton(text="🛠 Исправить ход", callback_data=f"try:{bid}")],
         [InlineKeyboardButton(text="🏠 Главное меню", callback_data="back_to_main")],
     ])
     await bot.send_document(chat_id, document=file_obj, caption=caption, reply_markup=kb)
 
+def _next_kb(blunder_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="➡️ Следующая задача", callback_data=f"next:{blunder_id}")]
+    ])
+
 @dp.callback_query(F.data == "back_to_main")
 async def on_back_to_main(query: CallbackQuery, state: FSMContext):
     await query.answer()
@@ -561,44 +626,37 @@ async def on_back_to_main(query: CallbackQuery, state: FSMContext):
 @dp.callback_query(F.data.startswith("soln:"))
 async def on_show_solution(query: CallbackQuery, state: FSMContext):
     await query.answer()
-    data = await state.get_data()
-    errors = data.get("errors", [])
-    if not errors:
-        return await query.message.answer("📭 Задач нет.")
-    idx = int(query.data.split(":", 1)[1])
-    if idx < 0 or idx >= len(errors):
+    blunder_id = int(query.data.split(":", 1)[1])
+    err = await run_db(load_blunder, query.message.chat.id, blunder_id)
+    if err is None:
         return await query.message.answer("❗ Недоступно.")
-    err = errors[idx]
-    flip = err["user_color"] == "b"
-    blob = err["gif_best_b"] if flip else err["gif_best_w"]
-    if not blob:
+    if not err["best_move_uci"]:
         return await query.message.answer("⏳ Решение ещё не готово.")
+    flip = err["user_color"] == "b"
+    blob = await RENDER_CACHE.move_gif(err["fen"], chess.Move.from_uci(err["best_move_uci"]), flip)
     animation = BufferedInputFile(blob, filename="best.gif")
-    mark_blunder_solved(err["blunder_id"])
-    kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="➡️ Следующая задача", callback_data=f"next:{idx}")]
-    ])
-    await query.message.answer_animation(animation, caption="💡 Лучший ход:", reply_markup=kb)
-    await state.update_data(current_idx=idx)
+    await run_db(mark_blunder_solved, blunder_id)
+    await query.message.answer_animation(animation, caption="💡 Лучший ход:", reply_markup=_next_kb(blunder_id))
+    await state.update_data(current_id=blunder_id)
 
 @dp.callback_query(F.data.startswith("cont:"))
 async def on_cont(query: CallbackQuery, state: FSMContext):
     await query.answer()
-    data = await state.get_data()
-    errors = data.get("errors", [])
-    if not errors:
-        return await query.message.answer("📭 Задач нет.")
-    idx = int(query.data.split(":", 1)[1])
-    if idx < 0 or idx >= len(errors):
+    blunder_id = int(query.data.split(":", 1)[1])
+    err = await run_db(load_blunder, query.message.chat.id, blunder_id)
+    if err is None:
         return await query.message.answer("❗ Недоступно.")
-    err = errors[idx]
-    flip = err["user_color"] == "b"
-    blob = err["gif_cont_b"] if flip else err["gif_cont_w"]
-    if not blob:
+    if not err["cont_line_uci"]:
         return await query.message.answer("⏳ Продолжение ещё не готово.")
+    flip = err["user_color"] == "b"
+    board_after = chess.Board(err["fen"])
+    if err["played_uci"]:
+        board_after.push(chess.Move.from_uci(err["played_uci"]))
+    cont_line = [chess.Move.from_uci(u) for u in err["cont_line_uci"].split()]
+    blob = await RENDER_CACHE.line_gif(board_after.fen(), cont_line, flip)
     animation = BufferedInputFile(blob, filename="cont.gif")
     kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="↩️ Вернуться к задаче", callback_data=f"back_to_task:{idx}")]
+        [InlineKeyboardButton(text="↩️ Вернуться к задаче", callback_data=f"back_to_task:{blunder_id}")]
     ])
     await query.message.answer_animation(animation, caption="📈 Продолжение движка:", reply_markup=kb)
 
@@ -613,23 +671,34 @@ async def on_back_to_task(query: CallbackQuery):
 @dp.callback_query(F.data.startswith("try:"))
 async def on_try(query: CallbackQuery, state: FSMContext):
     await query.answer()
-    idx = int(query.data.split(":", 1)[1])
-    await state.update_data(current_idx=idx)
+    blunder_id = int(query.data.split(":", 1)[1])
+    await state.update_data(current_id=blunder_id)
     await state.set_state(ErrorsSG.WAIT_FIX)
     await query.message.answer("✏️ Введи ход в SAN (например Nf3). 🏠 Назад — отмена.", reply_markup=None)
 
 @dp.callback_query(F.data.startswith("next:"))
 async def on_next_task(query: CallbackQuery, state: FSMContext):
     await query.answer()
+    chat_id = query.message.chat.id
     data = await state.get_data()
-    errors = data.get("errors", [])
+    ids = data.get("ids", [])
     prev = int(query.data.split(":", 1)[1])
-    nxt = prev + 1
-    if nxt >= len(errors):
-        await query.message.answer("🎉 Это была последняя задача.", reply_markup=analysis_kb)
-        return await state.clear()
-    await state.update_data(current_idx=nxt)
-    await _send_error_card(bot, query.message.chat.id, errors[nxt])
+    pos = ids.index(prev) + 1 if prev in ids else len(ids)
+
+    if pos >= len(ids):
+        # страница кончилась — следующая по курсору
+        cursor = data.get("cursor")
+        ids = await run_db(load_blunder_page, chat_id, cursor, BLUNDER_PAGE) if cursor is not None else []
+        if not ids:
+            await query.message.answer("🎉 Это была последняя задача.", reply_markup=analysis_kb)
+            return await state.clear()
+        pos = 0
+        await state.update_data(ids=ids, cursor=ids[-1], attempts={})
+
+    nxt = ids[pos]
+    await state.update_data(current_id=nxt)
+    await state.set_state(ErrorsSG.WAIT_ANSWER)
+    await _show_task(bot, chat_id, nxt)
 
 @dp.message(ErrorsSG.WAIT_ANSWER)
 async def process_user_attempt(message: Message, state: FSMContext):
@@ -638,14 +707,11 @@ async def process_user_attempt(message: Message, state: FSMContext):
         await state.clear()
         return await message.answer("🏠 Главное меню", reply_markup=main_kb)
 
-    data = await state.get_data()
-    errors = data.get("errors", [])
-    idx = data.get("current_idx", 0)
-    if not errors:
+    err = await _current_error(message.chat.id, state)
+    if err is None:
         await state.clear()
         return await message.answer("📭 Нет задач.", reply_markup=analysis_kb)
 
-    err = errors[idx]
     solved = False
     if txt:
         try:
@@ -660,12 +726,10 @@ async def process_user_attempt(message: Message, state: FSMContext):
                 solved = False
 
     if solved:
-        mark_blunder_solved(err["blunder_id"])
-        kb = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="➡️ Следующая задача", callback_data=f"next:{idx}")]
-        ])
-        return await message.answer("✅ Верно!", reply_markup=kb)
+        await run_db(mark_blunder_solved, err["blunder_id"])
+        return await message.answer("✅ Верно!", reply_markup=_next_kb(err["blunder_id"]))
 
+    data = await state.get_data()
     attempts = data.get("attempts", {})
     attempts[err["blunder_id"]] = attempts.get(err["blunder_id"], 0) + 1
     await state.update_data(attempts=attempts)
@@ -680,9 +744,10 @@ async def process_fix_input(message: Message, state: FSMContext):
         await state.set_state(ErrorsSG.WAIT_ANSWER)
         return await message.answer("↩️ Возврат к задаче.", reply_markup=analysis_kb)
 
-    data = await state.get_data()
-    idx = data["current_idx"]
-    err = data["errors"][idx]
+    err = await _current_error(message.chat.id, state)
+    if err is None:
+        await state.clear()
+        return await message.answer("📭 Нет задач.", reply_markup=analysis_kb)
     best_uci = err.get("best_move_uci")
     if not best_uci:
         await state.set_state(ErrorsSG.WAIT_ANSWER)
@@ -696,16 +761,13 @@ async def process_fix_input(message: Message, state: FSMContext):
         return await message.answer("❗ Ошибка парсинга. Попробуй снова в SAN.")
 
     if mv.uci() == best_uci:
-        mark_blunder_solved(err["blunder_id"])
+        await run_db(mark_blunder_solved, err["blunder_id"])
         await state.set_state(ErrorsSG.WAIT_ANSWER)
-        kb = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="➡️ Следующая задача", callback_data=f"next:{idx}")]
-        ])
-        return await message.answer("✅ Отлично!", reply_markup=kb)
+        return await message.answer("✅ Отлично!", reply_markup=_next_kb(err["blunder_id"]))
 
     try:
-        user_score = await _engine_evaluate_move_async(err["fen"], mv)
-        best_score = await _engine_evaluate_move_async(err["fen"], chess.Move.from_uci(best_uci))
+        user_score = await evaluate_move(err["fen"], mv, owner=message.chat.id)
+        best_score = await evaluate_move(err["fen"], chess.Move.from_uci(best_uci), owner=message.chat.id)
     except:
         await state.set_state(ErrorsSG.WAIT_ANSWER)
         return await message.answer("⚠️ Не удалось оценить ход. Повтори попытку.")
@@ -713,11 +775,8 @@ async def process_fix_input(message: Message, state: FSMContext):
     diff = best_score - user_score
     await state.set_state(ErrorsSG.WAIT_ANSWER)
     if diff <= 50:
-        mark_blunder_solved(err["blunder_id"])
-        kb = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="➡️ Следующая задача", callback_data=f"next:{idx}")]
-        ])
-        return await message.answer("✅ Достаточно хорошо!", reply_markup=kb)
+        await run_db(mark_blunder_solved, err["blunder_id"])
+        return await message.answer("✅ Достаточно хорошо!", reply_markup=_next_kb(err["blunder_id"]))
 
     return await message.answer(f"❌ Уступаешь на {diff} ц.п. Попробуй снова или «📌 Решение».")
 
@@ -731,8 +790,27 @@ async def fallback(message: Message):
     await message.answer("🤔 Не понял. Используй меню ниже ⬇️", reply_markup=main_kb)
 
 async def main():
-    asyncio.create_task(auto_sync_loop())
-    await dp.start_polling(bot)
+    await get_analysis_farm()
+    await JOB_QUEUE.start()
+    SYNC_SCHEDULER.start()
+    asyncio.create_task(asset_gc_loop())
+    metrics_runner = await start_metrics_server(METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
+    if hasattr(signal, "SIGUSR1"):
+        # на Windows сигнала нет — там только /diag
+        with contextlib.suppress(NotImplementedError):
+            asyncio.get_running_loop().add_signal_handler(
+                signal.SIGUSR1, lambda: asyncio.ensure_future(_diag_on_signal())
+            )
+    try:
+        await dp.start_polling(bot)
+    finally:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await SYNC_SCHEDULER.close()
+        await JOB_QUEUE.close()
+        await close_engine_pool()
+        await close_session()
+        close_db()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -1,14 +1,135 @@
+import asyncio
+import contextlib
+import functools
+import queue
+import random
 import sqlite3
+import time
+import hashlib
+import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
 import chess
 import chess.pgn
 import io
 
+from metrics import DB_SECONDS, DB_WAIT_SECONDS, Callback, stage
+
 DB_PATH = "bot.db"
+BUSY_TIMEOUT_MS = 30000
+WRITE_BATCH = 64
+
+# Всё обращение к SQLite идёт через один поток с одним долгоживущим
+# соединением: из других потоков функции ниже ставятся в его очередь,
+# из asyncio — через run_db, записи из рендер-воркеров — через queue_write.
+_local = threading.local()
+_conn: sqlite3.Connection | None = None
+_pending_writes: queue.SimpleQueue = queue.SimpleQueue()
+
+def _mark_db_thread():
+    _local.on_db_thread = True
+
+_DB_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite", initializer=_mark_db_thread)
+
+Callback(
+    "chessbot_db_queue_depth", "Вызовы и записи, ждущие поток SQLite",
+    lambda: {"calls": _DB_EXECUTOR._work_queue.qsize(), "writes": _pending_writes.qsize()},
+    labels=("queue",),
+)
 
 def get_connection():
-    conn = sqlite3.connect(DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES)
-    conn.row_factory = sqlite3.Row
-    return conn
+    global _conn
+    if _conn is None:
+        conn = sqlite3.connect(
+            DB_PATH,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False,
+            cached_statements=256,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        _conn = conn
+    return _conn
+
+def _on_db_thread(fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if getattr(_local, "on_db_thread", False):
+            return fn(*args, **kwargs)
+        return _DB_EXECUTOR.submit(fn, *args, **kwargs).result()
+    return wrapper
+
+@contextlib.contextmanager
+def _transaction(conn):
+    # вложенные вызовы (пачка из queue_write) остаются в одной транзакции
+    if getattr(_local, "tx_depth", 0):
+        _local.tx_depth += 1
+        try:
+            yield
+        finally:
+            _local.tx_depth -= 1
+        return
+    _local.tx_depth = 1
+    try:
+        with conn:
+            yield
+    finally:
+        _local.tx_depth = 0
+
+def _timed_db_call(queued_at: float, fn, args, kwargs):
+    started = time.perf_counter()
+    DB_WAIT_SECONDS.observe(started - queued_at)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        DB_SECONDS.observe(time.perf_counter() - started, fn=getattr(fn, "__name__", "?"))
+
+async def run_db(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_DB_EXECUTOR, _timed_db_call, time.perf_counter(), fn, args, kwargs)
+
+def queue_write(fn, *args, **kwargs) -> Future:
+    fut = Future()
+    _pending_writes.put((fn, args, kwargs, fut))
+    _DB_EXECUTOR.submit(_flush_writes)
+    return fut
+
+def _flush_writes():
+    batch = []
+    while len(batch) < WRITE_BATCH:
+        try:
+            batch.append(_pending_writes.get_nowait())
+        except queue.Empty:
+            break
+    if not batch:
+        return
+
+    conn = get_connection()
+    try:
+        with stage("db_write_batch"), _transaction(conn):
+            results = [fn(*args, **kwargs) for fn, args, kwargs, _ in batch]
+    except Exception:
+        # одна запись сломала пачку — повторяем по одной
+        for fn, args, kwargs, fut in batch:
+            try:
+                fut.set_result(fn(*args, **kwargs))
+            except Exception as e:
+                fut.set_exception(e)
+        return
+    for (*_, fut), res in zip(batch, results):
+        fut.set_result(res)
+
+def close_db():
+    def _close():
+        global _conn
+        _flush_writes()
+        if _conn is not None:
+            _conn.close()
+            _conn = None
+    _DB_EXECUTOR.submit(_close).result()
 
 def _ensure_column(conn, table: str, column: str, ddl: str):
     cols = conn.execute(f"PRAGMA table_info({table})").fetchall()
@@ -16,16 +137,220 @@ def _ensure_column(conn, table: str, column: str, ddl: str):
     if column not in have:
         conn.execute(f"ALTER TABLE {table} ADD COLUMN {ddl}")
 
+_PGN_HEADER_RE = re.compile(r'^\[(\w+) "((?:[^"\\]|\\.)*)"\]', re.MULTILINE)
+
+def pgn_headers(pgn: str) -> dict[str, str]:
+    headers = {}
+    for tag, value in _PGN_HEADER_RE.findall(pgn):
+        headers.setdefault(tag, value)
+    return headers
+
+def make_game_key(source: str, pgn: str) -> str:
+    headers = pgn_headers(pgn)
+    site = headers.get("Site", "")
+    if source == "lichess" and "lichess.org/" in site:
+        return "lichess:" + site.rstrip("/").rsplit("/", 1)[-1]
+    link = headers.get("Link", "")
+    if source == "chesscom" and link:
+        return "chesscom:" + link
+    return "sha1:" + hashlib.sha1(pgn.strip().encode("utf-8")).hexdigest()
+
+def user_color_in_game(pgn: str, nick: str | None) -> str:
+    # "w"/"b" — цвет ника в партии, "" — ника среди игроков нет
+    if not nick:
+        return ""
+    headers = pgn_headers(pgn)
+    nick = nick.lower()
+    if headers.get("White", "").lower() == nick:
+        return "w"
+    if headers.get("Black", "").lower() == nick:
+        return "b"
+    return ""
+
+def _nick_for_source(conn, chat_id: int, source: str) -> str | None:
+    row = conn.execute(
+        "SELECT lichess_nick, chesscom_nick FROM users WHERE chat_id = ?",
+        (chat_id,)
+    ).fetchone()
+    if not row:
+        return None
+    return row["lichess_nick"] if source == "lichess" else row["chesscom_nick"]
+
+def _migrate_game_keys(conn):
+    # старые базы: UNIQUE(chat_id, pgn) -> UNIQUE(chat_id, game_key), таблицу надо пересобрать
+    cols = {c[1] for c in conn.execute("PRAGMA table_info(games)").fetchall()}
+    if not cols or "game_key" in cols:
+        return
+
+    rows = conn.execute(
+        "SELECT game_id, chat_id, source, pgn, synced_at FROM games ORDER BY game_id"
+    ).fetchall()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("""
+            CREATE TABLE games_new (
+              game_id      INTEGER PRIMARY KEY AUTOINCREMENT,
+              chat_id      INTEGER       NOT NULL,
+              source       TEXT          NOT NULL,
+              game_key     TEXT          NOT NULL,
+              pgn          TEXT          NOT NULL,
+              synced_at    TIMESTAMP     DEFAULT CURRENT_TIMESTAMP,
+              FOREIGN KEY(chat_id) REFERENCES users(chat_id),
+              UNIQUE(chat_id, game_key)
+            )
+        """)
+        kept = {}
+        for r in rows:
+            key = make_game_key(r["source"], r["pgn"])
+            first = kept.setdefault((r["chat_id"], key), r["game_id"])
+            if first == r["game_id"]:
+                conn.execute(
+                    "INSERT INTO games_new(game_id, chat_id, source, game_key, pgn, synced_at) "
+                    "VALUES(?,?,?,?,?,?)",
+                    (r["game_id"], r["chat_id"], r["source"], key, r["pgn"], r["synced_at"])
+                )
+                continue
+            # дубликат той же партии: ошибки переносим на оставшуюся запись
+            conn.execute(
+                "UPDATE OR IGNORE blunders SET game_id = ? WHERE game_id = ?",
+                (first, r["game_id"])
+            )
+            conn.execute("DELETE FROM blunders WHERE game_id = ?", (r["game_id"],))
+        conn.execute("DROP TABLE games")
+        conn.execute("ALTER TABLE games_new RENAME TO games")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+_ASSET_KINDS = ("error_w", "error_b", "best_w", "best_b", "cont_w", "cont_b")
+# PRAGMA user_version: GIF-колонки blunders очищены (см. _migrate_gif_blobs)
+_GIF_BLOBS_CLEARED = 1
+
+def _migrate_gif_blobs(conn):
+    # старые базы хранили шесть GIF прямо в blunders. Переносить их незачем:
+    # анимации теперь в render_cache и отрисуются заново по запросу
+    cols = {c[1] for c in conn.execute("PRAGMA table_info(blunders)").fetchall()}
+    if "gif_error_w" not in cols:
+        return
+    # на SQLite < 3.35 пустые колонки остаются: по схеме не понять,
+    # что миграция уже прошла, поэтому отметка в user_version
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= _GIF_BLOBS_CLEARED:
+        return
+
+    try:
+        with _transaction(conn):
+            for kind in _ASSET_KINDS:
+                conn.execute(f"ALTER TABLE blunders DROP COLUMN gif_{kind}")
+    except sqlite3.OperationalError:
+        # SQLite < 3.35 не умеет DROP COLUMN: хотя бы освобождаем место
+        with _transaction(conn):
+            conn.execute(
+                f"UPDATE blunders SET {', '.join(f'gif_{kind} = NULL' for kind in _ASSET_KINDS)}"
+            )
+            conn.execute(f"PRAGMA user_version = {_GIF_BLOBS_CLEARED}")
+    conn.execute("VACUUM")
+
+def _backfill_user_colors(conn):
+    # цвет пользователя считается при сохранении партии; старым партиям — один раз здесь
+    with _transaction(conn):
+        _ensure_column(conn, "games", "user_color", "user_color TEXT")
+    rows = conn.execute(
+        "SELECT g.game_id, g.source, g.pgn, u.lichess_nick, u.chesscom_nick "
+        "FROM games g LEFT JOIN users u ON u.chat_id = g.chat_id "
+        "WHERE g.user_color IS NULL"
+    ).fetchall()
+    if not rows:
+        return
+    with _transaction(conn):
+        conn.executemany(
+            "UPDATE games SET user_color = ? WHERE game_id = ?",
+            [
+                (user_color_in_game(
+                    r["pgn"], r["lichess_nick"] if r["source"] == "lichess" else r["chesscom_nick"]
+                ), r["game_id"])
+                for r in rows
+            ]
+        )
+
+def _migrate_sync_schedule(conn):
+    with _transaction(conn):
+        _ensure_column(conn, "sync_schedule", "last_synced_at", "last_synced_at REAL")
+
+_BLUNDER_MOVE_COLUMNS = ("played_uci", "played_san", "side_to_move", "opponent")
+
+def _backfill_blunder_moves(conn):
+    # карточке больше не нужен PGN: сыгранный ход и соперник лежат в самой ошибке
+    with _transaction(conn):
+        for column in _BLUNDER_MOVE_COLUMNS:
+            _ensure_column(conn, "blunders", column, f"{column} TEXT")
+    game_ids = [r[0] for r in conn.execute(
+        "SELECT DISTINCT game_id FROM blunders WHERE played_uci IS NULL"
+    ).fetchall()]
+    for game_id in game_ids:
+        game = conn.execute(
+            "SELECT pgn, user_color FROM games WHERE game_id = ?", (game_id,)
+        ).fetchone()
+        rows = conn.execute(
+            "SELECT blunder_id, move_index, fen_before FROM blunders "
+            "WHERE game_id = ? AND played_uci IS NULL",
+            (game_id,)
+        ).fetchall()
+        plies = {}
+        if game is not None:
+            try:
+                plies = replay_plies(game["pgn"], [r["move_index"] for r in rows])
+            except ValueError:
+                pass
+        opponent = opponent_name(game["pgn"], game["user_color"]) if game is not None else ""
+        updates = []
+        for r in rows:
+            ply = plies.get(r["move_index"], {})
+            updates.append((
+                ply.get("played_uci", ""),
+                ply.get("played_san", ""),
+                ply.get("side_to_move", r["fen_before"].split()[1]),
+                opponent,
+                r["blunder_id"],
+            ))
+        with _transaction(conn):
+            conn.executemany(
+                "UPDATE blunders SET played_uci = ?, played_san = ?, side_to_move = ?, opponent = ? "
+                "WHERE blunder_id = ?",
+                updates
+            )
+
+def _drop_blunder_assets(conn):
+    # анимации теперь в общем render_cache по содержимому, а не по ошибке;
+    # файлы старых колонок уберёт GC, нужные отрисуются заново по запросу
+    cols = {c[1] for c in conn.execute("PRAGMA table_info(blunders)").fetchall()}
+    if "asset_error_w" not in cols:
+        return
+    try:
+        with _transaction(conn):
+            for kind in _ASSET_KINDS:
+                conn.execute(f"ALTER TABLE blunders DROP COLUMN asset_{kind}")
+    except sqlite3.OperationalError:
+        # SQLite < 3.35: колонки остаются, но больше не читаются
+        pass
+
+@_on_db_thread
 def init_db():
     conn = get_connection()
-    with conn:
+    _migrate_game_keys(conn)
+    _migrate_gif_blobs(conn)
+    with _transaction(conn):
         with open("schema.sql", encoding="utf-8") as f:
             conn.executescript(f.read())
-    conn.close()
+    _backfill_user_colors(conn)
+    _backfill_blunder_moves(conn)
+    _migrate_sync_schedule(conn)
+    _drop_blunder_assets(conn)
 
+@_on_db_thread
 def upsert_user(chat_id: int, lichess: str = None, chesscom: str = None):
     conn = get_connection()
-    with conn:
+    with _transaction(conn):
         conn.execute("""
             INSERT INTO users(chat_id, lichess_nick, chesscom_nick)
             VALUES (?, ?, ?)
@@ -34,40 +359,196 @@ def upsert_user(chat_id: int, lichess: str = None, chesscom: str = None):
               chesscom_nick = COALESCE(excluded.chesscom_nick, users.chesscom_nick),
               updated_at    = CURRENT_TIMESTAMP
         """, (chat_id, lichess, chesscom))
-    conn.close()
+        # новый ник: прошлая синхронизация к нему не относится, проба профиля не пропустит
+        conn.execute("UPDATE sync_schedule SET last_synced_at = NULL WHERE chat_id = ?", (chat_id,))
 
+@_on_db_thread
 def get_user_nicks(chat_id: int) -> tuple[str, str]:
     conn = get_connection()
     row = conn.execute(
         "SELECT lichess_nick, chesscom_nick FROM users WHERE chat_id = ?",
         (chat_id,)
     ).fetchone()
-    conn.close()
     if not row:
         return None, None
     return row["lichess_nick"], row["chesscom_nick"]
 
+@_on_db_thread
 def get_all_users():
     conn = get_connection()
     rows = conn.execute("SELECT chat_id, lichess_nick, chesscom_nick FROM users").fetchall()
-    conn.close()
     return rows
 
+@_on_db_thread
+def get_sync_mark(chat_id: int, provider: str, nick: str) -> int | None:
+    conn = get_connection()
+    row = conn.execute(
+        "SELECT nick, last_seen FROM sync_state WHERE chat_id = ? AND provider = ?",
+        (chat_id, provider)
+    ).fetchone()
+    if not row or row["nick"].lower() != nick.lower():
+        return None
+    return row["last_seen"]
+
+@_on_db_thread
+def set_sync_mark(chat_id: int, provider: str, nick: str, last_seen: int):
+    conn = get_connection()
+    with _transaction(conn):
+        conn.execute("""
+            INSERT INTO sync_state(chat_id, provider, nick, last_seen)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(chat_id, provider) DO UPDATE SET
+              last_seen  = CASE WHEN lower(sync_state.nick) = lower(excluded.nick)
+                                THEN MAX(sync_state.last_seen, excluded.last_seen)
+                                ELSE excluded.last_seen END,
+              nick       = excluded.nick,
+              updated_at = CURRENT_TIMESTAMP
+        """, (chat_id, provider, nick, last_seen))
+
+@_on_db_thread
+def seed_sync_schedule(interval: float) -> int:
+    # новые пользователи равномерно раскладываются по интервалу, а не все сразу
+    conn = get_connection()
+    now = time.time()
+    missing = [r[0] for r in conn.execute(
+        "SELECT u.chat_id FROM users u "
+        "LEFT JOIN sync_schedule s ON s.chat_id = u.chat_id "
+        "WHERE s.chat_id IS NULL"
+    ).fetchall()]
+    if missing:
+        with _transaction(conn):
+            conn.executemany(
+                "INSERT OR IGNORE INTO sync_schedule(chat_id, next_run_at) VALUES(?, ?)",
+                [(chat_id, now + random.uniform(0, interval)) for chat_id in missing]
+            )
+    return len(missing)
+
+@_on_db_thread
+def claim_due_syncs(limit: int, interval: float, active_interval: float, active_window: float, jitter: float) -> list[int]:
+    # сначала недавно активные; следующий запуск назначается сразу, чтобы
+    # пользователь не попал в выборку повторно, пока его синхронизация идёт
+    conn = get_connection()
+    now = time.time()
+    rows = conn.execute(
+        "SELECT chat_id, last_active_at FROM sync_schedule "
+        "WHERE next_run_at <= ? "
+        "ORDER BY COALESCE(last_active_at, 0) DESC, next_run_at "
+        "LIMIT ?",
+        (now, limit)
+    ).fetchall()
+    updates = []
+    for r in rows:
+        active = r["last_active_at"] is not None and now - r["last_active_at"] <= active_window
+        period = active_interval if active else interval
+        updates.append((now + period * random.uniform(1 - jitter, 1 + jitter), now, r["chat_id"]))
+    if updates:
+        with _transaction(conn):
+            conn.executemany(
+                "UPDATE sync_schedule SET next_run_at = ?, last_run_at = ? WHERE chat_id = ?",
+                updates
+            )
+    return [r["chat_id"] for r in rows]
+
+@_on_db_thread
+def mark_synced(chat_id: int, started_at: float):
+    conn = get_connection()
+    with _transaction(conn):
+        conn.execute(
+            "UPDATE sync_schedule SET last_synced_at = MAX(COALESCE(last_synced_at, 0), ?) WHERE chat_id = ?",
+            (started_at, chat_id)
+        )
+
+@_on_db_thread
+def get_last_synced(chat_id: int) -> float | None:
+    conn = get_connection()
+    row = conn.execute("SELECT last_synced_at FROM sync_schedule WHERE chat_id = ?", (chat_id,)).fetchone()
+    return row["last_synced_at"] if row else None
+
+@_on_db_thread
+def touch_user_activity(chat_id: int):
+    conn = get_connection()
+    with _transaction(conn):
+        conn.execute(
+            "UPDATE sync_schedule SET last_active_at = ? WHERE chat_id = ?",
+            (time.time(), chat_id)
+        )
+
+@_on_db_thread
 def save_game(chat_id: int, source: str, pgn: str) -> tuple[int, bool]:
+    key = make_game_key(source, pgn)
     conn = get_connection()
-    with conn:
+    with _transaction(conn):
+        color = user_color_in_game(pgn, _nick_for_source(conn, chat_id, source))
         cur = conn.execute(
-            "INSERT OR IGNORE INTO games(chat_id, source, pgn) VALUES(?,?,?)",
-            (chat_id, source, pgn)
+            "INSERT OR IGNORE INTO games(chat_id, source, game_key, pgn, user_color) VALUES(?,?,?,?,?)",
+            (chat_id, source, key, pgn, color)
         )
         if cur.rowcount:
             return cur.lastrowid, True
         row = conn.execute(
-            "SELECT game_id FROM games WHERE chat_id = ? AND pgn = ?",
-            (chat_id, pgn)
+            "SELECT game_id FROM games WHERE chat_id = ? AND game_key = ?",
+            (chat_id, key)
         ).fetchone()
         return row["game_id"], False
 
+def _select_game_ids(conn, chat_id: int, keys: list[str]) -> dict[str, int]:
+    ids = {}
+    for i in range(0, len(keys), 500):
+        part = keys[i:i + 500]
+        rows = conn.execute(
+            f"SELECT game_key, game_id FROM games "
+            f"WHERE chat_id = ? AND game_key IN ({','.join('?' * len(part))})",
+            (chat_id, *part)
+        ).fetchall()
+        ids.update((r["game_key"], r["game_id"]) for r in rows)
+    return ids
+
+@_on_db_thread
+def save_games(chat_id: int, source: str, pgns: list[str]) -> list[tuple[int, str, str]]:
+    keyed = {}
+    for pgn in pgns:
+        keyed.setdefault(make_game_key(source, pgn), pgn)
+    if not keyed:
+        return []
+
+    conn = get_connection()
+    if not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE")
+    with _transaction(conn):
+        existing = _select_game_ids(conn, chat_id, list(keyed))
+        fresh = [(key, pgn) for key, pgn in keyed.items() if key not in existing]
+        nick = _nick_for_source(conn, chat_id, source)
+        fresh = [(key, pgn, user_color_in_game(pgn, nick)) for key, pgn in fresh]
+        conn.executemany(
+            "INSERT OR IGNORE INTO games(chat_id, source, game_key, pgn, user_color) VALUES(?,?,?,?,?)",
+            [(chat_id, source, key, pgn, color) for key, pgn, color in fresh]
+        )
+        ids = _select_game_ids(conn, chat_id, [key for key, _, _ in fresh])
+    return [(ids[key], pgn, color) for key, pgn, color in fresh if key in ids]
+
+@_on_db_thread
+def existing_game_keys(chat_id: int, keys: list[str]) -> set[str]:
+    return set(_select_game_ids(get_connection(), chat_id, keys))
+
+@_on_db_thread
+def save_analysed_game(chat_id: int, source: str, pgn: str, plies: dict[int, dict]) -> tuple[int, str, list[dict]] | None:
+    # партия и её ошибки одной транзакцией: после обрыва партия либо есть целиком, либо её нет
+    conn = get_connection()
+    with _transaction(conn):
+        saved = save_games(chat_id, source, [pgn])
+        if not saved:
+            return None
+        game_id, _, color = saved[0]
+        opponent = opponent_name(pgn, color)
+        bls = [
+            {"move_index": idx, "opponent": opponent, **ply}
+            for idx, ply in plies.items() if ply["side_to_move"] == color
+        ]
+        if bls:
+            save_blunders(game_id, bls)
+    return game_id, color, bls
+
+@_on_db_thread
 def load_games(chat_id: int):
     conn = get_connection()
     rows = conn.execute(
@@ -77,67 +558,52 @@ def load_games(chat_id: int):
         "LIMIT 50",
         (chat_id,)
     ).fetchall()
-    conn.close()
     return rows
 
-def save_blunders(game_id: int, blunder_list: list[tuple[int, str]]):
+@_on_db_thread
+def save_blunders(game_id: int, blunder_list: list[dict]):
     conn = get_connection()
-    with conn:
+    with _transaction(conn):
         conn.executemany(
-            "INSERT OR IGNORE INTO blunders(game_id, move_index, fen_before) VALUES(?,?,?)",
-            [(game_id, idx, fen) for idx, fen in blunder_list]
+            "INSERT OR IGNORE INTO blunders("
+            "  game_id, move_index, fen_before, played_uci, played_san, side_to_move, opponent"
+            ") VALUES(?,?,?,?,?,?,?)",
+            [
+                (game_id, b["move_index"], b["fen"], b["played_uci"],
+                 b["played_san"], b["side_to_move"], b["opponent"])
+                for b in blunder_list
+            ]
         )
 
+@_on_db_thread
 def get_blunder_id(game_id: int, move_index: int) -> int | None:
     conn = get_connection()
     row = conn.execute(
         "SELECT blunder_id FROM blunders WHERE game_id = ? AND move_index = ?",
         (game_id, move_index)
     ).fetchone()
-    conn.close()
     return row["blunder_id"] if row else None
 
-def update_blunder_assets(
-    blunder_id: int,
-    best_move_uci: str | None,
-    cont_line_uci: str | None,
-    gif_error_w: bytes | None,
-    gif_error_b: bytes | None,
-    gif_best_w: bytes | None,
-    gif_best_b: bytes | None,
-    gif_cont_w: bytes | None,
-    gif_cont_b: bytes | None,
-):
-    conn = get_connection()
-    with conn:
+@_on_db_thread
+def update_blunder_lines(blunder_id: int, best_move_uci: str | None, cont_line_uci: str | None):
+    conn = get_connection()
+    with _transaction(conn):
         conn.execute(
             """
             UPDATE blunders SET
                 best_move_uci = COALESCE(?, best_move_uci),
-                cont_line_uci = COALESCE(?, cont_line_uci),
-                gif_error_w   = COALESCE(?, gif_error_w),
-                gif_error_b   = COALESCE(?, gif_error_b),
-                gif_best_w    = COALESCE(?, gif_best_w),
-                gif_best_b    = COALESCE(?, gif_best_b),
-                gif_cont_w    = COALESCE(?, gif_cont_w),
-                gif_cont_b    = COALESCE(?, gif_cont_b)
+                cont_line_uci = COALESCE(?, cont_line_uci)
             WHERE blunder_id = ?
             """,
-            (
-                best_move_uci, cont_line_uci,
-                gif_error_w, gif_error_b,
-                gif_best_w, gif_best_b,
-                gif_cont_w, gif_cont_b,
-                blunder_id,
-            )
+            (best_move_uci, cont_line_uci, blunder_id)
         )
 
+@_on_db_thread
 def load_unsolved_blunders(chat_id: int):
     conn = get_connection()
     rows = conn.execute(
         "SELECT b.blunder_id, b.game_id, b.move_index, b.fen_before, b.solved, "
         "       b.best_move_uci, b.cont_line_uci, "
-        "       b.gif_error_w, b.gif_error_b, b.gif_best_w, b.gif_best_b, b.gif_cont_w, b.gif_cont_b, "
         "       g.source "
         "FROM blunders b "
         "JOIN games g ON g.game_id = b.game_id "
@@ -145,14 +611,119 @@ def load_unsolved_blunders(chat_id: int):
         "ORDER BY b.detected_at DESC ",
         (chat_id,)
     ).fetchall()
-    conn.close()
     return rows
 
+_BLUNDER_CARD_COLUMNS = (
+    "b.blunder_id, b.game_id, b.move_index AS move_idx, b.fen_before AS fen, "
+    "b.played_uci, b.played_san, b.opponent, "
+    "b.best_move_uci, b.cont_line_uci, "
+    "g.source, g.user_color "
+)
+
+@_on_db_thread
+def load_blunder_page(chat_id: int, before_id: int | None = None, limit: int = 20) -> list[int]:
+    # курсор — blunder_id последней выданной задачи; идём от новых к старым.
+    # Только ходы самого пользователя: сторона хода = его цвет в партии
+    conn = get_connection()
+    rows = conn.execute(
+        "SELECT b.blunder_id "
+        "FROM blunders b "
+        "JOIN games g ON g.game_id = b.game_id "
+        "WHERE g.chat_id = ? AND b.solved = 0 AND b.blunder_id < ? "
+        "  AND g.user_color IN ('w', 'b') "
+        "  AND b.side_to_move = g.user_color "
+        "ORDER BY b.blunder_id DESC "
+        "LIMIT ?",
+        (chat_id, before_id if before_id is not None else 1 << 62, limit)
+    ).fetchall()
+    return [r["blunder_id"] for r in rows]
+
+@_on_db_thread
+def load_blunder(chat_id: int, blunder_id: int) -> dict | None:
+    conn = get_connection()
+    row = conn.execute(
+        "SELECT " + _BLUNDER_CARD_COLUMNS +
+        "FROM blunders b "
+        "JOIN games g ON g.game_id = b.game_id "
+        "WHERE b.blunder_id = ? AND g.chat_id = ?",
+        (blunder_id, chat_id)
+    ).fetchone()
+    return dict(row) if row else None
+
+@_on_db_thread
+def load_render_asset(render_key: str) -> str | None:
+    conn = get_connection()
+    row = conn.execute(
+        "SELECT asset FROM render_cache WHERE render_key = ?", (render_key,)
+    ).fetchone()
+    return row["asset"] if row else None
+
+@_on_db_thread
+def save_render_asset(render_key: str, asset: str):
+    conn = get_connection()
+    with _transaction(conn):
+        conn.execute("""
+            INSERT INTO render_cache(render_key, asset) VALUES (?, ?)
+            ON CONFLICT(render_key) DO UPDATE SET
+              asset   = excluded.asset,
+              used_at = CURRENT_TIMESTAMP
+        """, (render_key, asset))
+
+@_on_db_thread
+def touch_render_asset(render_key: str):
+    conn = get_connection()
+    with _transaction(conn):
+        conn.execute(
+            "UPDATE render_cache SET used_at = CURRENT_TIMESTAMP WHERE render_key = ?",
+            (render_key,)
+        )
+
+@_on_db_thread
+def live_render_assets(max_idle_days: int = 30) -> set[str]:
+    # давно не показанные анимации забываем, их файлы заберёт GC assetstore
+    conn = get_connection()
+    with _transaction(conn):
+        conn.execute(
+            "DELETE FROM render_cache WHERE used_at < datetime('now', ?)",
+            (f"-{max_idle_days} days",)
+        )
+    return {r["asset"] for r in conn.execute("SELECT DISTINCT asset FROM render_cache")}
+
+@_on_db_thread
 def mark_blunder_solved(blunder_id: int):
     conn = get_connection()
-    with conn:
+    with _transaction(conn):
         conn.execute("UPDATE blunders SET solved = 1 WHERE blunder_id = ?", (blunder_id,))
 
+def replay_plies(pgn: str, idxs) -> dict[int, dict]:
+    # один проход по партии на все нужные полуходы вместо get_fen_at_move на каждый
+    with stage("pgn_parse"):
+        game = chess.pgn.read_game(io.StringIO(pgn))
+    if game is None:
+        raise ValueError("Невалидный PGN")
+    wanted = set(idxs)
+    plies = {}
+    if not wanted:
+        return plies
+    last = max(wanted)
+    board = game.board()
+    for i, move in enumerate(game.mainline_moves()):
+        if i > last:
+            break
+        if i in wanted:
+            plies[i] = {
+                "fen": board.fen(),
+                "played_uci": move.uci(),
+                "played_san": board.san(move),
+                "side_to_move": "w" if board.turn == chess.WHITE else "b",
+            }
+        board.push(move)
+    return plies
+
+def opponent_name(pgn: str, user_color: str) -> str:
+    headers = pgn_headers(pgn)
+    return headers.get("Black" if user_color == "w" else "White", "")
+
 def get_fen_at_move(pgn: str, move_idx: int) -> str:
     pgn_io = io.StringIO(pgn)
     game = chess.pgn.read_game(pgn_io)
@@ -165,8 +736,141 @@ def get_fen_at_move(pgn: str, move_idx: int) -> str:
         board.push(move)
     return board.fen()
 
+@_on_db_thread
+def get_game(game_id: int) -> dict | None:
+    conn = get_connection()
+    row = conn.execute(
+        "SELECT game_id, chat_id, source, pgn, user_color FROM games WHERE game_id = ?",
+        (game_id,)
+    ).fetchone()
+    return dict(row) if row else None
+
+@_on_db_thread
 def get_game_pgn(game_id: int) -> str | None:
     conn = get_connection()
     row = conn.execute("SELECT pgn FROM games WHERE game_id = ?", (game_id,)).fetchone()
-    conn.close()
     return row["pgn"] if row else None
+
+@_on_db_thread
+def load_position_evals(zobrists: list[int], min_depth: int) -> dict:
+    # bare-колонки при MAX() в SQLite берутся из строки с максимальной глубиной
+    conn = get_connection()
+    found = {}
+    for i in range(0, len(zobrists), 500):
+        part = zobrists[i:i + 500]
+        rows = conn.execute(
+            f"SELECT zobrist, MAX(depth) AS depth, score, best_move_uci, pv_uci "
+            f"FROM position_evals "
+            f"WHERE depth >= ? AND zobrist IN ({','.join('?' * len(part))}) "
+            f"GROUP BY zobrist",
+            (min_depth, *part)
+        ).fetchall()
+        found.update((r["zobrist"], r) for r in rows)
+    return found
+
+@_on_db_thread
+def save_position_evals(rows: list[tuple[int, int, int | None, str | None, str | None]]):
+    conn = get_connection()
+    with _transaction(conn):
+        conn.executemany(
+            "INSERT OR REPLACE INTO position_evals(zobrist, depth, score, best_move_uci, pv_uci) "
+            "VALUES(?,?,?,?,?)",
+            rows
+        )
+
+@_on_db_thread
+def enqueue_job(kind: str, payload: str, dedup_key: str | None = None, max_attempts: int = 5) -> bool:
+    # dedup_key: незавершённое задание второй раз не ставится,
+    # упавшее окончательно — запускается заново
+    conn = get_connection()
+    now = time.time()
+    with _transaction(conn):
+        cur = conn.execute("""
+            INSERT INTO jobs(kind, dedup_key, payload, max_attempts, created_at, updated_at, run_after)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(kind, dedup_key) DO UPDATE SET
+              payload    = excluded.payload,
+              status     = 'pending',
+              attempts   = 0,
+              last_error = NULL,
+              created_at = excluded.created_at,
+              updated_at = excluded.updated_at,
+              run_after  = excluded.run_after
+            WHERE jobs.status = 'failed'
+        """, (kind, dedup_key, payload, max_attempts, now, now, now))
+    return cur.rowcount > 0
+
+@_on_db_thread
+def claim_job() -> dict | None:
+    # все обращения к БД идут из одного потока, так что SELECT + UPDATE атомарны
+    conn = get_connection()
+    now = time.time()
+    row = conn.execute(
+        "SELECT job_id, kind, payload, attempts, max_attempts, created_at FROM jobs "
+        "WHERE status = 'pending' AND run_after <= ? "
+        "ORDER BY run_after, job_id LIMIT 1",
+        (now,)
+    ).fetchone()
+    if row is None:
+        return None
+    with _transaction(conn):
+        conn.execute(
+            "UPDATE jobs SET status = 'running', attempts = attempts + 1, updated_at = ? WHERE job_id = ?",
+            (now, row["job_id"])
+        )
+    job = dict(row)
+    job["attempts"] += 1
+    return job
+
+@_on_db_thread
+def complete_job(job_id: int):
+    conn = get_connection()
+    with _transaction(conn):
+        conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+
+@_on_db_thread
+def fail_job(job_id: int, error: str, retry_delay: float) -> bool:
+    # True — задание ещё будет повторено, False — попытки кончились
+    conn = get_connection()
+    now = time.time()
+    with _transaction(conn):
+        conn.execute(
+            "UPDATE jobs SET "
+            "  status = CASE WHEN attempts < max_attempts THEN 'pending' ELSE 'failed' END, "
+            "  last_error = ?, updated_at = ?, run_after = ? "
+            "WHERE job_id = ?",
+            (error[:1000], now, now + retry_delay, job_id)
+        )
+    row = conn.execute("SELECT status FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+    return row is not None and row["status"] == "pending"
+
+@_on_db_thread
+def requeue_running_jobs() -> int:
+    # задания, прерванные остановкой бота, возвращаются в очередь. Прерванный
+    # запуск считается попыткой: задание, которое роняет процесс, иначе
+    # повторялось бы бесконечно
+    conn = get_connection()
+    with _transaction(conn):
+        cur = conn.execute(
+            "UPDATE jobs SET "
+            "  status = CASE WHEN attempts < max_attempts THEN 'pending' ELSE 'failed' END, "
+            "  last_error = CASE WHEN attempts < max_attempts THEN last_error "
+            "    ELSE 'прервано остановкой бота' END, "
+            "  updated_at = ? "
+            "WHERE status = 'running'",
+            (time.time(),)
+        )
+    return cur.rowcount
+
+@_on_db_thread
+def job_stats() -> list[dict]:
+    conn = get_connection()
+    rows = conn.execute(
+        "SELECT kind, status, COUNT(*) AS count, MIN(created_at) AS oldest "
+        "FROM jobs GROUP BY kind, status ORDER BY kind, status"
+    ).fetchall()
+    now = time.time()
+    return [
+        {"kind": r["kind"], "status": r["status"], "count": r["count"], "oldest_age": now - r["oldest"]}
+        for r in rows
+    ]
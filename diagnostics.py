@@ -0,0 +1,150 @@
+import asyncio
+import collections
+import io
+import linecache
+import os
+import sys
+import threading
+import time
+import traceback
+import tracemalloc
+
+# Диагностика живого процесса без перезапуска: сэмплирующий профиль
+# всех потоков, снимки tracemalloc с ростом за короткое окно и стеки задач asyncio.
+# Всё пишется в файлы DIAG_DIR.
+
+DIAG_DIR = "diagnostics"
+SAMPLE_INTERVAL = 0.005
+MAX_PROFILE_SECONDS = 300
+TRACEMALLOC_FRAMES = 4
+MEMORY_WINDOW = 10
+TOP_N = 30
+
+_capture_lock = threading.Lock()
+
+
+def _path(kind: str, stamp: str, ext: str = "txt") -> str:
+    os.makedirs(DIAG_DIR, exist_ok=True)
+    return os.path.join(DIAG_DIR, f"{stamp}-{kind}.{ext}")
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+def sample_profile(seconds: float, stamp: str, interval: float = SAMPLE_INTERVAL) -> list[str]:
+    # sys._current_frames() раз в interval: стеки всех потоков, кроме собственного;
+    # итог — свёрнутые стеки (для flamegraph.pl/speedscope) и топ функций
+    seconds = min(seconds, MAX_PROFILE_SECONDS)
+    me = threading.get_ident()
+    stacks = collections.Counter()
+    own = collections.Counter()
+    total = collections.Counter()
+    samples = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            chain = []
+            while frame is not None:
+                chain.append(_frame_label(frame))
+                frame = frame.f_back
+            chain.reverse()
+            thread = names.get(ident, str(ident))
+            stacks[";".join([thread, *chain])] += 1
+            if chain:
+                own[(thread, chain[-1])] += 1
+                for label in set(chain):
+                    total[(thread, label)] += 1
+        samples += 1
+        time.sleep(interval)
+
+    folded = _path("profile", stamp, "folded")
+    with open(folded, "w", encoding="utf-8") as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{stack} {count}\n")
+
+    summary = _path("profile", stamp)
+    with open(summary, "w", encoding="utf-8") as f:
+        f.write(f"Сэмплов: {samples} за {seconds:.1f} с (шаг {interval * 1000:.1f} мс)\n")
+        for title, counter in (("Собственное время", own), ("С учётом вызванных", total)):
+            f.write(f"\n{title}:\n")
+            for (thread, label), count in counter.most_common(TOP_N):
+                f.write(f"{100 * count / max(samples, 1):6.1f}%  {thread:<24} {label}\n")
+    return [summary, folded]
+
+def _take_snapshot() -> tracemalloc.Snapshot:
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, linecache.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+
+def memory_snapshot(stamp: str, window: float = MEMORY_WINDOW, top: int = TOP_N) -> str:
+    # tracemalloc работает только на время снимка: базовый снимок, окно
+    # window секунд, второй снимок и разница. Трассировку, включённую здесь,
+    # здесь же и выключаем — постоянно она замедляет выделения в разы.
+    # Видны только выделения, сделанные после включения
+    path = _path("memory", stamp)
+    started_here = not tracemalloc.is_tracing()
+    if started_here:
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    try:
+        baseline = _take_snapshot()
+        time.sleep(min(window, MAX_PROFILE_SECONDS))
+        snapshot = _take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        if started_here:
+            tracemalloc.stop()
+
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"Окно {window:.1f} с, отслежено: {current / 2**20:.1f} МБ, пик {peak / 2**20:.1f} МБ\n")
+        f.write(f"\nТоп {top} мест выделения:\n")
+        for stat in snapshot.statistics("lineno")[:top]:
+            f.write(f"{stat}\n")
+        f.write(f"\nРост за окно, топ {top}:\n")
+        for stat in snapshot.compare_to(baseline, "lineno")[:top]:
+            f.write(f"{stat}\n")
+        f.write(f"\nТоп {min(top, 10)} по стекам вызовов:\n")
+        for stat in snapshot.statistics("traceback")[:min(top, 10)]:
+            f.write(f"\n{stat.count} блоков, {stat.size / 1024:.1f} КиБ\n")
+            f.write("\n".join(stat.traceback.format()) + "\n")
+    return path
+
+def dump_tasks(stamp: str, loop: asyncio.AbstractEventLoop) -> str:
+    # вызывать из потока цикла: all_tasks и стеки корутин читаются без гонок
+    path = _path("tasks", stamp)
+    tasks = sorted(asyncio.all_tasks(loop), key=lambda t: t.get_name())
+    by_coro = collections.Counter(getattr(t.get_coro(), "__qualname__", "?") for t in tasks)
+    buf = io.StringIO()
+    buf.write(f"Задач asyncio: {len(tasks)}\n")
+    for name, count in by_coro.most_common():
+        buf.write(f"{count:6d}  {name}\n")
+    for task in tasks:
+        buf.write(f"\n--- {task.get_name()}: {task.get_coro()!r}\n")
+        task.print_stack(file=buf)
+
+    names = {t.ident: t.name for t in threading.enumerate()}
+    buf.write("\n\nПотоки:\n")
+    for ident, frame in sys._current_frames().items():
+        buf.write(f"\n--- {names.get(ident, ident)}\n")
+        buf.write("".join(traceback.format_stack(frame)))
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(buf.getvalue())
+    return path
+
+async def capture(profile_seconds: float) -> list[str]:
+    # одна диагностика за раз: второй запрос во время профилирования отклоняется
+    if not _capture_lock.acquire(blocking=False):
+        raise RuntimeError("Диагностика уже идёт")
+    try:
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        paths = [dump_tasks(stamp, asyncio.get_running_loop())]
+        window = min(profile_seconds, MEMORY_WINDOW)
+        paths.append(await asyncio.to_thread(memory_snapshot, stamp, window))
+        paths += await asyncio.to_thread(sample_profile, profile_seconds, stamp)
+        return paths
+    finally:
+        _capture_lock.release()
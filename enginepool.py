@@ -0,0 +1,163 @@
+import asyncio
+import contextlib
+import logging
+
+import chess.engine
+
+log = logging.getLogger(__name__)
+
+
+class EnginePool:
+    def __init__(
+        self,
+        path: str,
+        size: int = 2,
+        threads: int = 1,
+        hash_mb: int = 64,
+        checkout_timeout: float = 30.0,
+        health_interval: float = 60.0,
+    ):
+        self.path = path
+        self.size = size
+        self.options = {"Threads": threads, "Hash": hash_mb}
+        self.checkout_timeout = checkout_timeout
+        self.health_interval = health_interval
+        self.restarts = 0
+
+        self._idle: asyncio.Queue | None = None
+        self._engines: set[chess.engine.UciProtocol] = set()
+        self._busy = 0
+        self._missing = 0
+        self._background: set[asyncio.Task] = set()
+        self._health_task: asyncio.Task | None = None
+        self._start_lock = asyncio.Lock()
+        self._started = False
+
+    async def start(self):
+        if self._started:
+            return
+        async with self._start_lock:
+            if self._started:
+                return
+            self._idle = asyncio.Queue()
+            results = await asyncio.gather(
+                *[self._spawn() for _ in range(self.size)], return_exceptions=True
+            )
+            for res in results:
+                if isinstance(res, BaseException):
+                    log.error("Не удалось запустить движок: %r", res)
+                    self._missing += 1
+                    continue
+                self._idle.put_nowait(res)
+            if self._missing == self.size:
+                raise RuntimeError(f"Ни один движок не запустился: {self.path}")
+            self._health_task = asyncio.create_task(self._health_loop())
+            self._started = True
+
+    async def close(self):
+        if self._health_task:
+            self._health_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._health_task
+        for task in list(self._background):
+            task.cancel()
+        for engine in list(self._engines):
+            await self._discard(engine)
+        self._started = False
+
+    async def checkout(self, timeout: float | None = None) -> chess.engine.UciProtocol:
+        await self.start()
+        timeout = self.checkout_timeout if timeout is None else timeout
+        while True:
+            engine = await asyncio.wait_for(self._idle.get(), timeout)
+            if self._alive(engine):
+                self._busy += 1
+                return engine
+            await self._replace(engine)
+
+    def checkin(self, engine: chess.engine.UciProtocol, broken: bool = False):
+        self._busy -= 1
+        if broken or not self._alive(engine):
+            task = asyncio.create_task(self._replace(engine))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+            return
+        self._idle.put_nowait(engine)
+
+    @contextlib.asynccontextmanager
+    async def engine(self, timeout: float | None = None):
+        engine = await self.checkout(timeout)
+        broken = False
+        try:
+            yield engine
+        except (chess.engine.EngineTerminatedError, asyncio.TimeoutError, asyncio.CancelledError):
+            broken = True
+            raise
+        finally:
+            self.checkin(engine, broken=broken)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "size": self.size,
+            "idle": self._idle.qsize() if self._idle else 0,
+            "busy": self._busy,
+            "missing": self._missing,
+            "restarts": self.restarts,
+        }
+
+    async def _spawn(self) -> chess.engine.UciProtocol:
+        _, engine = await chess.engine.popen_uci(self.path)
+        try:
+            await engine.configure(self.options)
+        except Exception:
+            await self._discard(engine)
+            raise
+        self._engines.add(engine)
+        return engine
+
+    @staticmethod
+    def _alive(engine: chess.engine.UciProtocol) -> bool:
+        return not engine.returncode.done()
+
+    async def _discard(self, engine: chess.engine.UciProtocol):
+        self._engines.discard(engine)
+        if not self._alive(engine):
+            return
+        try:
+            await asyncio.wait_for(engine.quit(), 2)
+        except Exception:
+            with contextlib.suppress(Exception):
+                engine.transport.kill()
+
+    async def _replace(self, engine: chess.engine.UciProtocol):
+        await self._discard(engine)
+        self.restarts += 1
+        try:
+            self._idle.put_nowait(await self._spawn())
+        except Exception as e:
+            log.error("Не удалось перезапустить движок: %r", e)
+            self._missing += 1
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            for _ in range(self._idle.qsize()):
+                try:
+                    engine = self._idle.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                try:
+                    await asyncio.wait_for(engine.ping(), 5)
+                except Exception:
+                    log.warning("Движок не отвечает, перезапуск")
+                    await self._replace(engine)
+                    continue
+                self._idle.put_nowait(engine)
+
+            for _ in range(self._missing):
+                try:
+                    self._idle.put_nowait(await self._spawn())
+                    self._missing -= 1
+                except Exception as e:
+                    log.error("Не удалось восстановить движок: %r", e)
+                    break
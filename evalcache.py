@@ -0,0 +1,104 @@
+import threading
+from collections import OrderedDict
+
+import chess
+import chess.polyglot
+
+from connection import load_position_evals, queue_write, run_db, save_position_evals
+
+
+def position_key(board: chess.Board) -> int:
+    # SQLite INTEGER — знаковое 64-битное, а Zobrist-хеш беззнаковый
+    h = chess.polyglot.zobrist_hash(board)
+    return h - (1 << 64) if h >= (1 << 63) else h
+
+
+class PositionCache:
+    def __init__(self, capacity: int = 200_000, persistent: bool = True):
+        self.capacity = capacity
+        self.persistent = persistent
+        self.hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[int, dict] = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def get(self, board: chess.Board, depth: int) -> dict | None:
+        return (await self.get_many([board], depth))[0]
+
+    async def get_many(self, boards: list[chess.Board], depth: int) -> list[dict | None]:
+        keys = [position_key(board) for board in boards]
+        found: list[dict | None] = []
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and entry["depth"] >= depth:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    found.append(entry)
+                else:
+                    found.append(None)
+
+        missing = [i for i, entry in enumerate(found) if entry is None]
+        if self.persistent and missing:
+            rows = await run_db(load_position_evals, list({keys[i] for i in missing}), depth)
+            with self._lock:
+                for i in missing:
+                    row = rows.get(keys[i])
+                    if row is None:
+                        continue
+                    found[i] = {
+                        "depth": row["depth"],
+                        "score": row["score"],
+                        "best_move": chess.Move.from_uci(row["best_move_uci"]) if row["best_move_uci"] else None,
+                        "pv": [chess.Move.from_uci(u) for u in (row["pv_uci"] or "").split()],
+                    }
+                    self._remember(keys[i], found[i])
+                    self.hits += 1
+                    self.db_hits += 1
+
+        with self._lock:
+            self.misses += sum(1 for entry in found if entry is None)
+        return found
+
+    def put(self, board: chess.Board, depth: int, score: int | None, pv: list[chess.Move]):
+        self.put_many([(board, depth, score, pv)])
+
+    def put_many(self, items: list[tuple[chess.Board, int, int | None, list[chess.Move]]]):
+        rows = []
+        with self._lock:
+            for board, depth, score, pv in items:
+                key = position_key(board)
+                entry = {
+                    "depth": depth,
+                    "score": score,
+                    "best_move": pv[0] if pv else None,
+                    "pv": list(pv),
+                }
+                self._remember(key, entry)
+                rows.append((
+                    key, depth, score,
+                    pv[0].uci() if pv else None,
+                    " ".join(m.uci() for m in pv) or None,
+                ))
+        if self.persistent and rows:
+            queue_write(save_position_evals, rows)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "db_hits": self.db_hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+            }
+
+    def _remember(self, key: int, entry: dict):
+        old = self._entries.get(key)
+        if old is not None and old["depth"] > entry["depth"]:
+            self._entries.move_to_end(key)
+            return
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
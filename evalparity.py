@@ -0,0 +1,79 @@
+import argparse
+import asyncio
+import time
+
+import chess.pgn
+
+from stockfishanalyse import SEARCH_STATS, close_engine_pool, findmove, geteval
+
+
+async def _run_mode(pgn: str, mode: str) -> tuple[list[int], float, int, int]:
+    searches, nodes = SEARCH_STATS["searches"], SEARCH_STATS["nodes"]
+    started = time.perf_counter()
+    evals = await geteval(pgn, mode=mode, use_cache=False)
+    elapsed = time.perf_counter() - started
+    return (
+        findmove(evals),
+        elapsed,
+        SEARCH_STATS["searches"] - searches,
+        SEARCH_STATS["nodes"] - nodes,
+    )
+
+async def parity_report(path: str, limit: int | None = None):
+    totals = {
+        "full": {"time": 0.0, "searches": 0, "nodes": 0},
+        "two_pass": {"time": 0.0, "searches": 0, "nodes": 0},
+    }
+    games = identical = missed = extra = 0
+
+    with open(path, encoding="utf-8") as f:
+        while limit is None or games < limit:
+            game = chess.pgn.read_game(f)
+            if game is None:
+                break
+            pgn = str(game)
+            games += 1
+
+            results = {}
+            for mode in ("full", "two_pass"):
+                blunders, elapsed, searches, nodes = await _run_mode(pgn, mode)
+                results[mode] = set(blunders)
+                totals[mode]["time"] += elapsed
+                totals[mode]["searches"] += searches
+                totals[mode]["nodes"] += nodes
+
+            lost = results["full"] - results["two_pass"]
+            added = results["two_pass"] - results["full"]
+            missed += len(lost)
+            extra += len(added)
+            if not lost and not added:
+                identical += 1
+            else:
+                site = game.headers.get("Site", f"#{games}")
+                print(f"{site}: пропущено {sorted(lost)}, лишние {sorted(added)}")
+
+    await close_engine_pool()
+
+    if not games:
+        print("Партии не найдены")
+        return
+
+    full, fast = totals["full"], totals["two_pass"]
+    print()
+    print(f"Партий: {games}, совпали полностью: {identical} ({100 * identical / games:.1f}%)")
+    print(f"Пропущено ошибок: {missed}, лишних ошибок: {extra}")
+    for mode, t in totals.items():
+        print(f"{mode:>8}: {t['time']:.1f} с, поисков {t['searches']}, узлов {t['nodes']}")
+    if fast["time"] and fast["nodes"]:
+        print(f"Ускорение: {full['time'] / fast['time']:.2f}x по времени, "
+              f"{full['nodes'] / fast['nodes']:.2f}x по узлам")
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение режимов full и two_pass в geteval")
+    parser.add_argument("pgn", help="PGN-файл с партиями")
+    parser.add_argument("--limit", type=int, default=None, help="максимум партий")
+    args = parser.parse_args()
+    asyncio.run(parity_report(args.pgn, args.limit))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+import asyncio
+import contextlib
+import contextvars
+import json
+import logging
+import time
+
+from connection import (
+    claim_job,
+    complete_job,
+    enqueue_job,
+    fail_job,
+    job_stats,
+    requeue_running_jobs,
+    run_db,
+)
+
+log = logging.getLogger(__name__)
+
+RETRY_BASE = 30.0
+RETRY_MAX = 3600.0
+IDLE_POLL = 5.0
+
+# выставлен, пока выполняется обработчик задания (и в задачах, созданных из него)
+_in_handler: contextvars.ContextVar[bool] = contextvars.ContextVar("jobqueue_in_handler", default=False)
+
+
+class JobQueue:
+    # Очередь заданий в SQLite: воркеров фиксированное число, незавершённые
+    # задания после перезапуска продолжаются, упавшие повторяются с паузой
+    def __init__(self, workers: int, max_pending: int = 1000):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._handlers: dict[str, object] = {}
+        self._outstanding = 0
+        self._running = 0
+        self._capacity = asyncio.Condition()
+        self._wakeup = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []
+
+    def register(self, kind: str, handler):
+        self._handlers[kind] = handler
+
+    async def start(self):
+        if self._tasks:
+            return
+        resumed = await run_db(requeue_running_jobs)
+        self._outstanding = sum(
+            s["count"] for s in await run_db(job_stats) if s["status"] in ("pending", "running")
+        )
+        if self._outstanding:
+            log.info("Очередь заданий: %d незавершённых (%d прерваны остановкой)", self._outstanding, resumed)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+        self._tasks = []
+
+    async def enqueue(self, kind: str, payload: dict, dedup_key: str | None = None, max_attempts: int = 5):
+        # backpressure: при переполненной очереди ждём, пока воркеры её разгребут.
+        # Обработчики заданий не ждут: их слот освобождается только после
+        # возврата, и при полной очереди все воркеры заблокировали бы друг друга
+        # Слот резервируется под замком, а запись в БД идёт уже без него:
+        # иначе все производители и воркеры ждали бы одного обращения к БД
+        async with self._capacity:
+            if not _in_handler.get():
+                await self._capacity.wait_for(lambda: self._outstanding < self.max_pending)
+            self._outstanding += 1
+        added = False
+        try:
+            added = await run_db(enqueue_job, kind, json.dumps(payload), dedup_key, max_attempts)
+        finally:
+            if not added:
+                # дубль или ошибка записи — слот возвращаем
+                await self._finished()
+        if added:
+            self._wakeup.set()
+        return added
+
+    def snapshot(self) -> dict[str, int]:
+        # без обращения к БД — для датчиков /metrics
+        return {"outstanding": self._outstanding, "running": self._running, "workers": self.workers}
+
+    async def stats(self) -> dict:
+        rows = await run_db(job_stats)
+        return {
+            "outstanding": self._outstanding,
+            "running": self._running,
+            "workers": self.workers,
+            "by_kind": rows,
+            "oldest_pending_age": max(
+                (r["oldest_age"] for r in rows if r["status"] == "pending"), default=0.0
+            ),
+        }
+
+    async def _finished(self):
+        async with self._capacity:
+            self._outstanding = max(0, self._outstanding - 1)
+            self._capacity.notify_all()
+
+    async def _db(self, fn, *args):
+        # сбой БД (например, «database is locked») не должен убивать воркер:
+        # пишем в журнал и продолжаем. Задание, не отмеченное в БД, осталось
+        # running и вернётся в очередь при следующем старте
+        try:
+            return await run_db(fn, *args)
+        except Exception:
+            log.exception("Очередь заданий: %s не выполнилось", fn.__name__)
+            return None
+
+    async def _worker(self):
+        while True:
+            job = await self._db(claim_job)
+            if job is None:
+                self._wakeup.clear()
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._wakeup.wait(), IDLE_POLL)
+                continue
+
+            handler = self._handlers.get(job["kind"])
+            self._running += 1
+            started = time.monotonic()
+            try:
+                if handler is None:
+                    raise LookupError(f"нет обработчика для {job['kind']!r}")
+                token = _in_handler.set(True)
+                try:
+                    await handler(json.loads(job["payload"]))
+                finally:
+                    _in_handler.reset(token)
+            except asyncio.CancelledError:
+                # остановка бота: задание останется running и вернётся в очередь при старте
+                raise
+            except Exception as e:
+                delay = min(RETRY_MAX, RETRY_BASE * 2 ** (job["attempts"] - 1))
+                retried = await self._db(fail_job, job["job_id"], repr(e), delay)
+                log.warning(
+                    "Задание %s #%d упало (попытка %d/%d): %r",
+                    job["kind"], job["job_id"], job["attempts"], job["max_attempts"], e
+                )
+                if not retried:
+                    await self._finished()
+            else:
+                await self._db(complete_job, job["job_id"])
+                await self._finished()
+                log.debug("Задание %s #%d: %.2f с", job["kind"], job["job_id"], time.monotonic() - started)
+            finally:
+                self._running -= 1
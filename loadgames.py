@@ -1,39 +1,243 @@
-import requests
+import asyncio
+import contextlib
 import datetime
+import json
+import logging
+import os
+import time
 
-def getlastlichessgames(username,max_games,period):
+import aiohttp
 
+from metrics import HTTP_RESPONSES, STAGE_SECONDS
+
+log = logging.getLogger(__name__)
+
+LICHESS_URL = os.environ.get("LICHESS_URL", "https://lichess.org")
+CHESSCOM_URL = os.environ.get("CHESSCOM_URL", "https://api.chess.com")
+LICHESS_PERF_TYPES = "blitz,rapid,classical,standard"
+# статусы Lichess для партий, которые ещё идут
+LICHESS_ONGOING = ("created", "started")
+
+HEADERS = {"User-Agent": "MyChessBot/1.0 (+https://t.me/@Justachessbot)"}
+MAX_RETRIES = 3
+BACKOFF_BASE = 2.0
+# Lichess просит ждать целую минуту после 429
+LICHESS_429_PAUSE = 60.0
+
+_session: aiohttp.ClientSession | None = None
+
+
+class FetchError(Exception):
+    # загрузка оборвалась: отметку синхронизации сдвигать нельзя,
+    # games — то, что успели получить
+    def __init__(self, message: str, games: list[dict] | None = None):
+        super().__init__(message)
+        self.games = games or []
+
+
+class RateLimiter:
+    def __init__(self, min_interval: float, concurrency: int):
+        self.min_interval = min_interval
+        self._sem = asyncio.Semaphore(concurrency)
+        self._lock = asyncio.Lock()
+        self._next_at = 0.0
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        async with self._sem:
+            async with self._lock:
+                loop = asyncio.get_running_loop()
+                wait = self._next_at - loop.time()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                self._next_at = loop.time() + self.min_interval
+            yield
+
+    def backoff(self, delay: float):
+        loop = asyncio.get_running_loop()
+        self._next_at = max(self._next_at, loop.time() + delay)
+
+
+RATE_LIMITS = {
+    "lichess": RateLimiter(min_interval=1.0, concurrency=1),
+    "chesscom": RateLimiter(min_interval=0.2, concurrency=4),
+}
+
+async def get_session() -> aiohttp.ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            headers=HEADERS,
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=60),
+            connector=aiohttp.TCPConnector(limit=32, limit_per_host=8),
+        )
+    return _session
+
+async def close_session():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+def _retry_delay(provider: str, resp: aiohttp.ClientResponse, attempt: int) -> float:
+    retry_after = resp.headers.get("Retry-After")
+    if retry_after and retry_after.isdigit():
+        return float(retry_after)
+    if provider == "lichess" and resp.status == 429:
+        return LICHESS_429_PAUSE
+    return BACKOFF_BASE * (2 ** attempt)
+
+@contextlib.asynccontextmanager
+async def _request(provider: str, url: str, params: dict | None = None, headers: dict | None = None):
+    # лимитер держит слот только до заголовков ответа: он задаёт темп
+    # начала запросов, а долгое чтение потокового тела (выгрузка партий
+    # Lichess) не задерживает короткие запросы профилей
+    limiter = RATE_LIMITS[provider]
+    session = await get_session()
+    for attempt in range(MAX_RETRIES + 1):
+        async with limiter.slot():
+            # время до заголовков ответа, без ожидания лимитера и чтения тела
+            started = time.perf_counter()
+            resp = await session.get(url, params=params, headers=headers)
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage=f"http_{provider}")
+            HTTP_RESPONSES.inc(provider=provider, status=resp.status)
+            retryable = resp.status == 429 or resp.status >= 500
+            if retryable and attempt < MAX_RETRIES:
+                delay = _retry_delay(provider, resp, attempt)
+                limiter.backoff(delay)
+        async with resp:
+            if not retryable or attempt == MAX_RETRIES:
+                yield resp
+                return
+        log.warning("[%s] HTTP %d для %s, повтор через %.0f с", provider, resp.status, url, delay)
+
+def iter_pgn_texts(lines):
+    buf = list()
+    in_movetext = False
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8", errors="replace")
+        line = line.rstrip("\r\n")
+        if line.startswith("[") and in_movetext:
+            game = "\n".join(buf).strip()
+            if game:
+                yield game
+            buf = list()
+            in_movetext = False
+        elif line.strip() and not line.startswith("["):
+            in_movetext = True
+        buf.append(line)
+    game = "\n".join(buf).strip()
+    if game:
+        yield game
+
+def iter_ndjson(lines):
+    for line in lines:
+        if not line or not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            log.warning("Пропущена некорректная строка NDJSON: %r", line[:80])
+
+async def _aiter_lines(resp: aiohttp.ClientResponse):
+    # без лимита aiohttp на длину строки
+    tail = b""
+    async for chunk in resp.content.iter_any():
+        tail += chunk
+        *lines, tail = tail.split(b"\n")
+        for line in lines:
+            yield line
+    if tail:
+        yield tail
+
+async def _export_lichess(username, max_games, since, until, perf_types, spool=None, ongoing=False):
+    url = f"{LICHESS_URL}/api/games/user/{username}"
+    params = {
+        "tags": "true",
+        "clocks": "false",
+        "evals": "false",
+        "opening": "false",
+        "literate": "false",
+        "pgnInJson": "true",
+        "max": max_games,
+        "since": since,
+        "until": until,
+        "perfType": perf_types,
+    }
+    if ongoing:
+        # от старых к новым: если max обрежет выдачу, пропадут самые новые,
+        # и отметка по увиденным партиям ничего не перескочит
+        params["ongoing"] = "true"
+        params["sort"] = "dateAsc"
+    headers = {"Accept": "application/x-ndjson"}
+
+    try:
+        async with _request("lichess", url, params=params, headers=headers) as resp:
+            if resp.status != 200:
+                raise FetchError(f"Ошибка при скачивании партий: HTTP {resp.status}")
+            async for line in _aiter_lines(resp):
+                if spool is not None:
+                    spool.write(line + b"\n")
+                for game in iter_ndjson([line]):
+                    yield game
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        raise FetchError(f"Ошибка при скачивании партий: {e!r}") from e
+
+def _lichess_window(period, since):
     time_now = int(datetime.datetime.now(datetime.UTC).timestamp() * 1000)
     time_prev = time_now - int(datetime.timedelta(days=period).total_seconds() * 1000)
-    url = f'https://lichess.org/api/games/user/{username}?tags=true&clocks=false&evals=false&opening=false&literate=false&max={max_games}&since={time_prev}&until={time_now}&perfType=blitz%2Crapid%2Cclassical%2Ccorrespondence%2Cstandard'
+    if since is not None:
+        time_prev = since + 1
+    return time_prev, time_now
+
+async def fetch_lichess_games(username, max_games, period, since=None, spool=None):
+    # партии с контролем времени; заочные — fetch_lichess_correspondence
+    time_prev, time_now = _lichess_window(period, since)
+    async for game in _export_lichess(username, max_games, time_prev, time_now, LICHESS_PERF_TYPES, spool):
+        pgn = (game.get("pgn") or "").strip()
+        if pgn:
+            yield {"pgn": pgn, "ts": game.get("createdAt") or 0}
+
+async def fetch_lichess_correspondence(username, max_games, period, since=None) -> tuple[list[dict], int | None]:
+    # since у Lichess фильтрует по createdAt, а заочная партия идёт неделями:
+    # начатая до отметки и доигранная после неё иначе не попала бы никогда.
+    # Поэтому запрашиваем и идущие партии, а отметка (второе значение) не
+    # уходит дальше начала самой старой из них: следующая синхронизация
+    # перечитает только ещё не доигранные. Отдаются лишь законченные партии
+    time_prev, time_now = _lichess_window(period, since)
+    finished, ongoing, newest = [], [], None
+    async for game in _export_lichess(username, max_games, time_prev, time_now, "correspondence", ongoing=True):
+        created = game.get("createdAt") or 0
+        newest = max(newest or 0, created)
+        if game.get("status") in LICHESS_ONGOING:
+            ongoing.append(created)
+            continue
+        pgn = (game.get("pgn") or "").strip()
+        if pgn:
+            finished.append({"pgn": pgn, "ts": created})
+    if ongoing:
+        return finished, min(ongoing) - 1
+    return finished, newest
 
+async def _fetch_chesscom_month(username: str, year: int, mon: str) -> list[dict]:
+    url = f"{CHESSCOM_URL}/pub/player/{username}/games/{year}/{mon}"
     try:
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
-        file_path = f'D:\\ChessHelper\\chessdata\\lichess\\{username}.pgn'
-        with open(file_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-    except requests.exceptions.RequestException as e:
-        print(f"Ошибка при скачивании файла: {e}")
-
-    with open(f'D:\\ChessHelper\\chessdata\\lichess\\{username}.pgn', encoding='UTF-8') as file:
-        text = file.read()
-
-    if text.strip() == '':
-        return list()
-
-    gameslist = list()
-    numofgames = text.count('[Event')
-    for v in range(numofgames - 1):
-        gameslist.append(text[:text.find('[Event',1)].strip())
-        text = text[text.find('[Event',1):]
-    gameslist.append(text.strip())
-    return gameslist
-
-def getlastchesscomgames(username, max_games, period):
+        async with _request("chesscom", url) as resp:
+            if resp.status == 404:
+                return []
+            if resp.status != 200:
+                raise FetchError(f"[Chess.com] Ошибка при запросе {url}: HTTP {resp.status}")
+            payload = await resp.json(content_type=None)
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        raise FetchError(f"[Chess.com] Ошибка при запросе {url}: {e!r}") from e
+    return payload.get("games", [])
+
+async def fetch_chesscom_games(username, max_games, period, since=None):
     now = datetime.datetime.now(datetime.timezone.utc)
     start = now - datetime.timedelta(days=period)
+    if since is not None:
+        start = datetime.datetime.fromtimestamp(since / 1000, datetime.timezone.utc)
     start_ts = start.timestamp()
     end_ts = now.timestamp()
 
@@ -46,31 +250,77 @@ def getlastchesscomgames(username, max_games, period):
         else:
             m += 1
 
-    headers = {"User-Agent": "MyChessBot/1.0 (+https://t.me/@Justachessbot)"}
-    all_games = []
+    monthly = await asyncio.gather(*[
+        _fetch_chesscom_month(username, year, mon) for year, mon in months
+    ], return_exceptions=True)
 
-    for year, mon in months:
-        url = f"https://api.chess.com/pub/player/{username}/games/{year}/{mon}"
-        try:
-            resp = requests.get(url, headers=headers)
-            resp.raise_for_status()
-            payload = resp.json()
-        except requests.RequestException as e:
-            print(f"[Chess.com] Ошибка при запросе {url}: {e}")
+    all_games = []
+    errors = []
+    for games in monthly:
+        if isinstance(games, BaseException):
+            errors.append(games)
             continue
-
-        for game in payload.get("games", []):
+        for game in games:
             end_time = game.get("end_time")
             if not isinstance(end_time, int):
                 continue
+            if since is not None and end_time * 1000 <= since:
+                continue
 
             if start_ts <= end_time <= end_ts:
                 all_games.append(game)
 
-    if not all_games:
-        return list()
-
     sorted_games = sorted(all_games, key=lambda g: g["end_time"], reverse=True)
-    selected = sorted_games[:max_games]
+    selected = [
+        {"pgn": g.get("pgn", ""), "ts": g["end_time"] * 1000}
+        for g in sorted_games[:max_games]
+    ]
+
+    if errors:
+        raise FetchError(str(errors[0]), games=selected)
+    return selected
+
+async def lichess_user_exists(nick: str) -> bool:
+    if not nick:
+        return False
+    url = f"{LICHESS_URL}/api/user/{nick}"
+    try:
+        async with _request("lichess", url) as resp:
+            return resp.status == 200
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        return False
 
-    return [g.get("pgn", "") for g in selected]
\ No newline at end of file
+async def chesscom_user_exists(nick: str) -> bool:
+    if not nick:
+        return False
+    url = f"{CHESSCOM_URL}/pub/player/{nick.lower()}"
+    try:
+        async with _request("chesscom", url) as resp:
+            return resp.status == 200
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        return False
+
+async def lichess_seen_at(nick: str) -> int | None:
+    # дешёвая проверка перед синхронизацией: когда игрок последний раз был на сайте (мс)
+    url = f"{LICHESS_URL}/api/user/{nick}"
+    try:
+        async with _request("lichess", url) as resp:
+            if resp.status != 200:
+                return None
+            payload = await resp.json(content_type=None)
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+        return None
+    seen = payload.get("seenAt")
+    return seen if isinstance(seen, int) else None
+
+async def chesscom_last_online(nick: str) -> int | None:
+    url = f"{CHESSCOM_URL}/pub/player/{nick.lower()}"
+    try:
+        async with _request("chesscom", url) as resp:
+            if resp.status != 200:
+                return None
+            payload = await resp.json(content_type=None)
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+        return None
+    online = payload.get("last_online")
+    return online * 1000 if isinstance(online, int) else None
@@ -0,0 +1,195 @@
+import asyncio
+import bisect
+import contextlib
+import functools
+import inspect
+import threading
+import time
+
+from aiohttp import web
+
+# Метрики в текстовом формате Prometheus без внешних зависимостей.
+# Гистограммы и счётчики обновляются на месте (замок + bisect),
+# датчики — функции (или корутины), которые вызываются только при запросе /metrics.
+
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0
+)
+
+_REGISTRY: list = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels[n] for n in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self) -> list[str]:
+        with self._lock:
+            values = dict(self._values)
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_labels(self.labels, key)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        # по каждому набору меток: [счётчики корзин..., сумма, количество]
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels[n] for n in self.labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if idx < len(self.buckets):
+                series[idx] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def collect(self) -> list[str]:
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                le = _labels(self.labels, key, f'le="{_number(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = _labels(self.labels, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {values[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {_number(values[-2])}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {values[-1]}")
+        return lines
+
+
+class Callback:
+    # значение считается при запросе: fn() -> число или {значения меток: число};
+    # fn может быть корутиной, если значение надо достать из БД
+    def __init__(self, name: str, help: str, fn, labels: tuple = (), kind: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labels = labels
+        self.kind = kind
+        _REGISTRY.append(self)
+
+    async def collect(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            values = self.fn()
+            if inspect.isawaitable(values):
+                values = await values
+        except Exception:
+            return lines
+        if values is None:
+            return lines
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in sorted(values.items(), key=lambda kv: str(kv[0])):
+            key = key if isinstance(key, tuple) else (key,)
+            lines.append(f"{self.name}{_labels(self.labels, key)} {_number(value)}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("chessbot_stage_seconds", "Длительность этапов конвейера", ("stage",))
+STAGE_ERRORS = Counter("chessbot_stage_errors_total", "Этапы, завершившиеся исключением", ("stage",))
+HANDLER_SECONDS = Histogram("chessbot_handler_seconds", "Длительность обработчиков aiogram", ("handler",))
+HANDLER_ERRORS = Counter("chessbot_handler_errors_total", "Обработчики, завершившиеся исключением", ("handler",))
+HTTP_RESPONSES = Counter("chessbot_http_responses_total", "Ответы провайдеров партий", ("provider", "status"))
+DB_SECONDS = Histogram("chessbot_db_seconds", "Выполнение функций в потоке SQLite", ("fn",))
+DB_WAIT_SECONDS = Histogram("chessbot_db_wait_seconds", "Ожидание в очереди потока SQLite")
+
+
+@contextlib.contextmanager
+def stage(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=name)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=name)
+
+def timed(name: str):
+    # stage() на всю функцию — обычную или корутину
+    def decorate(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with stage(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+async def render_metrics() -> str:
+    lines = []
+    for metric in _REGISTRY:
+        collected = metric.collect()
+        if inspect.isawaitable(collected):
+            collected = await collected
+        lines.extend(collected)
+    return "\n".join(lines) + "\n"
+
+async def _metrics_view(request: web.Request) -> web.Response:
+    return web.Response(
+        body=(await render_metrics()).encode("utf-8"),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    app = web.Application()
+    app.router.add_get("/metrics", _metrics_view)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,99 @@
+import argparse
+import time
+from io import BytesIO
+
+import chess
+from PIL import Image, ImageChops, ImageDraw
+
+import boardrender
+from benchmarks.fixtures import synthetic_lines, synthetic_positions
+from boardrender import _piece_images, _render_board_image, render_line_gif
+
+
+def _legacy_render_board_image(fen: str, square_size: int, flip: bool) -> Image.Image:
+    # прежний рендер: холст и 64 клетки на каждый кадр, масштабирование фигур каждый раз
+    board = chess.Board(fen)
+    bs = square_size
+    img = Image.new("RGBA", (8 * bs, 8 * bs), "#FFFFFF")
+    draw = ImageDraw.Draw(img)
+    for rank in range(8):
+        for file in range(8):
+            color = boardrender.LIGHT_SQUARE if (file + rank) % 2 == 0 else boardrender.DARK_SQUARE
+            x0, y0 = file * bs, rank * bs
+            draw.rectangle([x0, y0, x0 + bs, y0 + bs], fill=color)
+            sq = chess.square(7 - file, rank) if flip else chess.square(file, 7 - rank)
+            piece = board.piece_at(sq)
+            if piece:
+                icon = _piece_images[f"{'w' if piece.color else 'b'}{piece.symbol().lower()}"]
+                if icon.size != (bs, bs):
+                    icon = icon.resize((bs, bs), Image.LANCZOS)
+                img.alpha_composite(icon, (x0, y0))
+    return img
+
+def _legacy_line_gif(fen_start: str, moves: list[chess.Move], square_size: int, flip: bool) -> BytesIO:
+    # прежний кодировщик: полные RGBA-кадры, пауза — копиями последнего кадра
+    frame_duration, pause_after = 600, 2000
+    board = chess.Board(fen_start)
+    frames = [_legacy_render_board_image(fen_start, square_size, flip)]
+    for mv in moves:
+        board.push(mv)
+        frames.append(_legacy_render_board_image(board.fen(), square_size, flip))
+    frames += [frames[-1]] * max(1, int(round(pause_after / frame_duration)))
+    buf = BytesIO()
+    frames[0].save(
+        buf, format="GIF", save_all=True, append_images=frames[1:],
+        loop=0, duration=frame_duration, disposal=2,
+    )
+    return buf
+
+def _fps(render, fens: list[str], square_size: int) -> float:
+    started = time.perf_counter()
+    frames = 0
+    for fen in fens:
+        for flip in (False, True):
+            render(fen, square_size, flip)
+            frames += 1
+    return frames / (time.perf_counter() - started)
+
+def _gif_cost(encode, lines, square_size: int) -> tuple[int, float]:
+    started = time.perf_counter()
+    size = 0
+    for fen, moves in lines:
+        size += len(encode(fen, moves, square_size, False).getvalue())
+    return size, time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description="Рендер доски и кодирование GIF: прежний код против текущего")
+    parser.add_argument("--positions", type=int, default=100, help="число позиций")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[200, 120, 64], help="размеры клетки")
+    parser.add_argument("--gifs", type=int, default=20, help="число анимаций для сравнения GIF")
+    parser.add_argument("--plies", type=int, default=6, help="полуходов в анимации")
+    args = parser.parse_args()
+
+    fens = synthetic_positions(args.positions)
+    for fen in fens[:10]:
+        for flip in (False, True):
+            diff = ImageChops.difference(
+                _legacy_render_board_image(fen, 64, flip), _render_board_image(fen, 64, flip)
+            )
+            if diff.getbbox() is not None:
+                print(f"Расхождение в кадре: {fen} flip={flip}")
+
+    for size in args.sizes:
+        _render_board_image(fens[0], size, False)  # прогрев кэша спрайтов
+        before = _fps(_legacy_render_board_image, fens, size)
+        after = _fps(_render_board_image, fens, size)
+        print(f"клетка {size:>3}px: было {before:7.1f} к/с, стало {after:7.1f} к/с ({after / before:.2f}x)")
+
+    lines = synthetic_lines(fens[:args.gifs], args.plies)
+    render_line_gif(*lines[0], 200)  # прогрев палитры и плиток
+    old_size, old_time = _gif_cost(_legacy_line_gif, lines, 200)
+    new_size, new_time = _gif_cost(render_line_gif, lines, 200)
+    print()
+    print(f"GIF ({len(lines)} анимаций по {args.plies} полуходов, клетка 200px):")
+    print(f"  было:  {old_size / len(lines) / 1024:8.1f} КБ, {1000 * old_time / len(lines):7.1f} мс на анимацию")
+    print(f"  стало: {new_size / len(lines) / 1024:8.1f} КБ, {1000 * new_time / len(lines):7.1f} мс на анимацию")
+    print(f"  размер меньше в {old_size / new_size:.2f}x, кодирование быстрее в {old_time / new_time:.2f}x")
+
+if __name__ == "__main__":
+    main()
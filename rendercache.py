@@ -0,0 +1,148 @@
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import chess
+
+from assetstore import put_asset, read_asset
+from boardrender import render_line_gif, render_move_gif
+from connection import load_render_asset, queue_write, run_db, save_render_asset, touch_render_asset
+from metrics import Callback, stage
+
+RENDER_SIZE = 200
+# меняется вместе с палитрой/спрайтами/таймингами — старые ключи просто перестают совпадать
+RENDER_STYLE = "classic-v1"
+
+RENDER_EXECUTOR = ThreadPoolExecutor(max_workers=4)
+
+
+def render_key(kind: str, fen: str, moves: list[chess.Move], size: int, flip: bool, style: str = RENDER_STYLE) -> str:
+    raw = "|".join((kind, style, str(size), "b" if flip else "w", fen, " ".join(m.uci() for m in moves)))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+def _render_sync(kind: str, fen: str, moves: list[chess.Move], size: int, flip: bool) -> str:
+    with stage(f"render_{kind}"):
+        if kind == "move":
+            gif = render_move_gif(fen, moves[0], square_size=size, flip=flip)
+        else:
+            gif = render_line_gif(fen, moves, square_size=size, flip=flip)
+    with stage("asset_write"):
+        return put_asset(gif.getvalue())
+
+
+class RenderCache:
+    # GIF рисуется при первом запросе нужной ориентации и дальше
+    # отдаётся всем пользователям по ключу содержимого
+    def __init__(self, capacity: int = 4096):
+        self.capacity = capacity
+        self.hits = 0
+        self.db_hits = 0
+        self.renders = 0
+        self._keys: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    async def move_gif(self, fen: str, move: chess.Move, flip: bool, size: int = RENDER_SIZE) -> bytes:
+        return await self._get("move", fen, [move], size, flip)
+
+    async def line_gif(self, fen: str, moves: list[chess.Move], flip: bool, size: int = RENDER_SIZE) -> bytes:
+        return await self._get("line", fen, list(moves), size, flip)
+
+    async def prewarm(
+        self,
+        fen_before: str,
+        bad_move: chess.Move | None,
+        best_move: chess.Move | None,
+        cont_line: list[chess.Move],
+        flip: bool
+    ):
+        # только ориентация пользователя: другую сторону карточки никто не увидит
+        jobs = []
+        if bad_move:
+            jobs.append(self.move_gif(fen_before, bad_move, flip))
+        if best_move:
+            jobs.append(self.move_gif(fen_before, best_move, flip))
+        if cont_line:
+            board_after = chess.Board(fen_before)
+            if bad_move:
+                board_after.push(bad_move)
+            jobs.append(self.line_gif(board_after.fen(), cont_line, flip))
+        for result in await asyncio.gather(*jobs, return_exceptions=True):
+            if isinstance(result, Exception):
+                raise result
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "db_hits": self.db_hits,
+                "renders": self.renders,
+                "size": len(self._keys),
+            }
+
+    async def _get(self, kind: str, fen: str, moves: list[chess.Move], size: int, flip: bool) -> bytes:
+        key = render_key(kind, fen, moves, size, flip)
+
+        with self._lock:
+            digest = self._keys.get(key)
+            if digest is not None:
+                self._keys.move_to_end(key)
+        if digest is not None:
+            data = await asyncio.to_thread(read_asset, digest)
+            if data is not None:
+                self._count("hits")
+                return data
+
+        digest = await run_db(load_render_asset, key)
+        if digest is not None:
+            data = await asyncio.to_thread(read_asset, digest)
+            if data is not None:
+                self._remember(key, digest)
+                self._count("hits", "db_hits")
+                queue_write(touch_render_asset, key)
+                return data
+
+        # одну и ту же анимацию параллельно не рисуем: ждём первый рендер
+        fut = self._inflight.get(key)
+        if fut is None:
+            fut = self._inflight[key] = asyncio.ensure_future(self._render(key, kind, fen, moves, size, flip))
+            fut.add_done_callback(lambda _: self._inflight.pop(key, None))
+        digest = await asyncio.shield(fut)
+        data = await asyncio.to_thread(read_asset, digest)
+        if data is None:
+            raise FileNotFoundError(digest)
+        return data
+
+    async def _render(self, key: str, kind: str, fen: str, moves: list[chess.Move], size: int, flip: bool) -> str:
+        loop = asyncio.get_running_loop()
+        digest = await loop.run_in_executor(RENDER_EXECUTOR, _render_sync, kind, fen, moves, size, flip)
+        self._remember(key, digest)
+        self._count("renders")
+        queue_write(save_render_asset, key, digest)
+        return digest
+
+    def _count(self, *names: str):
+        with self._lock:
+            for name in names:
+                setattr(self, name, getattr(self, name) + 1)
+
+    def _remember(self, key: str, digest: str):
+        with self._lock:
+            self._keys[key] = digest
+            self._keys.move_to_end(key)
+            while len(self._keys) > self.capacity:
+                self._keys.popitem(last=False)
+
+
+RENDER_CACHE = RenderCache()
+
+Callback(
+    "chessbot_render_queue_depth", "Анимации, ждущие поток рендера",
+    lambda: RENDER_EXECUTOR._work_queue.qsize(),
+)
+Callback(
+    "chessbot_render_cache_total", "Запросы анимаций по источнику",
+    lambda: {k: v for k, v in RENDER_CACHE.stats().items() if k != "size"}, labels=("result",), kind="counter",
+)
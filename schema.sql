@@ -7,14 +7,18 @@ CREATE TABLE IF NOT EXISTS users (
   updated_at     TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- game_key: "lichess:<id>", "chesscom:<url>" или "sha1:<хеш PGN>"
 CREATE TABLE IF NOT EXISTS games (
   game_id      INTEGER PRIMARY KEY AUTOINCREMENT,
   chat_id      INTEGER       NOT NULL,
   source       TEXT          NOT NULL,
+  game_key     TEXT          NOT NULL,
   pgn          TEXT          NOT NULL,
+  -- цвет пользователя в партии: 'w', 'b' или '' (ника среди игроков нет)
+  user_color   TEXT,
   synced_at    TIMESTAMP     DEFAULT CURRENT_TIMESTAMP,
   FOREIGN KEY(chat_id) REFERENCES users(chat_id),
-  UNIQUE(chat_id, pgn)
+  UNIQUE(chat_id, game_key)
 );
 
 CREATE TABLE IF NOT EXISTS blunders (
@@ -25,15 +29,15 @@ CREATE TABLE IF NOT EXISTS blunders (
   detected_at       TIMESTAMP     DEFAULT CURRENT_TIMESTAMP,
   solved            INTEGER       NOT NULL DEFAULT 0,
 
+  -- сыгранный ход и контекст карточки: PGN при показе не разбирается
+  played_uci        TEXT,
+  played_san        TEXT,
+  side_to_move      TEXT,
+  opponent          TEXT,
+
   -- Новые поля:
   best_move_uci     TEXT,
   cont_line_uci     TEXT,
-  gif_error_w       BLOB,
-  gif_error_b       BLOB,
-  gif_best_w        BLOB,
-  gif_best_b        BLOB,
-  gif_cont_w        BLOB,
-  gif_cont_b        BLOB,
 
   FOREIGN KEY(game_id) REFERENCES games(game_id),
   UNIQUE(game_id, move_index)
@@ -43,3 +47,70 @@ CREATE TABLE IF NOT EXISTS blunders (
 CREATE INDEX IF NOT EXISTS idx_games_chat ON games(chat_id, synced_at DESC);
 CREATE INDEX IF NOT EXISTS idx_blunders_game ON blunders(game_id, move_index);
 CREATE INDEX IF NOT EXISTS idx_blunders_solved ON blunders(solved, detected_at DESC);
+-- постраничная выдача задач: партии пользователя по idx_games_chat, в каждой —
+-- диапазон solved = 0 AND blunder_id < курсор; индекс без game_id обходил бы
+-- нерешённые задачи всех пользователей подряд
+DROP INDEX IF EXISTS idx_blunders_unsolved;
+CREATE INDEX IF NOT EXISTS idx_blunders_page ON blunders(game_id, solved, blunder_id);
+
+CREATE TABLE IF NOT EXISTS position_evals (
+  zobrist        INTEGER   NOT NULL,
+  depth          INTEGER   NOT NULL,
+  score          INTEGER,
+  best_move_uci  TEXT,
+  pv_uci         TEXT,
+  created_at     TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY(zobrist, depth)
+);
+
+-- Отметка последней загруженной партии по каждому провайдеру (мс):
+-- Lichess — createdAt, Chess.com — end_time
+CREATE TABLE IF NOT EXISTS sync_state (
+  chat_id     INTEGER   NOT NULL,
+  provider    TEXT      NOT NULL,
+  nick        TEXT      NOT NULL,
+  last_seen   INTEGER   NOT NULL,
+  updated_at  TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY(chat_id, provider),
+  FOREIGN KEY(chat_id) REFERENCES users(chat_id)
+);
+
+-- Готовые анимации, общие для всех пользователей.
+-- render_key — sha1 от (вид, стиль, размер, разворот, FEN, ходы), asset — sha256 в assetstore
+CREATE TABLE IF NOT EXISTS render_cache (
+  render_key  TEXT      PRIMARY KEY,
+  asset       TEXT      NOT NULL,
+  created_at  TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  used_at     TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Расписание автосинхронизации (unix-секунды): переживает перезапуск,
+-- поэтому после старта пользователи не синхронизируются все разом
+CREATE TABLE IF NOT EXISTS sync_schedule (
+  chat_id         INTEGER PRIMARY KEY,
+  next_run_at     REAL    NOT NULL,
+  last_run_at     REAL,
+  last_active_at  REAL,
+  -- начало последней синхронизации, загрузившей все источники без ошибок
+  last_synced_at  REAL,
+  FOREIGN KEY(chat_id) REFERENCES users(chat_id)
+);
+CREATE INDEX IF NOT EXISTS idx_sync_schedule_due ON sync_schedule(next_run_at);
+
+-- Фоновые задания (render / engine_line / reanalysis), переживают перезапуск.
+-- Время — unix-секунды: по нему считаются повторы и возраст очереди
+CREATE TABLE IF NOT EXISTS jobs (
+  job_id        INTEGER PRIMARY KEY AUTOINCREMENT,
+  kind          TEXT      NOT NULL,
+  dedup_key     TEXT,
+  payload       TEXT      NOT NULL,
+  status        TEXT      NOT NULL DEFAULT 'pending',
+  attempts      INTEGER   NOT NULL DEFAULT 0,
+  max_attempts  INTEGER   NOT NULL DEFAULT 5,
+  last_error    TEXT,
+  created_at    REAL      NOT NULL,
+  updated_at    REAL      NOT NULL,
+  run_after     REAL      NOT NULL,
+  UNIQUE(kind, dedup_key)
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_ready ON jobs(status, run_after);
@@ -1,73 +1,246 @@
+import asyncio
+import os
 import chess
 import chess.engine
 import chess.pgn
 import io
 
+from analysisfarm import SEARCH_STATS, AnalysisFarm
+from enginepool import EnginePool
+from evalcache import PositionCache
+from metrics import Callback, stage, timed
+
 ENGINE_PATH = "D:\\ChessHelper\\stockfish\\stockfish-windows-x86-64-avx2.exe"
+# один однопоточный движок на ядро: воркеров фермы столько же, сколько движков
+ANALYSIS_WORKERS = os.cpu_count() or 2
+ENGINE_THREADS = 1
+ENGINE_HASH_MB = 64
+
+EVAL_DEPTH = 15
+LINE_DEPTH = 15
+
+# "two_pass": быстрый проход на SHALLOW_DEPTH, затем EVAL_DEPTH только
+# для ходов, чей перепад оценки близок к порогам findmove.
+# По умолчанию "full", пока evalparity.py не покажет на реальном корпусе
+# те же списки зевков, что и полный анализ
+EVAL_MODE = "full"
+SHALLOW_DEPTH = 8
+SWING_MARGIN = 120
+# оценки дальше этого — мат; на малой глубине матовым оценкам верить нельзя
+MATE_THRESHOLD = 10000
+
+POSITION_CACHE = PositionCache()
+
+_engine_pool: EnginePool | None = None
+_analysis_farm: AnalysisFarm | None = None
+
+async def get_engine_pool() -> EnginePool:
+    global _engine_pool
+    if _engine_pool is None:
+        _engine_pool = EnginePool(
+            ENGINE_PATH,
+            size=ANALYSIS_WORKERS,
+            threads=ENGINE_THREADS,
+            hash_mb=ENGINE_HASH_MB,
+        )
+    await _engine_pool.start()
+    return _engine_pool
+
+async def get_analysis_farm() -> AnalysisFarm:
+    global _analysis_farm
+    pool = await get_engine_pool()
+    if _analysis_farm is None:
+        _analysis_farm = AnalysisFarm(pool, workers=ANALYSIS_WORKERS)
+    _analysis_farm.start()
+    return _analysis_farm
+
+async def close_engine_pool():
+    global _engine_pool, _analysis_farm
+    if _analysis_farm is not None:
+        await _analysis_farm.close()
+        _analysis_farm = None
+    if _engine_pool is not None:
+        await _engine_pool.close()
+        _engine_pool = None
+
+def _pool_gauges() -> dict | None:
+    if _engine_pool is None:
+        return None
+    return {k: v for k, v in _engine_pool.stats().items() if k != "restarts"}
+
+def _pool_utilisation() -> float | None:
+    if _engine_pool is None or not _engine_pool.size:
+        return None
+    return _engine_pool.stats()["busy"] / _engine_pool.size
+
+Callback("chessbot_engine_pool", "Движки пула по состоянию", _pool_gauges, labels=("state",))
+Callback("chessbot_engine_pool_utilisation", "Доля занятых движков", _pool_utilisation)
+Callback(
+    "chessbot_engine_restarts_total", "Перезапуски упавших движков",
+    lambda: _engine_pool.stats()["restarts"] if _engine_pool else None, kind="counter",
+)
+Callback(
+    "chessbot_analysis_queue", "Очередь фермы анализа",
+    lambda: _analysis_farm.queue_depth() if _analysis_farm else None, labels=("state",),
+)
+Callback("chessbot_engine_searches_total", "Поиски движка", lambda: SEARCH_STATS["searches"], kind="counter")
+Callback("chessbot_engine_nodes_total", "Узлы, просмотренные движком", lambda: SEARCH_STATS["nodes"], kind="counter")
+Callback(
+    "chessbot_position_cache_total", "Обращения к кэшу оценок позиций",
+    lambda: {k: v for k, v in POSITION_CACHE.stats().items() if k != "size"}, labels=("result",), kind="counter",
+)
+Callback("chessbot_position_cache_size", "Позиций в кэше оценок", lambda: POSITION_CACHE.stats()["size"])
+
+async def _evaluate_positions(
+    positions: list[chess.Board],
+    idxs: list[int],
+    depth: int,
+    use_cache: bool = True,
+    owner=None
+) -> dict[int, int]:
+
+    scores = dict()
+    missing = list()
+    if use_cache:
+        cached = await POSITION_CACHE.get_many([positions[i] for i in idxs], depth)
+    else:
+        cached = [None] * len(idxs)
+    for i, entry in zip(idxs, cached):
+        if entry is not None:
+            scores[i] = entry["score"]
+        else:
+            missing.append(i)
+
+    if missing:
+        fresh = list()
+        farm = await get_analysis_farm()
+        results = await asyncio.gather(*[
+            farm.analyse(owner, positions[i], depth) for i in missing
+        ])
+        for i, lines in zip(missing, results):
+            scores[i] = lines[0]["score"] if lines else 0
+            fresh.append((positions[i], depth, scores[i], lines[0]["pv"] if lines else []))
+        if use_cache:
+            POSITION_CACHE.put_many(fresh)
+    return scores
+
+@timed("geteval")
+async def geteval(
+    strgame,
+    depth: int = EVAL_DEPTH,
+    mode: str | None = None,
+    use_cache: bool = True,
+    owner=None,
+    side: str | None = None
+):
+    # side ("w"/"b"): в two_pass углублять только ходы этой стороны,
+    # оценки вокруг ходов соперника остаются с быстрого прохода
+
+    with stage("pgn_parse"):
+        pgn = io.StringIO(strgame)
+        game = chess.pgn.read_game(pgn)
+
+        board = chess.Board()
+        positions = list()
+        for move in game.mainline_moves():
+            positions.append(board.copy())
+            board.push(move)
+
+    all_idxs = list(range(len(positions)))
+    if (mode or EVAL_MODE) == "full":
+        scores = await _evaluate_positions(positions, all_idxs, depth, use_cache, owner)
+        return [scores[i] for i in all_idxs]
+
+    evaluations = await _evaluate_positions(positions, all_idxs, min(SHALLOW_DEPTH, depth), use_cache, owner)
+    deep = set()
+    while True:
+        suspects = set()
+        for i in range(len(positions) - 1):
+            if {i, i + 1} <= deep:
+                continue
+            if side is not None and positions[i].turn != (side == "w"):
+                continue
+            mate = max(abs(evaluations[i]), abs(evaluations[i + 1])) > MATE_THRESHOLD
+            if mate or _is_blunder(evaluations[i], evaluations[i + 1], margin=SWING_MARGIN):
+                suspects.update((i, i + 1))
+        suspects -= deep
+        if not suspects:
+            break
+        evaluations.update(await _evaluate_positions(positions, sorted(suspects), depth, use_cache, owner))
+        deep |= suspects
+
+    return [evaluations[i] for i in all_idxs]
+
+def _is_blunder(evalnow, evalnext, margin=0):
 
-def geteval(strgame):
+    base_thresh = 150
+    scale_factor = 0.5
+    max_thresh = 500
 
-    engine = chess.engine.SimpleEngine.popen_uci(ENGINE_PATH)
-    pgn = io.StringIO(strgame)
-    game = chess.pgn.read_game(pgn)
+    evalafter = evalnext * (-1)
+    deltaeval = abs(evalafter - evalnow)
 
-    board = chess.Board()
-    evaluations = list()
+    if abs(evalnow) >= 750 + margin and abs(evalafter) >= 750 + margin and evalnow * evalafter > 0:
+        return False
 
-    for move in game.mainline_moves():
-        info = engine.analyse(board,limit=chess.engine.Limit(depth=15),info=chess.engine.INFO_SCORE)
-        evaluation = info["score"].pov(board.turn).score(mate_score=100000)
-        evaluations.append(evaluation)
+    if abs(evalafter) > MATE_THRESHOLD and evalnow * evalafter > 0:
+        return False
 
-        board.push(move)
-    engine.close()
-    return evaluations
+    if abs(evalnow) < base_thresh:
+        threshold = base_thresh
+    else:
+        threshold = min(max_thresh, abs(evalnow) * scale_factor + 75)
 
-def findmove(evaluations):
+    return deltaeval + margin >= threshold
 
-    base_thresh = 150
-    scale_factor = 0.5
-    max_thresh = 500
+@timed("findmove")
+def findmove(evaluations):
 
     blunders = list()
     for i in range(len(evaluations) - 1):
-        evalnow = evaluations[i]
-        evalafter = evaluations[i+1] * (-1)
-        deltaeval = abs(evalafter - evalnow)
-
-        if abs(evalnow) >= 750 and abs(evalafter) >= 750 and evalnow * evalafter > 0:
-            continue
-
-        if abs(evalafter) > 10000 and evalnow * evalafter > 0:
-            continue
-
-        if abs(evalnow) < base_thresh:
-            threshold = base_thresh
-        else:
-            threshold = min(max_thresh, abs(evalnow) * scale_factor + 75)
-
-        if deltaeval >= threshold:
+        if _is_blunder(evaluations[i], evaluations[i+1]):
             blunders.append(i)
-            print(i)
 
     return blunders
 
-def stockfish_best_move(fen, time_limit = 0.1) -> chess.Move:
+async def stockfish_principal_variation(
+    fen: str,
+    depth: int = LINE_DEPTH,
+    multipv: int = 1,
+    owner=None,
+    urgent: bool = False
+) -> list[dict]:
     board = chess.Board(fen)
 
-    with chess.engine.SimpleEngine.popen_uci(ENGINE_PATH) as engine:
-        result = engine.play(board,chess.engine.Limit(time=time_limit))
-    return result.move
+    if multipv == 1:
+        cached = await POSITION_CACHE.get(board, depth)
+        if cached is not None and cached["pv"]:
+            return [{"move": cached["best_move"], "score": cached["score"], "pv": cached["pv"]}]
 
-def evaluate_move(fen: str, move: chess.Move, depth: int = 15) -> int:
+    farm = await get_analysis_farm()
+    lines = await farm.analyse(owner, board, depth, multipv=multipv, urgent=urgent)
+
+    lines = [line for line in lines if line["pv"]]
+    if lines:
+        POSITION_CACHE.put(board, depth, lines[0]["score"], lines[0]["pv"])
+    return lines
+
+async def stockfish_best_move(fen, depth: int = LINE_DEPTH, owner=None) -> chess.Move | None:
+    lines = await stockfish_principal_variation(fen, depth=depth, owner=owner)
+    return lines[0]["move"] if lines else None
+
+async def evaluate_move(fen: str, move: chess.Move, depth: int = EVAL_DEPTH, owner=None) -> int:
 
     board = chess.Board(fen)
     board.push(move)
-    with chess.engine.SimpleEngine.popen_uci(ENGINE_PATH) as engine:
-        info = engine.analyse(
-            board,
-            limit=chess.engine.Limit(depth=depth),
-            info=chess.engine.INFO_SCORE
-        )
-    score = info["score"].pov(board.turn).score(mate_score=100000)
+
+    cached = await POSITION_CACHE.get(board, depth)
+    if cached is not None:
+        score = cached["score"]
+    else:
+        farm = await get_analysis_farm()
+        lines = await farm.analyse(owner, board, depth, urgent=True)
+        score = lines[0]["score"] if lines else None
+        if lines:
+            POSITION_CACHE.put(board, depth, score, lines[0]["pv"])
     return score if score is not None else 0
@@ -0,0 +1,107 @@
+import asyncio
+import contextlib
+import logging
+
+from connection import claim_due_syncs, get_last_synced, get_user_nicks, run_db, seed_sync_schedule
+from loadgames import chesscom_last_online, lichess_seen_at
+
+log = logging.getLogger(__name__)
+
+SYNC_INTERVAL = 8 * 3600
+# тем, кто заходил в бота за последние ACTIVE_WINDOW, — чаще
+ACTIVE_SYNC_INTERVAL = 2 * 3600
+ACTIVE_WINDOW = 3 * 24 * 3600
+JITTER = 0.1
+TICK = 30.0
+# часы провайдера и наши могут расходиться: «был на сайте» незадолго
+# до прошлой синхронизации всё равно считается поводом синхронизироваться
+PROBE_SLACK = 300.0
+
+
+async def has_new_games(chat_id: int) -> bool:
+    # профиль провайдера дешевле выгрузки партий: если игрок не заходил
+    # на сайт с начала последней успешной синхронизации, новых партий нет
+    synced_at = await run_db(get_last_synced, chat_id)
+    if synced_at is None:
+        return True
+    lichess_nick, chesscom_nick = await run_db(get_user_nicks, chat_id)
+    for nick, last_seen in ((lichess_nick, lichess_seen_at), (chesscom_nick, chesscom_last_online)):
+        if not nick:
+            continue
+        seen = await last_seen(nick)
+        if seen is None or seen >= (synced_at - PROBE_SLACK) * 1000:
+            return True
+    return False
+
+
+class SyncScheduler:
+    # Каждый пользователь синхронизируется по своему next_run_at из БД;
+    # одновременно идут не больше concurrency синхронизаций
+    def __init__(self, sync, probe, concurrency: int = 4):
+        self.sync = sync
+        self.probe = probe
+        self.concurrency = concurrency
+        self._sem = asyncio.Semaphore(concurrency)
+        self._running: set[int] = set()
+        self._tasks: set[asyncio.Task] = set()
+        self._loop_task: asyncio.Task | None = None
+        self.skipped = 0
+        self.synced = 0
+        self.failed = 0
+
+    def start(self):
+        if self._loop_task is None:
+            self._loop_task = asyncio.create_task(self._loop())
+
+    async def close(self):
+        tasks = [t for t in (self._loop_task, *self._tasks) if t is not None]
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+        self._loop_task = None
+        self._tasks.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "running": len(self._running),
+            "synced": self.synced,
+            "skipped": self.skipped,
+            "failed": self.failed,
+        }
+
+    async def _loop(self):
+        while True:
+            try:
+                await run_db(seed_sync_schedule, SYNC_INTERVAL)
+                # берём не больше, чем успеем начать: остальные подождут следующего тика
+                free = self.concurrency - len(self._running)
+                if free > 0:
+                    due = await run_db(
+                        claim_due_syncs, free, SYNC_INTERVAL, ACTIVE_SYNC_INTERVAL, ACTIVE_WINDOW, JITTER
+                    )
+                    for chat_id in due:
+                        if chat_id in self._running:
+                            continue
+                        self._running.add(chat_id)
+                        task = asyncio.create_task(self._run(chat_id))
+                        self._tasks.add(task)
+                        task.add_done_callback(self._tasks.discard)
+            except Exception:
+                log.exception("Планировщик синхронизации: ошибка тика")
+            await asyncio.sleep(TICK)
+
+    async def _run(self, chat_id: int):
+        try:
+            async with self._sem:
+                if not await self.probe(chat_id):
+                    self.skipped += 1
+                    return
+                await self.sync(chat_id)
+                self.synced += 1
+        except Exception:
+            self.failed += 1
+            log.exception("Автосинхронизация %s завершилась ошибкой", chat_id)
+        finally:
+            self._running.discard(chat_id)
@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import connection
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    # init_db читает schema.sql из текущей папки
+    monkeypatch.chdir(ROOT)
+    monkeypatch.setattr(connection, "DB_PATH", str(tmp_path / "bot.db"))
+    connection.close_db()
+    connection.init_db()
+    yield connection
+    connection.close_db()
@@ -0,0 +1,23 @@
+import json
+
+from batchanalyse import _resume_jsonl
+
+
+def test_resume_drops_partial_and_glued_lines(tmp_path):
+    path = tmp_path / "out.jsonl"
+    path.write_text(
+        json.dumps({"index": 0}) + "\n"
+        # запись, к которой приклеилась следующая после прошлого падения
+        + '{"index": 1, "bl' + json.dumps({"index": 2}) + "\n"
+        + json.dumps({"index": 3}) + "\n"
+        + '{"index": 4, "blun',
+        encoding="utf-8",
+    )
+    assert _resume_jsonl(str(path)) == {0, 3}
+    assert path.read_text(encoding="utf-8") == (
+        json.dumps({"index": 0}) + "\n" + json.dumps({"index": 3}) + "\n"
+    )
+    # дописывание после восстановления начинается с новой строки
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"index": 4}) + "\n")
+    assert _resume_jsonl(str(path)) == {0, 3, 4}
@@ -0,0 +1,133 @@
+import asyncio
+
+from jobqueue import JobQueue
+
+
+def test_handler_enqueue_on_full_queue_does_not_deadlock(db):
+    async def scenario():
+        queue = JobQueue(workers=2, max_pending=3)
+        done = []
+
+        async def first(payload):
+            # очередь полна, а обработчик ставит продолжение
+            await queue.enqueue("second", {"n": payload["n"]}, dedup_key=str(payload["n"]))
+
+        async def second(payload):
+            done.append(payload["n"])
+
+        queue.register("first", first)
+        queue.register("second", second)
+        for n in range(3):
+            await queue.enqueue("first", {"n": n}, dedup_key=str(n))
+        assert queue.snapshot()["outstanding"] == 3
+
+        await queue.start()
+        try:
+            # производитель снаружи ждёт места, но не бесконечно
+            await asyncio.wait_for(queue.enqueue("first", {"n": 3}, dedup_key="3"), 10)
+            for _ in range(200):
+                if sorted(done) == [0, 1, 2, 3]:
+                    break
+                await asyncio.sleep(0.05)
+        finally:
+            await queue.close()
+        assert sorted(done) == [0, 1, 2, 3]
+        assert queue.snapshot()["outstanding"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_oldest_pending_age_in_stats_and_metrics(db, monkeypatch):
+    monkeypatch.setenv("BOT_TOKEN", "1:test")
+    import bot
+    import metrics
+
+    async def scenario():
+        await bot.JOB_QUEUE.enqueue("render", {}, dedup_key="a")
+
+        def age_job():
+            with db.get_connection() as conn:
+                conn.execute("UPDATE jobs SET created_at = created_at - 120")
+
+        await db.run_db(age_job)
+        stats = await bot.JOB_QUEUE.stats()
+        assert 119 < stats["oldest_pending_age"] < 180
+
+        series = {}
+        for line in (await metrics.render_metrics()).splitlines():
+            if line.startswith("chessbot_jobs"):
+                name, value = line.rsplit(" ", 1)
+                series[name] = float(value)
+        # возраст — отдельная серия, а не состояние среди счётчиков заданий
+        assert 119 < series["chessbot_jobs_oldest_pending_seconds"] < 180
+        assert set(series) - {"chessbot_jobs_oldest_pending_seconds"} == {
+            'chessbot_jobs{state="outstanding"}', 'chessbot_jobs{state="running"}', 'chessbot_jobs{state="workers"}',
+        }
+
+    asyncio.run(scenario())
+
+
+def test_db_error_does_not_kill_worker(db, monkeypatch):
+    import sqlite3
+
+    import jobqueue
+
+    real_complete = jobqueue.complete_job
+    failures = []
+
+    def flaky_complete(job_id):
+        if not failures:
+            failures.append(job_id)
+            raise sqlite3.OperationalError("database is locked")
+        return real_complete(job_id)
+
+    flaky_complete.__name__ = "complete_job"
+    monkeypatch.setattr(jobqueue, "complete_job", flaky_complete)
+
+    async def scenario():
+        queue = JobQueue(workers=1)
+        done = []
+
+        async def handler(payload):
+            done.append(payload["n"])
+
+        queue.register("job", handler)
+        await queue.start()
+        try:
+            for n in range(3):
+                await queue.enqueue("job", {"n": n}, dedup_key=str(n))
+            for _ in range(200):
+                if len(done) == 3:
+                    break
+                await asyncio.sleep(0.05)
+        finally:
+            await queue.close()
+        # единственный воркер пережил сбой и доделал остальные задания
+        assert sorted(done) == [0, 1, 2]
+        assert failures
+        assert queue.snapshot()["outstanding"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_duplicate_enqueue_returns_reserved_slot(db):
+    async def scenario():
+        queue = JobQueue(workers=1, max_pending=1)
+        assert await queue.enqueue("job", {}, dedup_key="a")
+        queue.max_pending = 2
+        assert not await queue.enqueue("job", {}, dedup_key="a")
+        assert queue.snapshot()["outstanding"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_interrupted_job_uses_up_attempts(db):
+    db.enqueue_job("crash", "{}", "a", 2)
+    statuses = []
+    for _ in range(3):
+        if db.claim_job() is None:
+            break
+        # процесс упал посреди обработчика
+        db.requeue_running_jobs()
+        statuses.append({r["status"] for r in db.job_stats()})
+    assert statuses == [{"pending"}, {"failed"}]
@@ -0,0 +1,82 @@
+import asyncio
+import json
+
+from aiohttp import web
+
+import loadgames
+
+
+def test_stream_body_does_not_hold_limiter_slot(monkeypatch):
+    async def scenario():
+        release = asyncio.Event()
+
+        async def export(request):
+            resp = web.StreamResponse()
+            await resp.prepare(request)
+            await resp.write(b'{"pgn": "1. e4 *", "createdAt": 1}\n')
+            await release.wait()
+            await resp.write_eof()
+            return resp
+
+        async def profile(request):
+            return web.json_response({"seenAt": 42})
+
+        app = web.Application()
+        app.router.add_get("/api/games/user/{nick}", export)
+        app.router.add_get("/api/user/{nick}", profile)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        monkeypatch.setattr(loadgames, "LICHESS_URL", f"http://127.0.0.1:{port}")
+        monkeypatch.setitem(loadgames.RATE_LIMITS, "lichess", loadgames.RateLimiter(0.0, 1))
+        try:
+            url = f"{loadgames.LICHESS_URL}/api/games/user/a"
+            async with loadgames._request("lichess", url) as resp:
+                await resp.content.readline()
+                # выгрузка ещё читается, а профиль уже отвечает
+                seen = await asyncio.wait_for(loadgames.lichess_seen_at("a"), 5)
+                release.set()
+            assert seen == 42
+        finally:
+            await loadgames.close_session()
+            await runner.cleanup()
+
+    asyncio.run(scenario())
+
+
+def test_correspondence_mark_stops_at_oldest_ongoing_game(monkeypatch):
+    async def scenario():
+        seen = {}
+
+        async def export(request):
+            seen.update(request.query)
+            lines = [
+                {"createdAt": 1000, "status": "mate", "pgn": "1. e4 *"},
+                {"createdAt": 2000, "status": "started", "pgn": "1. d4 *"},
+                {"createdAt": 3000, "status": "resign", "pgn": "1. c4 *"},
+            ]
+            return web.Response(text="".join(json.dumps(g) + "\n" for g in lines))
+
+        app = web.Application()
+        app.router.add_get("/api/games/user/{nick}", export)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        monkeypatch.setattr(loadgames, "LICHESS_URL", f"http://127.0.0.1:{port}")
+        monkeypatch.setitem(loadgames.RATE_LIMITS, "lichess", loadgames.RateLimiter(0.0, 1))
+        try:
+            games, mark = await loadgames.fetch_lichess_correspondence("a", max_games=5, period=30, since=500)
+        finally:
+            await loadgames.close_session()
+            await runner.cleanup()
+        assert seen["perfType"] == "correspondence"
+        assert seen["ongoing"] == "true" and seen["since"] == "501"
+        # идущая партия не сохраняется, а отметка не уходит дальше её начала
+        assert [g["ts"] for g in games] == [1000, 3000]
+        assert mark == 1999
+
+    asyncio.run(scenario())
@@ -0,0 +1,28 @@
+import sqlite3
+
+import connection
+
+
+def test_gif_blob_fallback_runs_once(db):
+    conn = sqlite3.connect(connection.DB_PATH)
+    for kind in connection._ASSET_KINDS:
+        conn.execute(f"ALTER TABLE blunders ADD COLUMN gif_{kind} BLOB")
+    # индекс по колонке не даёт её удалить — как DROP COLUMN на SQLite < 3.35
+    conn.execute("CREATE INDEX idx_legacy_gif ON blunders(gif_error_w)")
+    conn.commit()
+    conn.close()
+
+    db.close_db()
+    db.init_db()
+    conn = db.get_connection()
+    cols = {c[1] for c in conn.execute("PRAGMA table_info(blunders)").fetchall()}
+    assert "gif_error_w" in cols
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == connection._GIF_BLOBS_CLEARED
+
+    # повторный старт миграцию не повторяет
+    calls = []
+    db.close_db()
+    db.get_connection().set_trace_callback(calls.append)
+    db.init_db()
+    assert any("PRAGMA user_version" in sql for sql in calls)
+    assert not any("VACUUM" in sql or "gif_error_w = NULL" in sql for sql in calls)
@@ -0,0 +1,46 @@
+import asyncio
+import time
+
+import syncscheduler
+
+
+def _probe(db, monkeypatch, seen_ms):
+    calls = []
+
+    async def seen_at(nick):
+        calls.append(nick)
+        return seen_ms
+
+    monkeypatch.setattr(syncscheduler, "lichess_seen_at", seen_at)
+    return asyncio.run(syncscheduler.has_new_games(1)), calls
+
+
+def _user_synced_at(db, synced_at):
+    db.upsert_user(1, lichess="someone")
+    db.seed_sync_schedule(3600)
+    db.mark_synced(1, synced_at)
+
+
+def test_probe_skips_user_not_seen_since_last_sync(db, monkeypatch):
+    synced_at = time.time()
+    _user_synced_at(db, synced_at)
+    # последняя партия и визит на сайт — за час до синхронизации
+    new, calls = _probe(db, monkeypatch, int((synced_at - 3600) * 1000))
+    assert calls == ["someone"]
+    assert new is False
+
+
+def test_probe_syncs_user_seen_after_last_sync(db, monkeypatch):
+    synced_at = time.time() - 3600
+    _user_synced_at(db, synced_at)
+    new, _ = _probe(db, monkeypatch, int(time.time() * 1000))
+    assert new is True
+
+
+def test_probe_syncs_after_nick_change(db, monkeypatch):
+    synced_at = time.time()
+    _user_synced_at(db, synced_at)
+    db.upsert_user(1, lichess="someone_else")
+    new, calls = _probe(db, monkeypatch, int((synced_at - 3600) * 1000))
+    assert new is True
+    assert calls == []